@@ -0,0 +1,206 @@
+import datetime
+import gzip
+import json
+import os
+import threading
+
+
+class LogArchive:
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, directory: str, columns: tuple, page_size: int = 5000):
+        """Gzipped segment files holding audit logs that left the database
+
+        Each monthly log table becomes a segment of line-delimited JSON. A
+        month exported again, e.g. after more logs were rolled into it, gets
+        another segment.
+        index.json records the rows, time range, guilds and users of every
+        segment, so a query only opens the segments that can match.
+
+        Args:
+            directory (str): [Folder the segments are written to]
+            columns (tuple): [Columns of a log, id first]
+            page_size (int, optional): [Rows read from the database at a time]. Defaults to 5000.
+        """
+
+        self.directory = directory
+        self.columns = columns
+        self.page_size = page_size
+
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, directory: str, columns: tuple) -> 'LogArchive':
+        """Returns the archive for a folder, so every export to it is serialized
+
+        Args:
+            directory (str): [Folder the segments are written to]
+            columns (tuple): [Columns of a log, id first]
+
+        Returns:
+            LogArchive: [Log archive]
+        """
+
+        with cls._shared_lock:
+            if directory not in cls._shared:
+                cls._shared[directory] = cls(directory, columns)
+
+            return cls._shared[directory]
+
+    @property
+    def index(self) -> dict:
+        """Returns the index of the segments
+
+        Returns:
+            dict: [{segment file: {'rows', 'start', 'end', 'guilds', 'users'}}]
+        """
+
+        path = os.path.join(self.directory, "index.json")
+
+        if not os.path.exists(path):
+            return {}
+
+        with open(path) as file:
+            return json.load(file)
+
+    def export(self, db, table: str) -> int:
+        """Writes a log table to a segment, then drops the table
+
+        The segment and index are complete on disk before the table is
+        dropped, so a crash part way leaves the logs in the database.
+
+        Args:
+            db (Database): [Database the table is in]
+            table (str): [Monthly log table, e.g. audit_log_2022_03]
+
+        Returns:
+            int: [Rows archived]
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        entry = {'rows': 0, 'start': None, 'end': None, 'guilds': set(), 'users': set()}
+        select = ", ".join(self.columns)
+
+        with self._lock:
+            name = self._segment_name(table)
+            path = os.path.join(self.directory, name)
+
+            # Written under a temporary name so a partial segment is never read
+            with gzip.open(path + ".tmp", "wt", encoding="utf-8") as file:
+                last_id = 0
+
+                while True:
+                    rows = db.fetchall(
+                        f"SELECT {select} FROM {table} WHERE id > %s ORDER BY id LIMIT %s",
+                        (last_id, self.page_size))
+
+                    for row in rows:
+                        log = dict(zip(self.columns, row))
+
+                        file.write(json.dumps(log, default=_encode) + "\n")
+
+                        entry['rows'] += 1
+                        entry['guilds'].add(log['guild_id'])
+                        entry['users'].add(log['user_id'])
+
+                        time = log['time'].isoformat()
+                        if entry['start'] is None or time < entry['start']:
+                            entry['start'] = time
+                        if entry['end'] is None or time > entry['end']:
+                            entry['end'] = time
+
+                    if len(rows) < self.page_size:
+                        break
+
+                    last_id = rows[-1][0]
+
+            os.replace(path + ".tmp", path)
+
+            entry['guilds'] = sorted(entry['guilds'], key=str)
+            entry['users'] = sorted(entry['users'], key=str)
+
+            index = self.index
+            index[name] = entry
+            self._write_index(index)
+
+        db.execute(f"DROP TABLE {table}")
+
+        return entry['rows']
+
+    def query(self, guild: int = None, user: int = None, channel: int = None, action: str = None,
+              start: datetime.datetime = None, end: datetime.datetime = None):
+        """Yields archived logs, oldest segment first
+
+        Args:
+            guild (int, optional): [The guild_id to filter by]. Defaults to None.
+            user (int, optional): [The user_id to filter by]. Defaults to None.
+            channel (int, optional): [The channel_id to filter by]. Defaults to None.
+            action (str, optional): [The action to filter by]. Defaults to None.
+            start (datetime.datetime, optional): [Earliest time]. Defaults to None.
+            end (datetime.datetime, optional): [Time to stop before]. Defaults to None.
+
+        Yields:
+            dict: [Columns of each matching log]
+        """
+
+        for name, entry in sorted(self.index.items(), key=lambda item: item[1]['start'] or ""):
+            # The index rules out segments without reading them
+            if guild is not None and guild not in entry['guilds']:
+                continue
+            if user is not None and user not in entry['users']:
+                continue
+            if start is not None and entry['end'] is not None and entry['end'] < start.isoformat():
+                continue
+            if end is not None and entry['start'] is not None and entry['start'] >= end.isoformat():
+                continue
+
+            with gzip.open(os.path.join(self.directory, name), "rt", encoding="utf-8") as file:
+                for line in file:
+                    log = json.loads(line)
+                    log['time'] = datetime.datetime.fromisoformat(log['time'])
+
+                    if guild is not None and log['guild_id'] != guild:
+                        continue
+                    if user is not None and log['user_id'] != user:
+                        continue
+                    if channel is not None and log['channel_id'] != channel:
+                        continue
+                    if action is not None and log['action'] != action:
+                        continue
+                    if start is not None and log['time'] < start:
+                        continue
+                    if end is not None and log['time'] >= end:
+                        continue
+
+                    yield log
+
+    def _segment_name(self, table: str) -> str:
+        # Earlier segments of the month are kept alongside the new one
+        name = f"{table}.jsonl.gz"
+        part = 1
+
+        while os.path.exists(os.path.join(self.directory, name)):
+            name = f"{table}.{part}.jsonl.gz"
+            part += 1
+
+        return name
+
+    def _write_index(self, index: dict):
+        path = os.path.join(self.directory, "index.json")
+
+        with open(path + ".tmp", "w") as file:
+            json.dump(index, file)
+
+        os.replace(path + ".tmp", path)
+
+
+def _encode(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+
+    return str(value)
@@ -0,0 +1,360 @@
+import datetime
+import os
+import re
+import sqlite3
+
+
+class Backend:
+    """A database server and the SQL it speaks
+
+    Queries throughout the bot are written for MySQL with %s placeholders.
+    A backend opens connections and rewrites the few statements that differ
+    between servers.
+    """
+
+    name = None
+
+    # Column definition of an auto incrementing id
+    id_column = None
+
+    # Starts with no tables, so the schema is created on connect
+    embedded = False
+
+    def __init__(self, max_size: int = 5):
+        self.max_size = max_size
+
+    def connect(self):
+        """Returns a new connection"""
+
+        raise NotImplementedError
+
+    def check(self, connection):
+        """Raises if a connection is no longer usable"""
+
+        raise NotImplementedError
+
+    def cursor(self, connection):
+        """Returns a cursor whose results are read before the next query"""
+
+        raise NotImplementedError
+
+    def begin(self, connection):
+        """Starts a transaction on a connection"""
+
+        raise NotImplementedError
+
+    def upsert(self, table: str, columns: tuple, key: tuple, update=(), returning: bool = False) -> str:
+        """Returns an insert that updates the existing row on a duplicate key
+
+        Args:
+            table (str): [Table to insert into]
+            columns (tuple): [Columns given a value, in parameter order]
+            key (tuple): [Columns of the unique key that may clash]
+            update (tuple or dict, optional): [Columns set from the new row, or
+                {column: expression} where {new} is the new value]. Defaults to ().
+            returning (bool, optional): [Make the statement report the row id]. Defaults to False.
+
+        Returns:
+            str: [SQL statement]
+        """
+
+        raise NotImplementedError
+
+    def returns_id(self) -> bool:
+        """Returns if upserts made with returning report the id as a result row
+        rather than as lastrowid"""
+
+        return False
+
+    def tables(self, prefix: str) -> str:
+        """Returns a query for the names of tables starting with a prefix"""
+
+        raise NotImplementedError
+
+    def create_table_like(self, cursor, table: str, source: str):
+        """Creates an empty table with the columns of another, if it doesn't exist"""
+
+        raise NotImplementedError
+
+    def drop_index(self, table: str, name: str) -> str:
+        """Returns a statement dropping an index of a table"""
+
+        raise NotImplementedError
+
+    def indexes(self, cursor, table: str) -> list:
+        """Returns the indexes of a table, including unique keys
+
+        Returns:
+            list: [(name, columns tuple, unique) of each index]
+        """
+
+        raise NotImplementedError
+
+    @staticmethod
+    def _updates(update) -> dict:
+        if isinstance(update, dict):
+            return update
+
+        return {column: "{new}" for column in update}
+
+
+class MySQLBackend(Backend):
+    name = 'mysql'
+    id_column = "id INT AUTO_INCREMENT PRIMARY KEY"
+
+    def __init__(self, host: str = None, user: str = None, password: str = None,
+                 database: str = None, max_size: int = 5):
+        """MySQL server, reached over the network
+
+        Args:
+            host (str, optional): [Server address]. Defaults to None.
+            user (str, optional): [User to log in as]. Defaults to None.
+            password (str, optional): [Password of the user]. Defaults to None.
+            database (str, optional): [Database to use]. Defaults to None.
+            max_size (int, optional): [Most connections open at once]. Defaults to 5.
+        """
+
+        super().__init__(max_size)
+
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+
+    def connect(self):
+        import mysql.connector
+
+        # Each statement commits on its own unless it is part of a transaction
+        return mysql.connector.connect(
+            host=self.host,
+            user=self.user,
+            passwd=self.password,
+            database=self.database,
+            autocommit=True,
+        )
+
+    def check(self, connection):
+        connection.ping(reconnect=True, attempts=1, delay=0)
+
+    def cursor(self, connection):
+        return connection.cursor(buffered=True)
+
+    def begin(self, connection):
+        connection.start_transaction()
+
+    def upsert(self, table: str, columns: tuple, key: tuple, update=(), returning: bool = False) -> str:
+        values = ", ".join(["%s"] * len(columns))
+
+        assignments = []
+
+        # LAST_INSERT_ID(id) makes an existing row report its id as well
+        if returning:
+            assignments.append("id = LAST_INSERT_ID(id)")
+
+        for column, expression in self._updates(update).items():
+            assignments.append(f"{column} = {expression.format(new=f'VALUES({column})')}")
+
+        # Leave an existing row as it is
+        if not assignments:
+            assignments.append(f"{key[0]} = {key[0]}")
+
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({values}) "
+                f"ON DUPLICATE KEY UPDATE {', '.join(assignments)}")
+
+    def tables(self, prefix: str) -> str:
+        return f"SHOW TABLES LIKE '{_escape_like(prefix)}%'"
+
+    def create_table_like(self, cursor, table: str, source: str):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} LIKE {source}")
+
+    def drop_index(self, table: str, name: str) -> str:
+        return f"DROP INDEX {name} ON {table}"
+
+    def indexes(self, cursor, table: str) -> list:
+        cursor.execute(f"SHOW INDEX FROM {table}")
+
+        indexes = {}  # name: [unique, {position: column}]
+
+        for row in cursor.fetchall():
+            non_unique, name, position, column = row[1:5]
+            index = indexes.setdefault(name, [not non_unique, {}])
+            index[1][position] = column
+
+        return [(name, tuple(columns[position] for position in sorted(columns)), unique)
+                for name, (unique, columns) in indexes.items()]
+
+
+class SQLiteBackend(Backend):
+    name = 'sqlite'
+    id_column = "id INTEGER PRIMARY KEY AUTOINCREMENT"
+    embedded = True
+
+    def __init__(self, path: str = "jerald.db", max_size: int = 5, timeout: float = 10):
+        """SQLite database file in WAL mode, so readers never wait on the writer
+
+        Args:
+            path (str, optional): [Database file]. Defaults to "jerald.db".
+            max_size (int, optional): [Most connections open at once]. Defaults to 5.
+            timeout (float, optional): [Seconds to wait for another writer]. Defaults to 10.
+        """
+
+        super().__init__(max_size)
+
+        self.path = path
+        self.timeout = timeout
+
+    def connect(self):
+        # Statements commit on their own unless begin was called, like MySQL autocommit
+        connection = sqlite3.connect(
+            self.path, timeout=self.timeout, isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+
+        return connection
+
+    def check(self, connection):
+        connection.execute("SELECT 1")
+
+    def cursor(self, connection):
+        return _SQLiteCursor(connection.cursor())
+
+    def begin(self, connection):
+        connection.execute("BEGIN")
+
+    def upsert(self, table: str, columns: tuple, key: tuple, update=(), returning: bool = False) -> str:
+        values = ", ".join(["%s"] * len(columns))
+
+        assignments = [f"{column} = {expression.format(new=f'excluded.{column}')}"
+                       for column, expression in self._updates(update).items()]
+
+        # DO NOTHING wouldn't return the existing row
+        if not assignments:
+            assignments.append(f"{key[0]} = excluded.{key[0]}")
+
+        query = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({values}) "
+                 f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET {', '.join(assignments)}")
+
+        if returning:
+            query += " RETURNING id"
+
+        return query
+
+    def returns_id(self) -> bool:
+        return True
+
+    def tables(self, prefix: str) -> str:
+        return ("SELECT name FROM sqlite_master WHERE type = 'table' "
+                f"AND name LIKE '{_escape_like(prefix)}%' ESCAPE '\\'")
+
+    def create_table_like(self, cursor, table: str, source: str):
+        # CREATE TABLE AS loses the declared types, which datetimes are read back by
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", (source,))
+        sql = cursor.fetchone()[0]
+
+        cursor.execute(_CREATE_TABLE.sub(f"CREATE TABLE IF NOT EXISTS {table}", sql, count=1))
+
+    def drop_index(self, table: str, name: str) -> str:
+        return f"DROP INDEX {name}"
+
+    def indexes(self, cursor, table: str) -> list:
+        cursor.execute(f"PRAGMA index_list({table})")
+
+        indexes = []
+
+        for row in cursor.fetchall():
+            name, unique = row[1], bool(row[2])
+
+            cursor.execute(f"PRAGMA index_info({name})")
+            columns = tuple(column for _, _, column in sorted(cursor.fetchall()))
+
+            indexes.append((name, columns, unique))
+
+        return indexes
+
+
+class MemoryBackend(SQLiteBackend):
+    name = 'memory'
+
+    def __init__(self):
+        """SQLite database held in memory, for tests, benchmarks and throwaway
+        shards. Everything is lost when the bot stops.
+
+        Connections share one named in-memory database, which is kept alive
+        by a connection held for as long as the backend exists, so the pool
+        can close and reopen connections without losing data. Only one is
+        used at a time, as shared cache tables fail rather than wait when
+        another connection is writing.
+        """
+
+        super().__init__(path=f"file:jerald-{id(self)}?mode=memory&cache=shared", max_size=1)
+
+        # The database is freed once its last connection closes
+        self._anchor = self.connect()
+
+    def connect(self):
+        return sqlite3.connect(
+            self.path, uri=True, isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+
+
+class _SQLiteCursor:
+    """Cursor that accepts the %s placeholders used by MySQL queries"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query: str, params=()):
+        return self._cursor.execute(_translate(query), tuple(params))
+
+    def executemany(self, query: str, seq_params):
+        return self._cursor.executemany(_translate(query), [tuple(params) for params in seq_params])
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def from_env() -> Backend:
+    """Returns the backend chosen by DB_BACKEND: mysql (the default), sqlite or memory
+
+    Returns:
+        Backend: [Configured backend]
+    """
+
+    name = os.getenv("DB_BACKEND", "mysql").lower()
+    max_size = int(os.getenv("DB_POOL_MAX", 5))
+
+    if name == "mysql":
+        return MySQLBackend(
+            host=os.getenv("DB_HOST"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            database=os.getenv("DB_NAME"),
+            max_size=max_size,
+        )
+
+    if name == "sqlite":
+        return SQLiteBackend(path=os.getenv("DB_PATH", "jerald.db"), max_size=max_size)
+
+    if name == "memory":
+        return MemoryBackend()
+
+    raise ValueError(f"Unknown DB_BACKEND {name!r}, expected mysql, sqlite or memory")
+
+
+_CREATE_TABLE = re.compile(r"^CREATE TABLE (IF NOT EXISTS )?\S+", re.IGNORECASE)
+
+
+def _translate(query: str) -> str:
+    return query.replace("%s", "?")
+
+
+def _escape_like(prefix: str) -> str:
+    return prefix.replace("\\", "\\\\").replace("_", "\\_").replace("%", "\\%")
+
+
+# Datetimes are stored as ISO text and read back as datetimes
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter(
+    "DATETIME", lambda value: datetime.datetime.fromisoformat(value.decode()))
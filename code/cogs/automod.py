@@ -8,76 +8,37 @@ import asyncio
 
 from exceptions import *
 from data import Data
+from spam import SpamTracker
+import metrics
 
 from .logging import Logging
-data = Data()  # Connect to database
+data = Data()  # Uses the shared connection pool
+
+BULK_DELETE_LIMIT = 100  # Most messages discord deletes in one request
+DELETE_CONCURRENCY = 5  # Single deletes in flight when bulk deleting fails
 
 
 class AutoMod(commands.Cog):
     def __init__(self, client):
         self.client = client
 
+        # Recent messages per user for anti-spam
+        self.spam = SpamTracker(window=15)
+
     @commands.Cog.listener()
-    async def on_message(self, message):
+    async def on_message_context(self, context):
         """Monitors messages and checks if moderation is needed"""
-        import re
         import datetime
 
-        # Fetches the required classes from database
-        try:
-            user = data.get_user(message.author.id)
-        except EntryNotFound:
-            user = data.add_user(
-                message.author.id, message.author.name, message.author.discriminator)
+        message = context.message
 
-        try:
-            guild = data.get_guild(message.guild.id)
-        except EntryNotFound:
-            guild = data.add_guild(message.guild.id, message.guild.name)
+        # The settings come from the cached snapshot, so this never waits on the database
+        result = AutoMod.check_message(context)
 
-        try:
-            channel = guild.get_channel(message.channel.id)
-        except EntryNotFound:
-            channel = guild.add_channel(
-                message.channel.id, message.channel.name)
-
-        # Check if message violates any rules
-        if not guild.auto_mod.enabled:
+        if result is None:
             return
 
-        consequnce = None
-        timeout_time = None
-
-        for rule in guild.auto_mod.custom_config:
-            if rule.type == "word":
-                if rule.value in message.content.lower().split():
-                    # Set to the highest consequence
-                    if consequnce is None:
-                        consequnce = rule.consequence
-                    elif rule.consequence == "ban":
-                        consequnce = rule.consequence
-                    elif consequnce != "ban" and rule.consequence == "kick":
-                        consequnce = rule.consequence
-                    elif consequnce != "kick" and rule.consequence == "timeout":
-                        consequnce = rule.consequence
-                        timeout_time = rule.timeout_time
-                    elif consequnce != "timeout" and rule.consequence == "delete":
-                        consequnce = rule.consequence
-
-            elif rule.type == "regex":
-                if re.search(rule.value, message.content):
-                    # Set to the highest consequence
-                    if consequnce is None:
-                        consequnce = rule.consequence
-                    elif rule.consequence == "ban":
-                        consequnce = rule.consequence
-                    elif consequnce != "ban" and rule.consequence == "kick":
-                        consequnce = rule.consequence
-                    elif consequnce != "kick" and rule.consequence == "timeout":
-                        consequnce = rule.consequence
-                        timeout_time = rule.timeout_time
-                    elif consequnce != "timeout" and rule.consequence == "delete":
-                        consequnce = rule.consequence
+        user, guild, consequnce, timeout_time, anti_spam = result
 
         # If there is a consequnce, do the action
         if consequnce is not None:
@@ -88,45 +49,111 @@ class AutoMod(commands.Cog):
             elif consequnce == "timeout":
                 await message.author.timeout_for(datetime.timedelta(minutes=timeout_time))
 
-            message.delete()
+            await message.delete()
 
-            # Add the log
+            metrics.AUTOMOD_ACTIONS.inc(consequence=consequnce)
 
-            data.add_log(
+            # Add the log
+            await data.run(
+                data.add_log,
                 action="AutoMod Action",
                 user_id=user.id,
                 guild_id=guild.id,
                 extra=f"Action: {consequnce}",
             )
 
-        if guild.auto_mod.anti_spam:
+        # Recent messages are tracked in memory, so this never waits on the database
+        spam = self.spam.add(
+            message.guild.id, message.author.id, message.channel.id,
+            message.id, message.content, anti_spam)
 
-            # Refresh the database
-            guild.auto_mod.anti_spam = guild.auto_mod.anti_spam
+        if spam:
+            # Delete all spam messages sent by the user
+            await self.delete_messages(spam)
 
-            # Get logs
-            logs = user.get_logs(
-                limit=guild.auto_mod.anti_spam,
-                time=datetime.datetime.now() - datetime.timedelta(seconds=15),
-                guild=guild.id,
-                action="Message"
-            )
+            metrics.AUTOMOD_ACTIONS.inc(consequence="spam")
 
-            # Check if the user has sent the same message over and over
-            if len(logs) == guild.auto_mod.anti_spam and len({log.message_text for log in logs}) == 1:
-                # Delete all spam messages sent by the user
-                for log in logs:
+            # Timeout the user
+            try:
+                await message.author.timeout_for(datetime.timedelta(minutes=10), reason="Spamming")
+            except Forbidden:
+                pass
+
+    async def delete_messages(self, messages: list):
+        """Deletes messages by id, in bulk where discord allows it
+
+        Args:
+            messages (list): [(channel id, message id) of each message]
+        """
+        by_channel = {}
+        for channel_id, message_id in messages:
+            by_channel.setdefault(channel_id, []).append(message_id)
+
+        deletes = []
+        for channel_id, message_ids in by_channel.items():
+            channel = self.client.get_channel(channel_id)
+            if channel is not None:
+                deletes.append(self._delete_channel_messages(channel, message_ids))
+
+        # Each channel is cleaned up at the same time
+        await asyncio.gather(*deletes)
+
+    async def _delete_channel_messages(self, channel, message_ids: list):
+        # Bulk deletes take at most 100 messages
+        for i in range(0, len(message_ids), BULK_DELETE_LIMIT):
+            chunk = message_ids[i:i + BULK_DELETE_LIMIT]
+
+            try:
+                await channel.delete_messages([discord.Object(id=message_id) for message_id in chunk])
+                continue
+            except Forbidden:
+                return
+            except discord.HTTPException:
+                pass  # e.g. a message is already gone or too old to bulk delete
+
+            # Fall back to deleting each message, a few at a time
+            semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+            async def delete(message_id):
+                async with semaphore:
                     try:
-                        message = await message.channel.fetch_message(log.message_id)
-                        await message.delete()
+                        await channel.get_partial_message(message_id).delete()
                     except discord.NotFound:
                         pass
 
-                # Timeout the user
-                try:
-                    await message.author.timeout_for(datetime.timedelta(minutes=10), reason="Spamming")
-                except Forbidden:
-                    pass
+            await asyncio.gather(*(delete(message_id) for message_id in chunk))
+
+    @staticmethod
+    def check_message(context):
+        """Checks a message against the AutoMod config of its guild
+
+        Args:
+            context (MessageContext): [Records of the message]
+
+        Returns:
+            tuple: [(User, Guild, consequence, timeout time, anti-spam threshold)
+                    or None if AutoMod is disabled]
+        """
+        user, guild, message = context.user, context.guild, context.message
+        config = context.config
+
+        # Check if message violates any rules
+        if not config.enabled:
+            return None
+
+        consequnce = None
+        timeout_time = None
+
+        # The most severe rule broken decides the consequence
+        rule = config.rule_set.match(message.content)
+
+        if rule is not None:
+            consequnce = rule.consequence
+
+            if consequnce == "timeout":
+                timeout_time = rule.timeout_time
+
+        return user, guild, consequnce, timeout_time, config.anti_spam
 
     automod = SlashCommandGroup(
         "automod", "AutoMod commands", guild_ids=data.enabled_slash)
@@ -136,9 +163,10 @@ class AutoMod(commands.Cog):
         """
         Enable AutoMod in this server
         """
-        guild_data = data.get_guild(ctx.guild.id)
+        guild_data = await data.aio.get_guild(ctx.guild.id)
+        auto_mod = await guild_data.auto_mod
 
-        if guild_data.auto_mod.enabled:
+        if await auto_mod.enabled:
             response = discord.Embed(
                 title="AutoMod is already enabled",
                 description="AutoMod is already enabled in this server",
@@ -150,7 +178,7 @@ class AutoMod(commands.Cog):
             return await Logging.log_command(ctx, action='Command',
                                              extra=f"{ctx.author.name} tried to enable AutoMod")
 
-        guild_data.auto_mod.enabled = True
+        await auto_mod.set('enabled', True)
 
         response = discord.Embed(
             title='AutoMod Enabled',
@@ -166,9 +194,10 @@ class AutoMod(commands.Cog):
         """
         Disable AutoMod in this server
         """
-        guild_data = data.get_guild(ctx.guild.id)
+        guild_data = await data.aio.get_guild(ctx.guild.id)
+        auto_mod = await guild_data.auto_mod
 
-        if not guild_data.auto_mod.enabled:
+        if not await auto_mod.enabled:
             response = discord.Embed(
                 title="AutoMod is already disabled",
                 description="AutoMod is already disabled in this server",
@@ -180,7 +209,7 @@ class AutoMod(commands.Cog):
             return await Logging.log_command(ctx, action='Command',
                                              extra=f"{ctx.author.name} tried to disable AutoMod")
 
-        guild_data.auto_mod.enabled = False
+        await auto_mod.set('enabled', False)
 
         response = discord.Embed(
             title='AutoMod Disabled',
@@ -194,7 +223,8 @@ class AutoMod(commands.Cog):
     @ automod.command()
     async def anti_spam(self, ctx, threshold: Option(int, "Threshold for spam (0 to disable)", required=True, default=3)):
         """Sets the threshold for spam"""
-        guild_data = data.get_guild(ctx.guild.id)
+        guild_data = await data.aio.get_guild(ctx.guild.id)
+        auto_mod = await guild_data.auto_mod
 
         if threshold < 0:
             response = discord.Embed(
@@ -209,7 +239,7 @@ class AutoMod(commands.Cog):
                                              extra=f"{ctx.author.name} tried to set an invalid threshold")
 
         elif threshold == 0:
-            guild_data.auto_mod.anti_spam = threshold
+            await auto_mod.set('anti_spam', threshold)
 
             response = discord.Embed(
                 title="Anti-Spam Disabled",
@@ -220,7 +250,7 @@ class AutoMod(commands.Cog):
 
             return await Logging.log_command(ctx, action='Command', extra=f"{ctx.author.name} disabled anti-spam")
 
-        guild_data.auto_mod.anti_spam = threshold
+        await auto_mod.set('anti_spam', threshold)
 
         response = discord.Embed(
             title='Threshold Set',
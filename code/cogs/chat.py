@@ -7,40 +7,39 @@ from discord.commands import permission
 
 from exceptions import *
 from data import Data
+from responders import RESPONDERS, ResponderSet
 
 from .logging import Logging
-data = Data()  # Connect to database
+data = Data()  # Uses the shared connection pool
 
 
 class Chat(commands.Cog):
     def __init__(self, client):
         self.client = client
 
+        # Every responder compiled into one pattern
+        self.responders = ResponderSet(RESPONDERS)
+
+    async def cog_load(self):
+        # Muted channels are checked from memory on every message
+        await data.run(data.load_muted_channels)
+
     @commands.Cog.listener()
-    async def on_message(self, message):
-        import re
+    async def on_message_context(self, context):
+        message = context.message
 
         if message.author.bot:
             return
 
         # check if the channel is muted
-        if data.get_guild(message.guild.id).get_channel(message.channel.id).muted_events:
+        if context.muted:
             return
 
-        # if the message contains 'hi', say 'hi'
-        if re.search(r"hi", message.content):
-            await message.channel.send('hi')
+        # One scan of the message finds the responder that replies
+        reply = self.responders.reply(message.content, message.author.mention)
 
-        # if message has I'm followed by a sentence, say "Hi <sentence>, I'm Jerald"
-        if re.search(r"\bi'?m ([\s\w]+)\.?", message.content, re.IGNORECASE):
-            sentence = re.search(
-                r"\bi'?m ([\s\w]+)\.?", message.content, re.IGNORECASE).group(1)
-            await message.channel.send(f"Hi {sentence}, I'm Jerald")
-
-        # if the message is all caps
-        if re.search(r"^[A-Z\s'!.?]+$", message.content):
-            await message.channel.send(
-                f"{message.author.mention} keep your voice down!")
+        if reply is not None:
+            await message.channel.send(reply)
 
     @slash_command(guild_ids=data.enabled_slash, name='mute_channel', description='Stop jerald from talking in the specified channel')
     async def mute_channel(
@@ -56,22 +55,9 @@ class Chat(commands.Cog):
         # get the channel
         channel = ctx.channel if channel is None else channel
 
-        # get the guild
-        guild_data = data.get_guild(ctx.guild.id)
-
         if all:
-            channels_muted = []
-            for channel in ctx.guild.channels:
-                try:
-                    channel_data = guild_data.get_channel(channel.id)
-                except EntryNotFound:
-                    channel_data = guild_data.add_channel(
-                        channel.id, channel.name)  # add the channel to the database
-
-                if channel_data.muted_events == False:
-                    channel_data.muted_events = True
-                    # add channel to list of muted channels
-                    channels_muted.append(channel)
+            channels_muted = await data.run(
+                Chat.set_muted, ctx.guild, ctx.guild.channels, True)
 
             # Mention each channel
             channels_muted = [c.mention for c in channels_muted]
@@ -93,14 +79,8 @@ class Chat(commands.Cog):
 
             return
 
-        # get the channel or add it if it doesn't exist
-        try:
-            channel_data = guild_data.get_channel(channel.id)
-        except EntryNotFound:
-            channel_data = guild_data.add_channel(channel.id, channel.name)
-
-        # Check if the channel is already muted
-        if channel_data.muted_events:
+        # mute the channel if it isn't already
+        if not await data.run(Chat.set_muted, ctx.guild, [channel], True):
             response = discord.Embed(
                 title="Channel already muted",
                 description=f"{channel.mention} is already muted",
@@ -114,9 +94,6 @@ class Chat(commands.Cog):
 
             return
 
-        # mute the channel
-        channel_data.muted_events = True
-
         # send a response
         response = discord.Embed(
             title="Channel Muted",
@@ -145,24 +122,10 @@ class Chat(commands.Cog):
         # get the channel
         channel = ctx.channel if channel is None else channel
 
-        # get the guild
-        guild_data = data.get_guild(ctx.guild.id)
-
         if all:
             # unmute all channels
-            channels_unmuted = []
-            for channel in ctx.guild.channels:
-                try:
-                    channel_data = guild_data.get_channel(channel.id)
-                except EntryNotFound:
-                    # add the channel if it doesn't exist
-                    channel_data = guild_data.add_channel(
-                        channel.id, channel.name)
-
-                if channel_data.muted_events:  # if the channel is muted
-                    channel_data.muted_events = False
-                    # add each channel unmuted to the list
-                    channels_unmuted.append(channel)
+            channels_unmuted = await data.run(
+                Chat.set_muted, ctx.guild, ctx.guild.channels, False)
 
             # Mention each channel
             channels_unmuted = [c.mention for c in channels_unmuted]
@@ -184,14 +147,8 @@ class Chat(commands.Cog):
 
             return
 
-        # get the channel or add it if it doesn't exist
-        try:
-            channel_data = guild_data.get_channel(channel.id)
-        except EntryNotFound:
-            channel_data = guild_data.add_channel(channel.id, channel.name)
-
-        # Check if the channel is already unmuted
-        if channel_data.muted_events == False:
+        # unmute the channel if it isn't already
+        if not await data.run(Chat.set_muted, ctx.guild, [channel], False):
             response = discord.Embed(
                 title="Channel Unmuted",
                 description=f"{channel.mention} is already unmuted",
@@ -205,9 +162,6 @@ class Chat(commands.Cog):
 
             return
 
-        # unmute the channel
-        channel_data.muted_events = False
-
         # send a response
         response = discord.Embed(
             title="Channel Unmuted",
@@ -222,6 +176,26 @@ class Chat(commands.Cog):
 
         return
 
+    @staticmethod
+    def set_muted(guild, channels, muted: bool) -> list:
+        """Sets the muted state of channels, blocks so it should be run with data.run
+
+        Args:
+            guild (discord.Guild): [Guild the channels are in]
+            channels (list): [discord channels to update]
+            muted (bool): [Whether the channels should be muted]
+
+        Returns:
+            list: [discord channels that changed]
+        """
+        guild_data = data.get_or_create_guild(guild.id, guild.name)
+
+        # Every channel is updated in a few statements
+        changed = set(guild_data.set_channels_muted(
+            [(channel.id, channel.name) for channel in channels], muted))
+
+        return [channel for channel in channels if channel.id in changed]
+
 
 def setup(client):
     client.add_cog(Chat(client))
@@ -4,7 +4,7 @@ from discord.ext import commands
 from discord.commands import slash_command, Option
 
 from data import Data
-data = Data()
+data = Data()  # Uses the shared connection pool
 
 
 class Games(commands.Cog):
@@ -24,19 +24,15 @@ class Games(commands.Cog):
         discord_user = ctx.author if user is None else user
 
         # convert to custom user object
-        try:
-            user = data.get_user(
-                ctx.author.id) if user is None else data.get_user(user.id)
-        except:
-            user = data.add_user(
-                ctx.author.id, ctx.author.name, ctx.author.discriminator) if user is None else data.add_user(user.id, user.name, user.discriminator)
+        user = await data.aio.get_or_create_user(
+            discord_user.id, discord_user.name, discord_user.discriminator)
 
         # seed the random number generator with the user's id
         random.seed(user.id)
 
-        if user.rigged:
+        if await user.rigged:
             ppsize = random.randint(0, 2)
-        elif user.goated:
+        elif await user.goated:
             ppsize = random.randint(13, 15)
         else:
             ppsize = random.randint(0, 15)
@@ -51,7 +47,7 @@ class Games(commands.Cog):
         response = await ctx.respond(embed=response)
 
         await Logging.log_command(ctx, action='Command',
-                                  extra=f"PPsize for user: {user.name}")
+                                  extra=f"PPsize for user: {await user.name}")
 
         return
 
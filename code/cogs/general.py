@@ -7,7 +7,7 @@ from discord.commands import slash_command, Option
 from .logging import Logging
 
 from data import Data
-data = Data()
+data = Data()  # Uses the shared connection pool
 
 
 class General(commands.Cog):
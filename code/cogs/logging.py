@@ -5,7 +5,7 @@ from discord.commands import slash_command, Option
 from discord.commands import Option
 
 from data import Data
-data = Data()
+data = Data()  # Uses the shared connection pool
 
 
 class Logging(commands.Cog):
@@ -13,63 +13,26 @@ class Logging(commands.Cog):
         self.client = client
 
     @commands.Cog.listener()
-    async def on_message(self, message):
+    async def on_message_context(self, context):
         """On message event log message data"""
-        # Fetches the required classes from database
-        try:
-            user = data.get_user(message.author.id)
-        except EntryNotFound:
-            user = data.add_user(
-                message.author.id, message.author.name, message.author.discriminator)
-
-        try:
-            guild = data.get_guild(message.guild.id)
-        except EntryNotFound:
-            guild = data.add_guild(message.guild.id, message.guild.name)
-
-        try:
-            channel = guild.get_channel(message.channel.id)
-        except EntryNotFound:
-            channel = guild.add_channel(
-                message.channel.id, message.channel.name)
-
-        # Add the log
-        data.add_log(
+        await data.run(
+            data.add_log,
             action="Message",
-            user_id=user.id,
-            guild_id=guild.id,
-            channel_id=channel.id,
-            message_id=message.id,
-            message_text=message.content
+            user_id=context.user.id,
+            guild_id=context.guild.id,
+            channel_id=context.channel.id,
+            message_id=context.message.id,
+            message_text=context.message.content
         )
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
         """On message edit event log new message data"""
-        # Fetches the required classes from database
-        try:
-            user = data.get_user(after.author.id)
-        except EntryNotFound:
-            user = data.add_user(
-                after.author.id, after.author.name, after.author.discriminator)
-
-        try:
-            guild = data.get_guild(after.guild.id)
-        except EntryNotFound:
-            guild = data.add_guild(after.guild.id, after.guild.name)
-
-        try:
-            channel = guild.get_channel(after.channel.id)
-        except EntryNotFound:
-            channel = guild.add_channel(after.channel.id, after.channel.name)
-
-        # Add the log
-        data.add_log(
+        await data.run(
+            Logging.add_log,
+            after.author, after.guild, after.channel,
             action="Message Edit",
             extra=f"Before: {before.content}",
-            user_id=user.id,
-            guild_id=guild.id,
-            channel_id=channel.id,
             message_id=after.id,
             message_text=after.content
         )
@@ -77,54 +40,52 @@ class Logging(commands.Cog):
     @commands.Cog.listener()
     async def on_message_delete(self, message):
         """On message delete event log original message data"""
-        # Fetches the required classes from database
-        try:
-            user = data.get_user(message.author.id)
-        except EntryNotFound:
-            user = data.add_user(
-                message.author.id, message.author.name, message.author.discriminator)
-
-        try:
-            guild = data.get_guild(message.guild.id)
-        except EntryNotFound:
-            guild = data.add_guild(message.guild.id, message.guild.name)
-
-        try:
-            channel = guild.get_channel(message.channel.id)
-        except EntryNotFound:
-            channel = guild.add_channel(
-                message.channel.id, message.channel.name)
-
-        # Add the log
-        data.add_log(
+        await data.run(
+            Logging.add_log,
+            message.author, message.guild, message.channel,
             action="Message Delete",
-            user_id=user.id,
-            guild_id=guild.id,
-            channel_id=channel.id,
             message_id=message.id,
             message_text=message.content
         )
 
-    @staticmethod
-    async def log_command(ctx, action=None, extra=None):
-        # Fetches the required classes from database
-        try:
-            user = data.get_user(ctx.author.id)
-        except EntryNotFound:
-            user = data.add_user(
-                ctx.author.id, ctx.author.name, ctx.author.discriminator)
+    @slash_command(guild_ids=data.enabled_slash, name='log_retention', description='Set how long logs from this server are kept')
+    @commands.has_permissions(administrator=True)
+    async def log_retention(
+        self,
+        ctx,
+        days: Option(int, "Days to keep logs (0 to keep them forever)", required=True, default=0)
+    ):
+        """
+        Sets how many days logs from this server are kept
+        """
+        if days < 0:
+            response = discord.Embed(
+                title="Invalid retention",
+                description="Days must be greater than or equal to 0",
+                color=0xffff00
+            )
+
+            response = await ctx.respond(embed=response)
+
+            return await Logging.log_command(ctx, action='Command',
+                                             extra=f"{ctx.author.name} tried to set an invalid log retention")
+
+        guild_data = await data.aio.get_or_create_guild(ctx.guild.id, ctx.guild.name)
+        await guild_data.set('log_retention', days or None)
+
+        response = discord.Embed(
+            title="Log Retention Set",
+            description=f"Logs will be kept for {days} days" if days else "Logs will be kept forever",
+            color=0x00ff00
+        )
 
-        try:
-            guild = data.get_guild(ctx.guild.id)
-        except EntryNotFound:
-            guild = data.add_guild(ctx.guild.id, ctx.guild.name)
+        response = await ctx.respond(embed=response)
 
-        try:
-            channel = guild.get_channel(ctx.channel.id)
-        except EntryNotFound:
-            channel = guild.add_channel(
-                ctx.channel.id, ctx.channel.name)
+        await Logging.log_command(ctx, action='Command',
+                                  extra=f"{ctx.author.name} set log retention to {days} days")
 
+    @staticmethod
+    async def log_command(ctx, action=None, extra=None):
         try:
             message_id = ctx.message.id
         except AttributeError:
@@ -135,6 +96,21 @@ class Logging(commands.Cog):
         except AttributeError:
             message_content = None
 
+        await data.run(
+            Logging.add_log,
+            ctx.author, ctx.guild, ctx.channel,
+            action=action,
+            extra=extra,
+            message_id=message_id,
+            message_text=message_content
+        )
+
+    @staticmethod
+    def add_log(author, guild, channel, action=None, extra=None, message_id=None, message_text=None):
+        """Adds a log for a discord event, blocks so it should be run with data.run"""
+        # Fetches the required classes from database
+        user, guild, channel = data.resolve(author, guild, channel)
+
         # Add the log
         data.add_log(
             action=action,
@@ -143,7 +119,7 @@ class Logging(commands.Cog):
             guild_id=guild.id,
             channel_id=channel.id,
             message_id=message_id,
-            message_text=message_content
+            message_text=message_text
         )
 
 
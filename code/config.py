@@ -0,0 +1,72 @@
+import threading
+import weakref
+from typing import NamedTuple
+
+from rules import RuleSet
+
+
+class GuildConfig(NamedTuple):
+    """Snapshot of the AutoMod settings of a guild, read on every message
+
+    Snapshots are never changed, so a cog can hold on to one while the
+    settings are updated. Changing the settings through AutoMod drops the
+    cached snapshot and the next read builds a new one.
+    """
+
+    guild_id: int
+    config_id: int
+    enabled: bool
+    anti_spam: int
+    rule_set: RuleSet
+
+    @classmethod
+    def cached(cls, db, guild_id: int, load) -> 'GuildConfig':
+        """Returns the snapshot for a guild, loading it on first use
+
+        Args:
+            db (Database): [Database the guild is in]
+            guild_id (int): [Id of the guild]
+            load (callable): [Returns a fresh GuildConfig]
+
+        Returns:
+            GuildConfig: [Settings of the guild]
+        """
+
+        with _lock:
+            configs = _shared.setdefault(db, {})
+            config = configs.get(guild_id)
+            version = _versions.get(db, 0)
+
+        if config is None:
+            config = load()
+
+            with _lock:
+                # Don't keep a snapshot that was changed while it loaded
+                if _versions.get(db, 0) == version:
+                    configs[guild_id] = config
+
+        return config
+
+    @classmethod
+    def invalidate(cls, db, guild_id: int = None):
+        """Drops a cached snapshot so it is loaded again on next use
+
+        Args:
+            db (Database): [Database the guild is in]
+            guild_id (int, optional): [Id of the guild, None for every guild]. Defaults to None.
+        """
+
+        with _lock:
+            _versions[db] = _versions.get(db, 0) + 1
+            configs = _shared.get(db, {})
+
+            if guild_id is None:
+                configs.clear()
+            else:
+                configs.pop(guild_id, None)
+
+
+# Database: {guild id: GuildConfig}
+_shared = weakref.WeakKeyDictionary()
+_versions = weakref.WeakKeyDictionary()  # Database: invalidation count
+_lock = threading.Lock()
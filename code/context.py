@@ -0,0 +1,41 @@
+class MessageContext:
+    __slots__ = ('message', 'user', 'guild', 'channel', 'muted', 'config')
+
+    def __init__(self, message, user, guild, channel, muted: bool, config):
+        """Database records for a discord message, looked up once and shared by every cog
+
+        Args:
+            message (discord.Message): [The message]
+            user (User): [Author of the message]
+            guild (Guild): [Guild the message was sent in]
+            channel (Channel): [Channel the message was sent in]
+            muted (bool): [If the channel is muted]
+            config (GuildConfig): [AutoMod settings of the guild]
+        """
+
+        self.message = message
+        self.user = user
+        self.guild = guild
+        self.channel = channel
+        self.muted = muted
+        self.config = config
+
+    @classmethod
+    def resolve(cls, data, message):
+        """Looks up the records for a message, blocks so it should be run with data.run
+
+        Args:
+            data (Data): [Data object to look them up with]
+            message (discord.Message): [Message sent in a guild]
+
+        Returns:
+            MessageContext: [Records for the message]
+        """
+
+        user, guild, channel = data.resolve(
+            message.author, message.guild, message.channel)
+
+        return cls(message, user, guild, channel, data.is_muted(message.channel.id), guild.config)
+
+    def __repr__(self):
+        return f"<MessageContext {self.message.id} {self.guild!r} {self.channel!r}>"
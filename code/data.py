@@ -1,18 +1,326 @@
-import mysql.connector
+from database import Database, ConnectionPool
+from log_writer import LogWriter
+from rules import RuleSet
+from config import GuildConfig
+from member_counts import MemberCountSeries, point_cutoff
+from retention import LogRetention
+from archive import LogArchive
+from query_stats import QueryStats
+from exceptions import EntryNotFound, EntryAlreadyExists
 
+import datetime
 import os
-from dotenv import load_dotenv
+import threading
+import time
+import weakref
+from collections import OrderedDict
 
-from exceptions import EntryNotFound, EntryAlreadyExists
 
-import datetime
+# Most values put in one IN (...) list
+CHUNK_SIZE = 1000
+
+
+def _chunks(items: list, size: int = CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class IdentityMap:
+    _shared = weakref.WeakKeyDictionary()
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        """LRU cache of model objects keyed by discord id
+
+        Entries expire after ttl seconds so changes made outside this
+        process are picked up eventually.
+
+        Args:
+            max_size (int, optional): [Most objects kept]. Defaults to 10000.
+            ttl (float, optional): [Seconds an object is kept]. Defaults to 300.
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # key: (expiry time, model)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, db) -> 'IdentityMap':
+        """Returns the identity map for a database
+
+        Args:
+            db (Database): [Database the cached objects belong to]
+
+        Returns:
+            IdentityMap: [Identity map]
+        """
+
+        with cls._shared_lock:
+            if db not in cls._shared:
+                cls._shared[db] = cls(
+                    max_size=int(os.getenv("CACHE_SIZE", 10000)),
+                    ttl=float(os.getenv("CACHE_TTL", 300)),
+                )
+
+            return cls._shared[db]
+
+    def get(self, key: tuple):
+        """Returns a cached object
+
+        Args:
+            key (tuple): [e.g. ('user', discord_id)]
+
+        Returns:
+            Model: [Cached object or None]
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def put(self, key: tuple, model):
+        """Caches an object, evicting the least recently used if full
+
+        Args:
+            key (tuple): [e.g. ('user', discord_id)]
+            model (Model): [Object to cache]
+        """
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, model)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: tuple):
+        """Removes an object from the cache
+
+        Args:
+            key (tuple): [e.g. ('user', discord_id)]
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every object from the cache"""
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MutedChannels:
+    _shared = weakref.WeakKeyDictionary()
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db):
+        """discord ids of the muted channels, loaded once and kept in step by
+        Channel.muted_events so checking a channel never queries
+
+        Args:
+            db (Database): [Database the channels are in]
+        """
+
+        self._db = db
+        self._ids = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, db) -> 'MutedChannels':
+        """Returns the muted channels for a database
+
+        Args:
+            db (Database): [Database the channels are in]
+
+        Returns:
+            MutedChannels: [Muted channels]
+        """
+
+        with cls._shared_lock:
+            if db not in cls._shared:
+                cls._shared[db] = cls(db)
 
+            return cls._shared[db]
 
-class CustomConfig:
-    def __init__(self, id, db, cursor):
+    def load(self):
+        """Loads the muted channels from the database, replacing what is held"""
+
+        rows = self._db.fetchall(
+            "SELECT discord_id FROM channels WHERE muted_events = 1")
+
+        with self._lock:
+            self._ids = {row[0] for row in rows}
+
+    def set(self, discord_id: int, muted: bool):
+        """Records a channel being muted or unmuted
+
+        Args:
+            discord_id (int): [discord id of the channel]
+            muted (bool): [If the channel is muted]
+        """
+
+        if self._ids is None:
+            self.load()
+
+        with self._lock:
+            if muted:
+                self._ids.add(discord_id)
+            else:
+                self._ids.discard(discord_id)
+
+    def __contains__(self, discord_id: int) -> bool:
+        if self._ids is None:
+            self.load()
+
+        return discord_id in self._ids
+
+    def __len__(self):
+        if self._ids is None:
+            self.load()
+
+        return len(self._ids)
+
+
+class Model:
+    """Object backed by a single row of a table
+
+    The whole row is loaded with one query the first time any column is
+    read and kept until refresh() is called, so reading several properties
+    costs a single round trip. Large columns are left out of _columns and
+    queried on their own.
+    """
+
+    __slots__ = ('id', '_db', '_row', '_known')
+
+    _table = None
+    _columns = ()
+    _index = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        cls._index = {column: i for i, column in enumerate(cls._columns)}
+
+    def __init__(self, id, db, row: tuple = None, known: dict = None):
         self.id = id
         self._db = db
-        self._cursor = cursor
+        self._row = None if row is None else list(row)
+
+        # Column values known without loading the row, e.g. ones just upserted
+        self._known = None if known is None else dict(known)
+
+    @classmethod
+    def _select(cls, where: str, table: str = None) -> str:
+        """Returns a query for id followed by every column in _columns
+
+        Args:
+            where (str): [WHERE clause and anything after it]
+            table (str, optional): [Table with the same columns to read instead]. Defaults to _table.
+
+        Returns:
+            str: [SQL query]
+        """
+
+        table = cls._table if table is None else table
+        columns = ', '.join(f"{table}.{column}" for column in ('id',) + cls._columns)
+
+        return f"SELECT {columns} FROM {table} {where}"
+
+    @classmethod
+    def _from_rows(cls, rows: list, db) -> list:
+        """Returns hydrated objects for rows fetched with _select
+
+        Args:
+            rows (list): [Rows of (id, *columns)]
+
+        Returns:
+            list: [List of objects]
+        """
+
+        return [cls(row[0], db, row[1:]) for row in rows]
+
+    def refresh(self):
+        """Reloads the row from the database
+
+        Raises:
+            EntryNotFound: [If the row no longer exists]
+        """
+
+        row = self._db.fetchone(
+            self._select(f"WHERE {self._table}.id = %s"), (self.id,))
+
+        if row is None:
+            raise EntryNotFound(
+                f"{type(self).__name__} {self.id} does not exist in the database")
+
+        self._row = list(row[1:])
+
+        return self
+
+    def _stale(self, **columns) -> bool:
+        """Returns if the row differs from the given column values
+
+        Rows that haven't been loaded are compared with the known values,
+        and are stale if a column isn't known.
+        """
+
+        if self._row is None:
+            known = self._known or {}
+
+            return any(column not in known or known[column] != value
+                       for column, value in columns.items())
+
+        return any(self._row[self._index[column]] != value for column, value in columns.items())
+
+    def _get(self, column: str):
+        if self._row is None:
+            self.refresh()
+
+        return self._row[self._index[column]]
+
+    def _set(self, column: str, value):
+        # Inside a transaction this is merged with other updates to the row
+        self._db.update(self._table, self.id, column, value)
+
+        if self._row is not None:
+            self._row[self._index[column]] = value
+
+        if self._known is not None and column in self._known:
+            self._known[column] = value
+
+        # A rolled back change is undone by loading the row again
+        self._db.after_rollback(self._forget)
+
+    def _forget(self):
+        self._row = None
+        self._known = None
+
+
+class CustomConfig(Model):
+    __slots__ = ()
+
+    _table = 'auto_mod_custom_config'
+    _columns = ('config_id', 'type', 'value', 'consequence', 'timeout_time')
 
     @property
     def type(self) -> str:
@@ -21,10 +329,7 @@ class CustomConfig:
         Returns:
             str: [Type of config]"""
 
-        self._cursor.execute(
-            "SELECT type FROM auto_mod_custom_config WHERE id = %s", (self.id,))
-
-        return self._cursor.fetchone()[0]
+        return self._get('type')
 
     @property
     def value(self) -> str:
@@ -33,10 +338,7 @@ class CustomConfig:
         Returns:
             str: [Value of config]"""
 
-        self._cursor.execute(
-            "SELECT value FROM auto_mod_custom_config WHERE id = %s", (self.id,))
-
-        return self._cursor.fetchone()[0]
+        return self._get('value')
 
     @property
     def consequence(self) -> str:
@@ -45,10 +347,7 @@ class CustomConfig:
         Returns:
             str: [Consequence of config]"""
 
-        self._cursor.execute(
-            "SELECT consequence FROM auto_mod_custom_config WHERE id = %s", (self.id,))
-
-        return self._cursor.fetchone()[0]
+        return self._get('consequence')
 
     @property
     def timeout_time(self) -> int:
@@ -57,17 +356,14 @@ class CustomConfig:
         Returns:
             int: [Timeout time of config]"""
 
-        self._cursor.execute(
-            "SELECT timeout_time FROM auto_mod_custom_config WHERE id = %s", (self.id,))
+        return self._get('timeout_time')
 
-        return self._cursor.fetchone()[0]
 
+class AutoMod(Model):
+    __slots__ = ()
 
-class AutoMod:
-    def __init__(self, id, db, cursor):
-        self.id = id
-        self._db = db
-        self._cursor = cursor
+    _table = 'auto_mod_config'
+    _columns = ('guild_id', 'enabled', 'anti_spam')
 
     @property
     def guild(self) -> 'Guild':
@@ -77,12 +373,7 @@ class AutoMod:
             Guild: [Guild object]
         """
 
-        self._cursor.execute(
-            "SELECT guild_id FROM auto_mod_config WHERE id = %s", (self.id,))
-
-        guild_id = self._cursor.fetchone()[0]
-
-        return Guild(guild_id, self._db, self._cursor)
+        return Guild(self._get('guild_id'), self._db)
 
     @property
     def enabled(self) -> bool:
@@ -92,10 +383,7 @@ class AutoMod:
             bool: [If AutoMod is enabled]
         """
 
-        self._cursor.execute(
-            "SELECT enabled FROM auto_mod_config WHERE id = %s", (self.id,))
-
-        return self._cursor.fetchone()[0]
+        return self._get('enabled')
 
     @enabled.setter
     def enabled(self, enabled: bool):
@@ -105,9 +393,8 @@ class AutoMod:
             enabled (bool): [If AutoMod is enabled]
         """
 
-        self._cursor.execute(
-            "UPDATE auto_mod_config SET enabled = %s WHERE id = %s", (enabled, self.id))
-        self._db.commit()
+        self._set('enabled', enabled)
+        self._invalidate_config()
 
     @property
     def anti_spam(self) -> int:
@@ -117,12 +404,7 @@ class AutoMod:
             int: [0 if disabled, not 0 if enabled]
         """
 
-        self._cursor.execute(
-            "SELECT anti_spam FROM auto_mod_config WHERE id = %s", (self.id,))
-
-        anti_spam = self._cursor.fetchone()[0]
-
-        return anti_spam
+        return self._get('anti_spam')
 
     @anti_spam.setter
     def anti_spam(self, value: int):
@@ -132,9 +414,8 @@ class AutoMod:
             value (int): [0 if disabled, not 0 if enabled]
         """
 
-        self._cursor.execute(
-            "UPDATE auto_mod_config SET anti_spam = %s WHERE id = %s", (value, self.id))
-        self._db.commit()
+        self._set('anti_spam', value)
+        self._invalidate_config()
 
     @property
     def custom_config(self) -> list:
@@ -144,12 +425,21 @@ class AutoMod:
             list: [list of custom config]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM auto_mod_custom_config WHERE config_id = %s", (self.id,))
+        rows = self._db.fetchall(
+            CustomConfig._select("WHERE config_id = %s"), (self.id,))
+
+        return CustomConfig._from_rows(rows, self._db)
+
+    @property
+    def rule_set(self) -> RuleSet:
+        """Returns the custom config compiled for matching, built once and
+        reused until add_config changes it
 
-        custom_config_ids = self._cursor.fetchall()
+        Returns:
+            RuleSet: [Compiled custom config]
+        """
 
-        return [CustomConfig(id[0], self._db, self._cursor) for id in custom_config_ids]
+        return RuleSet.cached(self._db, self.id, lambda: self.custom_config)
 
     def add_config(self, type: str, value: str, consequence: str, timeout_time: int = 10):
         """Adds custom config to this config
@@ -161,19 +451,31 @@ class AutoMod:
             timeout_time (int, optional): [Timeout time of config in minutes. Defaults to 10.]
         """
 
-        self._cursor.execute(
+        config_id = self._db.execute(
             "INSERT INTO auto_mod_custom_config (config_id, type, value, consequence, timeout_time) VALUES (%s, %s, %s, %s, %s)",
             (self.id, type, value, consequence, timeout_time))
-        self._db.commit()
 
-        return CustomConfig(self._cursor.lastrowid, self._db, self._cursor)
+        # The compiled rules are rebuilt on next use
+        self._invalidate_config()
 
+        return CustomConfig(config_id, self._db)
+
+    def _invalidate_config(self):
+        # Dropped once the change is committed so it isn't reloaded early
+        guild_id = self._get('guild_id')
+
+        def invalidate():
+            RuleSet.invalidate(self._db, self.id)
+            GuildConfig.invalidate(self._db, guild_id)
+
+        self._db.after_commit(invalidate)
 
-class Log:
-    def __init__(self, id, db, cursor):
-        self.id = id
-        self._db = db
-        self._cursor = cursor
+
+class Log(Model):
+    __slots__ = ()
+
+    _table = 'audit_log'
+    _columns = ('time', 'action', 'extra', 'user_id', 'guild_id', 'channel_id', 'message_id', 'message_text')
 
     @property
     def guild(self) -> 'Guild':
@@ -183,12 +485,7 @@ class Log:
             Guild: [guild object]
         """
 
-        self._cursor.execute(
-            "SELECT guild_id FROM audit_log WHERE id = %s", (self.id,))
-
-        guild_id = self._cursor.fetchone()[0]
-
-        return Guild(guild_id, self._db, self._cursor)
+        return Guild(self._get('guild_id'), self._db)
 
     @property
     def channel(self) -> 'Channel':
@@ -198,12 +495,7 @@ class Log:
             int: [channel object]
         """
 
-        self._cursor.execute(
-            "SELECT channel_id FROM audit_log WHERE id = %s", (self.id,))
-
-        channel_id = self._cursor.fetchone()[0]
-
-        return Channel(channel_id, self._db, self._cursor)
+        return Channel(self._get('channel_id'), self._db)
 
     @property
     def message_id(self) -> int:
@@ -213,12 +505,7 @@ class Log:
             int: [message_id]
         """
 
-        self._cursor.execute(
-            "SELECT message_id FROM audit_log WHERE id = %s", (self.id,))
-
-        message_id = self._cursor.fetchone()[0]
-
-        return message_id
+        return self._get('message_id')
 
     @property
     def message_text(self) -> str:
@@ -228,12 +515,7 @@ class Log:
             str: [message_text]
         """
 
-        self._cursor.execute(
-            "SELECT message_text FROM audit_log WHERE id = %s", (self.id,))
-
-        message_text = self._cursor.fetchone()[0]
-
-        return message_text
+        return self._get('message_text')
 
     @property
     def user(self) -> 'User':
@@ -243,12 +525,7 @@ class Log:
             int: [user object]
         """
 
-        self._cursor.execute(
-            "SELECT user_id FROM audit_log WHERE id = %s", (self.id,))
-
-        user_id = self._cursor.fetchone()[0]
-
-        return User(user_id, self._db, self._cursor)
+        return User(self._get('user_id'), self._db)
 
     @property
     def action(self) -> str:
@@ -258,12 +535,7 @@ class Log:
             str: [action]
         """
 
-        self._cursor.execute(
-            "SELECT action FROM audit_log WHERE id = %s", (self.id,))
-
-        action = self._cursor.fetchone()[0]
-
-        return action
+        return self._get('action')
 
     @property
     def extra(self):
@@ -273,22 +545,141 @@ class Log:
             str: [extra]
         """
 
-        self._cursor.execute(
-            "SELECT extra FROM audit_log WHERE id = %s", (self.id,))
+        return self._get('extra')
+
+    @classmethod
+    def pages(cls, db, page_size: int = 1000, newest_first: bool = False, time: datetime.datetime = None,
+              user: int = None, guild: int = None, channel: int = None, action: str = None):
+        """Yields logs a page at a time using keyset pagination on id
+
+        Each page is its own short query that starts after the last id of
+        the page before, so a scan of the whole table holds one page in
+        memory and no connection between pages. Logs rolled into monthly
+        tables are included. Blocks, so iterate it on the database executor.
+
+        Args:
+            db (Database): [Database the logs are in]
+            page_size (int, optional): [Logs per page]. Defaults to 1000.
+            newest_first (bool, optional): [Yield the newest logs first]. Defaults to False.
+            time (datetime.datetime, optional): [Only logs after this time]. Defaults to None.
+            user (int, optional): [The user_id to filter by]. Defaults to None.
+            guild (int, optional): [The guild_id to filter by]. Defaults to None.
+            channel (int, optional): [The channel_id to filter by]. Defaults to None.
+            action (str, optional): [The action to filter by]. Defaults to None.
+
+        Yields:
+            list: [Up to page_size Log objects]
+        """
+
+        conditions = []
+        paramaters = ()
+
+        for column, value in (('user_id', user), ('guild_id', guild),
+                              ('channel_id', channel), ('action', action)):
+            if value is not None:
+                conditions.append(f"{column} = %s")
+                paramaters = paramaters + (value,)
+
+        if time is not None:
+            conditions.append("time > %s")
+            paramaters = paramaters + (time,)
+
+        compare, order = ("<", "DESC") if newest_first else (">", "ASC")
+
+        tables = cls._tables(db)
+        last_id = None
+
+        while True:
+            where = list(conditions)
+            params = paramaters
+
+            if last_id is not None:
+                where.append(f"id {compare} %s")
+                params = params + (last_id,)
+
+            logs = cls._fetch(db, "WHERE " + " AND ".join(where) if where else "", params,
+                              order=f"id {order}", limit=page_size, tables=tables)
+
+            if not logs:
+                return
+
+            yield logs
+
+            if len(logs) < page_size:
+                return
+
+            last_id = logs[-1].id
+
+    @classmethod
+    def _tables(cls, db) -> list:
+        # Logs rolled out of audit_log are kept in monthly tables
+        return [cls._table] + [table for table, _ in LogRetention.shared(db).periods()]
+
+    @classmethod
+    def _fetch(cls, db, where: str = "", params: tuple = (), order: str = None, limit: int = None,
+               tables: list = None) -> list:
+        """Returns logs from audit_log and the monthly tables rolled out of it
+
+        Args:
+            db (Database): [Database the logs are in]
+            where (str, optional): [WHERE clause]. Defaults to "".
+            params (tuple, optional): [Parameters of the WHERE clause]. Defaults to ().
+            order (str, optional): [ORDER BY expression]. Defaults to None.
+            limit (int, optional): [Most logs to return]. Defaults to all.
+            tables (list, optional): [Tables to read, from _tables]. Defaults to every log table.
+
+        Returns:
+            list: [Log objects]
+        """
+
+        if tables is None:
+            tables = cls._tables(db)
+
+        suffix = ""
+        limits = ()
+
+        if order:
+            suffix += f" ORDER BY {order}"
+
+        if limit:
+            suffix += " LIMIT %s"
+            limits = (limit,)
+
+        if len(tables) == 1:
+            rows = db.fetchall(cls._select(f"{where}{suffix}", tables[0]), params + limits)
+
+            return cls._from_rows(rows, db)
+
+        # Each table is filtered, sorted and limited on its own so its
+        # indexes are used, then the results are merged
+        query = " UNION ALL ".join(
+            f"SELECT * FROM ({cls._select(f'{where}{suffix}', table)}) AS t{i}"
+            for i, table in enumerate(tables))
+
+        rows = db.fetchall(query + suffix, (params + limits) * len(tables) + limits)
 
-        extra = self._cursor.fetchone()[0]
+        return cls._from_rows(rows, db)
 
-        return extra
+    @classmethod
+    def iterate(cls, db, page_size: int = 1000, **filters):
+        """Yields logs one at a time, see pages for the arguments
+
+        Yields:
+            Log: [Each matching log]
+        """
+
+        for page in cls.pages(db, page_size, **filters):
+            yield from page
 
     def __repr__(self):
         return f"<Log id={self.id} action={self.action} message_text={self.message_text} guild={self.guild} channel={self.channel} user={self.user}>"
 
 
-class Cog:
-    def __init__(self, id, db, cursor):
-        self.id = id
-        self._db = db
-        self._cursor = cursor
+class Cog(Model):
+    __slots__ = ()
+
+    _table = 'cogs'
+    _columns = ('name', 'enabled')
 
     @property
     def name(self):
@@ -298,11 +689,7 @@ class Cog:
             str: [name]
         """
 
-        self._cursor.execute("SELECT name FROM cogs WHERE id = %s", (self.id,))
-
-        name = self._cursor.fetchone()[0]
-
-        return name
+        return self._get('name')
 
     @property
     def enabled(self) -> bool:
@@ -312,12 +699,7 @@ class Cog:
             bool: [description]
         """
 
-        self._cursor.execute(
-            "SELECT enabled FROM cogs WHERE id = %s", (self.id,))
-
-        enabled = self._cursor.fetchone()[0]
-
-        return enabled
+        return self._get('enabled')
 
     @enabled.setter
     def enabled(self, value: bool):
@@ -327,17 +709,14 @@ class Cog:
             value (bool): [description]
         """
 
-        self._cursor.execute(
-            "UPDATE cogs SET enabled = %s WHERE id = %s", (value, self.id))
+        self._set('enabled', value)
 
-        self._db.commit()
 
+class Game(Model):
+    __slots__ = ()
 
-class Game:
-    def __init__(self, id, db, cursor):
-        self.id = id
-        self._db = db
-        self._cursor = cursor
+    _table = 'games'
+    _columns = ('channel_id', 'type', 'turn', 'waiting_for_players', 'wait_time', 'max_wait_time', 'last_move_time', 'winner')
 
     @property
     def channel_id(self) -> int:
@@ -347,12 +726,7 @@ class Game:
             int: [channel id]
         """
 
-        self._cursor.execute(
-            "SELECT channel_id FROM games WHERE id = %s", (self.id,))
-
-        channel_id = self._cursor.fetchone()[0]
-
-        return channel_id
+        return self._get('channel_id')
 
     @property
     def channel(self) -> 'Channel':
@@ -362,7 +736,7 @@ class Game:
             Channel: [channel object]
         """
 
-        return Channel(self.channel_id, self._db, self._cursor)
+        return Channel(self.channel_id, self._db)
 
     @property
     def type(self) -> str:
@@ -372,12 +746,7 @@ class Game:
             str: [game type]
         """
 
-        self._cursor.execute(
-            "SELECT type FROM games WHERE id = %s", (self.id,))
-
-        type = self._cursor.fetchone()[0]
-
-        return type
+        return self._get('type')
 
     @type.setter
     def type(self, type: str):
@@ -387,9 +756,7 @@ class Game:
             type (str): [game type]
         """
 
-        self._cursor.execute(
-            "UPDATE games SET type = %s WHERE id = %s", (type, self.id))
-        self._db.commit()
+        self._set('type', type)
 
     @property
     def turn(self) -> int:
@@ -399,12 +766,7 @@ class Game:
             int: [turn]
         """
 
-        self._cursor.execute(
-            "SELECT turn FROM games WHERE id = %s", (self.id,))
-
-        turn = self._cursor.fetchone()[0]
-
-        return turn
+        return self._get('turn')
 
     @turn.setter
     def turn(self, turn: int):
@@ -414,9 +776,7 @@ class Game:
             turn (int): [turn]
         """
 
-        self._cursor.execute(
-            "UPDATE games SET turn = %s WHERE id = %s", (turn, self.id))
-        self._db.commit()
+        self._set('turn', turn)
 
     @property
     def players(self) -> list:
@@ -426,12 +786,10 @@ class Game:
             list: [user objects]
         """
 
-        self._cursor.execute(
-            "SELECT player_id FROM game_players WHERE game_id = %s", (self.id,))
-
-        player_ids = self._cursor.fetchall()
-        players = [User(player_id[0], self._db, self._cursor)
-                   for player_id in player_ids]
+        rows = self._db.fetchall(
+            User._select("JOIN game_players ON game_players.player_id = users.id WHERE game_players.game_id = %s"),
+            (self.id,))
+        players = User._from_rows(rows, self._db)
 
         return players
 
@@ -443,17 +801,26 @@ class Game:
             players (list): [user objects]
         """
 
-        # Delete all players
-        self._cursor.execute(
-            "DELETE FROM game_players WHERE game_id = %s", (self.id,))
-        self._db.commit()
+        new_ids = [player.id for player in players]
 
-        # Add back those in list
-        for player in players:
-            self._cursor.execute(
-                "INSERT INTO game_players (game_id, player_id) VALUES (%s, %s)",
-                (self.id, player.id))
-        self._db.commit()
+        with self._db.transaction():
+            current = {row[0] for row in self._db.fetchall(
+                "SELECT player_id FROM game_players WHERE game_id = %s", (self.id,))}
+
+            # Only players that left or joined are touched
+            removed = list(current.difference(new_ids))
+            added = [player_id for player_id in dict.fromkeys(new_ids) if player_id not in current]
+
+            for chunk in _chunks(removed):
+                placeholders = ", ".join(["%s"] * len(chunk))
+                self._db.execute(
+                    f"DELETE FROM game_players WHERE game_id = %s AND player_id IN ({placeholders})",
+                    (self.id, *chunk))
+
+            if added:
+                self._db.executemany(
+                    "INSERT INTO game_players (game_id, player_id) VALUES (%s, %s)",
+                    [(self.id, player_id) for player_id in added])
 
     @property
     def waiting_for_players(self) -> bool:
@@ -463,12 +830,7 @@ class Game:
             bool: [waiting for players]
         """
 
-        self._cursor.execute(
-            "SELECT waiting_for_players FROM games WHERE id = %s", (self.id,))
-
-        waiting_for_players = self._cursor.fetchone()[0]
-
-        return waiting_for_players
+        return self._get('waiting_for_players')
 
     @waiting_for_players.setter
     def waiting_for_players(self, waiting_for_players: bool):
@@ -478,9 +840,7 @@ class Game:
             waiting_for_players (bool): [waiting for players]
         """
 
-        self._cursor.execute(
-            "UPDATE games SET waiting_for_players = %s WHERE id = %s", (waiting_for_players, self.id))
-        self._db.commit()
+        self._set('waiting_for_players', waiting_for_players)
 
     @property
     def wait_time(self) -> int:
@@ -490,12 +850,7 @@ class Game:
             int: [wait time]
         """
 
-        self._cursor.execute(
-            "SELECT wait_time FROM games WHERE id = %s", (self.id,))
-
-        wait_time = self._cursor.fetchone()[0]
-
-        return wait_time
+        return self._get('wait_time')
 
     @wait_time.setter
     def wait_time(self, wait_time: int):
@@ -505,9 +860,7 @@ class Game:
             wait_time (int): [wait time]
         """
 
-        self._cursor.execute(
-            "UPDATE games SET wait_time = %s WHERE id = %s", (wait_time, self.id))
-        self._db.commit()
+        self._set('wait_time', wait_time)
 
     @property
     def max_wait_time(self) -> int:
@@ -517,12 +870,7 @@ class Game:
             int: [max wait time]
         """
 
-        self._cursor.execute(
-            "SELECT max_wait_time FROM games WHERE id = %s", (self.id,))
-
-        max_wait_time = self._cursor.fetchone()[0]
-
-        return max_wait_time
+        return self._get('max_wait_time')
 
     @max_wait_time.setter
     def max_wait_time(self, max_wait_time: int):
@@ -532,9 +880,7 @@ class Game:
             max_wait_time (int): [max wait time]
         """
 
-        self._cursor.execute(
-            "UPDATE games SET max_wait_time = %s WHERE id = %s", (max_wait_time, self.id))
-        self._db.commit()
+        self._set('max_wait_time', max_wait_time)
 
     @property
     def last_move_time(self) -> int:
@@ -544,12 +890,7 @@ class Game:
             int: [last move time]
         """
 
-        self._cursor.execute(
-            "SELECT last_move_time FROM games WHERE id = %s", (self.id,))
-
-        last_move_time = self._cursor.fetchone()[0]
-
-        return last_move_time
+        return self._get('last_move_time')
 
     @last_move_time.setter
     def last_move_time(self, last_move_time: int):
@@ -559,9 +900,7 @@ class Game:
             last_move_time (int): [last move time]
         """
 
-        self._cursor.execute(
-            "UPDATE games SET last_move_time = %s WHERE id = %s", (last_move_time, self.id))
-        self._db.commit()
+        self._set('last_move_time', last_move_time)
 
     @property
     def winner(self) -> int:
@@ -571,12 +910,7 @@ class Game:
             int: [winner]
         """
 
-        self._cursor.execute(
-            "SELECT winner FROM games WHERE id = %s", (self.id,))
-
-        winner = self._cursor.fetchone()[0]
-
-        return winner
+        return self._get('winner')
 
     @property
     def board(self) -> dict:
@@ -587,10 +921,8 @@ class Game:
         """
         import pickle
 
-        self._cursor.execute(
-            "SELECT board FROM games WHERE id = %s", (self.id,))
-
-        board = self._cursor.fetchone()[0]  # in bytes
+        board = self._db.fetchone(
+            "SELECT board FROM games WHERE id = %s", (self.id,))[0]  # in bytes
         board = pickle.loads(board)  # convert to dict
 
         return board
@@ -612,19 +944,18 @@ class Game:
         board = pickle.dumps(board)
 
         # Push to database
-        self._cursor.execute(
+        self._db.execute(
             "UPDATE games SET board = %s WHERE id = %s", (board, self.id))
-        self._db.commit()
 
     def __repr__(self):
         return f"<Game {self.id, self.channel_id}>"
 
 
-class Embed:
-    def __init__(self, id, db, cursor):
-        self.id = id
-        self._db = db
-        self._cursor = cursor
+class Embed(Model):
+    __slots__ = ()
+
+    _table = 'embeds'
+    _columns = ('user_id', 'name', 'title', 'description', 'color', 'image', 'file_type', 'file_name')
 
     @property
     def user_id(self) -> int:
@@ -634,12 +965,7 @@ class Embed:
             [int]: [The id of the owner]
         """
 
-        self._cursor.execute(
-            "SELECT user_id FROM embeds WHERE id = %s", (self.id,))
-
-        user_id = self._cursor.fetchone()[0]
-
-        return user_id
+        return self._get('user_id')
 
     def user(self) -> 'User':
         """Returns the user of the embed
@@ -648,7 +974,7 @@ class Embed:
             [User]: [The user of the embed]
         """
 
-        return User(self.user_id, self._db, self._cursor)
+        return User(self.user_id, self._db)
 
     @property
     def name(self) -> str:
@@ -658,12 +984,7 @@ class Embed:
             [str]: [The name of the embed]
         """
 
-        self._cursor.execute(
-            "SELECT name FROM embeds WHERE id = %s", (self.id,))
-
-        name = self._cursor.fetchone()[0]
-
-        return name
+        return self._get('name')
 
     @property
     def title(self) -> str:
@@ -673,12 +994,7 @@ class Embed:
             [str]: [The title of the embed]
         """
 
-        self._cursor.execute(
-            "SELECT title FROM embeds WHERE id = %s", (self.id,))
-
-        title = self._cursor.fetchone()[0]
-
-        return title
+        return self._get('title')
 
     @title.setter
     def title(self, title: str):
@@ -688,10 +1004,7 @@ class Embed:
             title ([str]): [The title to set]
         """
 
-        self._cursor.execute(
-            "UPDATE embeds SET title = %s WHERE id = %s", (title, self.id))
-
-        self._db.commit()
+        self._set('title', title)
 
     @property
     def description(self) -> str:
@@ -701,12 +1014,7 @@ class Embed:
             [str]: [The description of the embed]
         """
 
-        self._cursor.execute(
-            "SELECT description FROM embeds WHERE id = %s", (self.id,))
-
-        description = self._cursor.fetchone()[0]
-
-        return description
+        return self._get('description')
 
     @description.setter
     def description(self, description: str):
@@ -716,10 +1024,7 @@ class Embed:
             description ([str]): [The description to set]
         """
 
-        self._cursor.execute(
-            "UPDATE embeds SET description = %s WHERE id = %s", (description, self.id))
-
-        self._db.commit()
+        self._set('description', description)
 
     @property
     def color(self) -> int:
@@ -729,12 +1034,7 @@ class Embed:
             [int]: [The color of the embed]
         """
 
-        self._cursor.execute(
-            "SELECT color FROM embeds WHERE id = %s", (self.id,))
-
-        color = self._cursor.fetchone()[0]
-
-        return color
+        return self._get('color')
 
     @color.setter
     def color(self, color: int):
@@ -751,10 +1051,7 @@ class Embed:
             raise ValueError("color must be between 0 and 0xffffff")
 
         # Push to database
-        self._cursor.execute(
-            "UPDATE embeds SET color = %s WHERE id = %s", (color, self.id))
-
-        self._db.commit()
+        self._set('color', color)
 
     @property
     def image(self) -> str:
@@ -764,12 +1061,7 @@ class Embed:
             [str]: [The image of the embed]
         """
 
-        self._cursor.execute(
-            "SELECT image FROM embeds WHERE id = %s", (self.id,))
-
-        image = self._cursor.fetchone()[0]
-
-        return image
+        return self._get('image')
 
     @image.setter
     def image(self, image: str):
@@ -790,10 +1082,7 @@ class Embed:
             raise ValueError("image must be a valid url")
 
         # Push to database
-        self._cursor.execute(
-            "UPDATE embeds SET image = %s WHERE id = %s", (image, self.id))
-
-        self._db.commit()
+        self._set('image', image)
 
     @property
     def fields(self) -> list:
@@ -803,10 +1092,8 @@ class Embed:
             [list]: [The fields of the embed]
         """
 
-        self._cursor.execute(
-            "SELECT name, value FROM embed_fields WHERE embed_id = %s", (self.id,))
-
-        fields = list(self._cursor.fetchall())
+        fields = [tuple(row) for row in self._db.fetchall(
+            "SELECT name, value FROM embed_fields WHERE embed_id = %s ORDER BY id", (self.id,))]
 
         return fields
 
@@ -836,14 +1123,30 @@ class Embed:
                 raise TypeError("fields must be a list of tuples of strings")
 
         # Push to database
-        self._cursor.execute(
-            "DELETE FROM embed_fields WHERE embed_id = %s", (self.id,))
+        with self._db.transaction():
+            current = self._db.fetchall(
+                "SELECT id, name, value FROM embed_fields WHERE embed_id = %s ORDER BY id", (self.id,))
 
-        for field in fields:
-            self._cursor.execute(
-                "INSERT INTO embed_fields (embed_id, name, value) VALUES (%s, %s, %s)", (self.id, field[0], field[1]))
+            # Fields are shown in id order, so rows are reused by position and
+            # only the fields that changed are touched
+            changed = [(name, value, row[0]) for row, (name, value) in zip(current, fields)
+                       if (row[1], row[2]) != (name, value)]
+            removed = [row[0] for row in current[len(fields):]]
+            added = fields[len(current):]
+
+            if changed:
+                self._db.executemany(
+                    "UPDATE embed_fields SET name = %s, value = %s WHERE id = %s", changed)
 
-        self._db.commit()
+            for chunk in _chunks(removed):
+                placeholders = ", ".join(["%s"] * len(chunk))
+                self._db.execute(
+                    f"DELETE FROM embed_fields WHERE id IN ({placeholders})", chunk)
+
+            if added:
+                self._db.executemany(
+                    "INSERT INTO embed_fields (embed_id, name, value) VALUES (%s, %s, %s)",
+                    [(self.id, name, value) for name, value in added])
 
     @property
     def file(self) -> bytes:
@@ -853,10 +1156,8 @@ class Embed:
             [bytes]: [The file of the embed]
         """
 
-        self._cursor.execute(
-            "SELECT file FROM embeds WHERE id = %s", (self.id,))
-
-        file = self._cursor.fetchone()[0]
+        file = self._db.fetchone(
+            "SELECT file FROM embeds WHERE id = %s", (self.id,))[0]
 
         return file
 
@@ -872,11 +1173,9 @@ class Embed:
             raise TypeError("file must be a bytes object")
 
         # Push to database
-        self._cursor.execute(
+        self._db.execute(
             "UPDATE embeds SET file = %s WHERE id = %s", (file, self.id))
 
-        self._db.commit()
-
     @property
     def file_type(self) -> str:
         """Returns the file type of the embed
@@ -885,12 +1184,7 @@ class Embed:
             [str]: [The file type of the embed]
         """
 
-        self._cursor.execute(
-            "SELECT file_type FROM embeds WHERE id = %s", (self.id,))
-
-        file_type = self._cursor.fetchone()[0]
-
-        return file_type
+        return self._get('file_type')
 
     @file_type.setter
     def file_type(self, file_type: str):
@@ -900,10 +1194,7 @@ class Embed:
             file_type ([str]): [The file type to set]
         """
 
-        self._cursor.execute(
-            "UPDATE embeds SET file_type = %s WHERE id = %s", (file_type, self.id))
-
-        self._db.commit()
+        self._set('file_type', file_type)
 
     @property
     def file_name(self) -> str:
@@ -913,12 +1204,7 @@ class Embed:
             [str]: [The file name of the embed]
         """
 
-        self._cursor.execute(
-            "SELECT file_name FROM embeds WHERE id = %s", (self.id,))
-
-        file_name = self._cursor.fetchone()[0]
-
-        return file_name
+        return self._get('file_name')
 
     @file_name.setter
     def file_name(self, file_name: str):
@@ -928,10 +1214,7 @@ class Embed:
             file_name ([str]): [The file name to set]
         """
 
-        self._cursor.execute(
-            "UPDATE embeds SET file_name = %s WHERE id = %s", (file_name, self.id))
-
-        self._db.commit()
+        self._set('file_name', file_name)
 
     def add_field(self, name: str, value: str):
         """Adds a field to the embed
@@ -949,17 +1232,15 @@ class Embed:
             raise TypeError("value must be a string")
 
         # Push to database
-        self._cursor.execute(
+        self._db.execute(
             "INSERT INTO embed_fields (embed_id, name, value) VALUES (%s, %s, %s)", (self.id, name, value))
 
-        self._db.commit()
 
+class User(Model):
+    __slots__ = ()
 
-class User:
-    def __init__(self, id, db, cursor):
-        self.id = id
-        self._db = db
-        self._cursor = cursor
+    _table = 'users'
+    _columns = ('discord_id', 'name', 'discriminator', 'goated', 'rigged')
 
     @property
     def discord_id(self) -> int:
@@ -969,12 +1250,7 @@ class User:
             int: [discord_id]
         """
 
-        self._cursor.execute(
-            "SELECT discord_id FROM users WHERE id = %s", (self.id,))
-
-        discord_id = self._cursor.fetchone()[0]
-
-        return discord_id
+        return self._get('discord_id')
 
     @property
     def name(self) -> str:
@@ -984,12 +1260,7 @@ class User:
             str: [name]
         """
 
-        self._cursor.execute(
-            "SELECT name FROM users WHERE id = %s", (self.id,))
-
-        name = self._cursor.fetchone()[0]
-
-        return name
+        return self._get('name')
 
     @property
     def discriminator(self) -> str:
@@ -999,12 +1270,7 @@ class User:
             str: [discriminator]
         """
 
-        self._cursor.execute(
-            "SELECT discriminator FROM users WHERE id = %s", (self.id,))
-
-        discriminator = self._cursor.fetchone()[0]
-
-        return discriminator
+        return self._get('discriminator')
 
     @property
     def goated(self) -> bool:
@@ -1014,12 +1280,7 @@ class User:
             bool: [goated]
         """
 
-        self._cursor.execute(
-            "SELECT goated FROM users WHERE id = %s", (self.id,))
-
-        goated = self._cursor.fetchone()[0]
-
-        return goated
+        return self._get('goated')
 
     @goated.setter
     def goated(self, value: bool):
@@ -1029,10 +1290,7 @@ class User:
             value (bool): [goated]
         """
 
-        self._cursor.execute(
-            "UPDATE users SET goated = %s WHERE id = %s", (value, self.id))
-
-        self._db.commit()
+        self._set('goated', value)
 
     @property
     def rigged(self) -> bool:
@@ -1042,12 +1300,7 @@ class User:
             bool: [rigged]
         """
 
-        self._cursor.execute(
-            "SELECT rigged FROM users WHERE id = %s", (self.id,))
-
-        rigged = self._cursor.fetchone()[0]
-
-        return rigged
+        return self._get('rigged')
 
     @rigged.setter
     def rigged(self, value: bool):
@@ -1057,10 +1310,7 @@ class User:
             value (bool): [rigged]
         """
 
-        self._cursor.execute(
-            "UPDATE users SET rigged = %s WHERE id = %s", (value, self.id))
-
-        self._db.commit()
+        self._set('rigged', value)
 
     @property
     def logs(self) -> list:
@@ -1070,14 +1320,24 @@ class User:
             list: [list of Log objects]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM audit_log WHERE user_id = %s", (self.id,))
-
-        log_ids = self._cursor.fetchall()
-        logs = [Log(id[0], self._db, self._cursor) for id in log_ids]
+        logs = Log._fetch(self._db, "WHERE user_id = %s", (self.id,))
 
         return logs
 
+    def iter_logs(self, page_size: int = 1000, **filters):
+        """Yields the logs of the user a page at a time from the database, in
+        constant memory
+
+        Args:
+            page_size (int, optional): [Logs fetched per query]. Defaults to 1000.
+            **filters: [newest_first, time, guild, channel or action, see Log.pages]
+
+        Yields:
+            Log: [Each matching log]
+        """
+
+        return Log.iterate(self._db, page_size, user=self.id, **filters)
+
     def __repr__(self):
         return f"<User {self.id}, {self.name}{self.discriminator}>"
 
@@ -1094,14 +1354,10 @@ class User:
             name (str): [The name of the embed]
         """
 
-        self._cursor.execute(
+        embed_id = self._db.execute(
             "INSERT INTO embeds (user_id, name) VALUES (%s, %s)", (self.id, name))
 
-        self._db.commit()
-
-        embed_id = self._cursor.lastrowid
-
-        return Embed(embed_id, self._db, self._cursor)
+        return Embed(embed_id, self._db)
 
     def get_logs(self, limit: int = 100, time: datetime.datetime = None, guild=None, channel=None, action=None) -> list:
         """Returns a list of log objects
@@ -1113,7 +1369,7 @@ class User:
             action (str, optional): [The action to filter by]. Defaults to None.
         """
 
-        query = "SELECT id FROM audit_log WHERE user_id = %s"
+        query = "WHERE user_id = %s"
         paramaters = (self.id,)
 
         if guild:
@@ -1132,27 +1388,16 @@ class User:
             query = query + " AND time > %s"
             paramaters = paramaters + (time,)
 
-        query = query + " ORDER BY time DESC"
-
-        if limit:
-            query = query + " LIMIT %s"
-            paramaters = paramaters + (limit,)
-
-        paramaters = paramaters
-
-        self._cursor.execute(query, paramaters)
-
-        log_ids = self._cursor.fetchall()
-        logs = [Log(id[0], self._db, self._cursor) for id in log_ids]
+        logs = Log._fetch(self._db, query, paramaters, order="time DESC", limit=limit)
 
         return logs
 
 
-class Channel:
-    def __init__(self, id, db, cursor):
-        self.id = id
-        self._db = db
-        self._cursor = cursor
+class Channel(Model):
+    __slots__ = ()
+
+    _table = 'channels'
+    _columns = ('guild_id', 'discord_id', 'name', 'muted_events', 'dynamic_voice_channel')
 
     @property
     def discord_id(self) -> int:
@@ -1162,12 +1407,7 @@ class Channel:
             int: [discord_id]
         """
 
-        self._cursor.execute(
-            "SELECT discord_id FROM channels WHERE id = %s", (self.id,))
-
-        discord_id = self._cursor.fetchone()[0]
-
-        return discord_id
+        return self._get('discord_id')
 
     @property
     def guild_id(self) -> int:
@@ -1177,12 +1417,7 @@ class Channel:
             int: [guild_id]
         """
 
-        self._cursor.execute(
-            "SELECT guild_id FROM channels WHERE id = %s", (self.id,))
-
-        guild_id = self._cursor.fetchone()[0]
-
-        return guild_id
+        return self._get('guild_id')
 
     @property
     def guild(self) -> 'Guild':
@@ -1192,7 +1427,7 @@ class Channel:
             Guild: [guild]
         """
 
-        return Guild(self.guild_id, self._db, self._cursor)
+        return Guild(self.guild_id, self._db)
 
     @property
     def name(self) -> str:
@@ -1202,12 +1437,7 @@ class Channel:
             str: [name]
         """
 
-        self._cursor.execute(
-            "SELECT name FROM channels WHERE id = %s", (self.id,))
-
-        name = self._cursor.fetchone()[0]
-
-        return name
+        return self._get('name')
 
     @property
     def muted_events(self) -> bool:
@@ -1217,12 +1447,7 @@ class Channel:
             bool: [muted_events]
         """
 
-        self._cursor.execute(
-            "SELECT muted_events FROM channels WHERE id = %s", (self.id,))
-
-        muted_events = self._cursor.fetchone()[0]
-
-        return muted_events
+        return self._get('muted_events')
 
     @muted_events.setter
     def muted_events(self, value: bool):
@@ -1232,10 +1457,11 @@ class Channel:
             value (bool): [muted_events]
         """
 
-        self._cursor.execute(
-            "UPDATE channels SET muted_events = %s WHERE id = %s", (value, self.id))
+        self._set('muted_events', value)
 
-        self._db.commit()
+        discord_id = self._get('discord_id')
+        self._db.after_commit(
+            lambda: MutedChannels.shared(self._db).set(discord_id, bool(value)))
 
     @property
     def dynamic_voice_channel(self) -> bool:
@@ -1245,12 +1471,7 @@ class Channel:
             bool: [dynamic_voice_channel]
         """
 
-        self._cursor.execute(
-            "SELECT dynamic_voice_channel FROM channels WHERE id = %s", (self.id,))
-
-        dynamic_voice_channel = self._cursor.fetchone()[0]
-
-        return dynamic_voice_channel
+        return self._get('dynamic_voice_channel')
 
     @dynamic_voice_channel.setter
     def dynamic_voice_channel(self, value: bool):
@@ -1260,10 +1481,7 @@ class Channel:
             value (bool): [value]
         """
 
-        self._cursor.execute(
-            "UPDATE channels SET dynamic_voice_channel = %s WHERE id = %s", (value, self.id))
-
-        self._db.commit()
+        self._set('dynamic_voice_channel', value)
 
     @property
     def games(self) -> list:
@@ -1273,13 +1491,10 @@ class Channel:
             list: [games]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM games WHERE channel_id = %s", (self.id,))
-
-        game_ids = self._cursor.fetchall()  # [(id,), (id, ) ...]
+        rows = self._db.fetchall(
+            Game._select("WHERE channel_id = %s"), (self.id,))
 
-        games = [Game(game_id[0], self._db, self._cursor)
-                 for game_id in game_ids]
+        games = Game._from_rows(rows, self._db)
 
         return games
 
@@ -1291,15 +1506,23 @@ class Channel:
             list: [logs]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM audit_log WHERE channel_id = %s", (self.id,))
+        logs = Log._fetch(self._db, "WHERE channel_id = %s", (self.id,))
 
-        log_ids = self._cursor.fetchall()
+        return logs
 
-        logs = [Log(id[0], self._db, self._cursor)
-                for id in log_ids]
+    def iter_logs(self, page_size: int = 1000, **filters):
+        """Yields the logs of the channel a page at a time from the database,
+        in constant memory
 
-        return logs
+        Args:
+            page_size (int, optional): [Logs fetched per query]. Defaults to 1000.
+            **filters: [newest_first, time, user or action, see Log.pages]
+
+        Yields:
+            Log: [Each matching log]
+        """
+
+        return Log.iterate(self._db, page_size, channel=self.id, **filters)
 
     def __hash__(self):
         return hash(self.id)
@@ -1308,11 +1531,11 @@ class Channel:
         return f'Channel({self.id, self.name})'
 
 
-class Guild:
-    def __init__(self, id: int, db, cursor):
-        self.id = id
-        self._db = db
-        self._cursor = cursor
+class Guild(Model):
+    __slots__ = ()
+
+    _table = 'guilds'
+    _columns = ('discord_id', 'name', 'member_count_channel', 'dynamic_voice_channel_id', 'dynamic_voice_channel_name', 'slash_commands')
 
     @property
     def discord_id(self) -> int:
@@ -1322,12 +1545,7 @@ class Guild:
             int: [discord_id]
         """
 
-        self._cursor.execute(
-            "SELECT discord_id FROM guilds WHERE id = %s", (self.id,))
-
-        discord_id = self._cursor.fetchone()[0]
-
-        return discord_id
+        return self._get('discord_id')
 
     @property
     def name(self) -> str:
@@ -1337,12 +1555,7 @@ class Guild:
             str: [name]
         """
 
-        self._cursor.execute(
-            "SELECT name FROM guilds WHERE id = %s", (self.id,))
-
-        name = self._cursor.fetchone()[0]
-
-        return name
+        return self._get('name')
 
     @name.setter
     def name(self, name: str):
@@ -1352,9 +1565,7 @@ class Guild:
             name (str): [name]
         """
 
-        self._cursor.execute(
-            "UPDATE guilds SET name = %s WHERE id = %s", (name, self.id))
-        self._db.commit()
+        self._set('name', name)
 
     @property
     def channels(self) -> set:
@@ -1364,13 +1575,10 @@ class Guild:
             set: [set of channels]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM channels WHERE guild_id = %s", (self.id,))
-
-        channel_ids = self._cursor.fetchall()
+        rows = self._db.fetchall(
+            Channel._select("WHERE guild_id = %s"), (self.id,))
 
-        channels = {Channel(id[0], self._db, self._cursor)
-                    for id in channel_ids}
+        channels = set(Channel._from_rows(rows, self._db))
 
         return channels
 
@@ -1383,13 +1591,7 @@ class Guild:
             int: [channel id]
         """
 
-        self._cursor.execute(
-            "SELECT member_count_channel FROM guilds WHERE id = %s",
-            (self.id,))
-
-        channel_id = self._cursor.fetchone()[0]
-
-        return channel_id
+        return self._get('member_count_channel')
 
     @member_count_channel.setter
     def member_count_channel(self, channel_id: int):
@@ -1400,10 +1602,7 @@ class Guild:
             channel_id (int): [channel id]
         """
 
-        self._cursor.execute(
-            "UPDATE guilds SET member_count_channel = %s WHERE id = %s",
-            (channel_id, self.id))
-        self._db.commit()
+        self._set('member_count_channel', channel_id)
 
     @property
     def dynamic_voice_channel_id(self) -> int:
@@ -1414,13 +1613,7 @@ class Guild:
             int: [channel id]
         """
 
-        self._cursor.execute(
-            "SELECT dynamic_voice_channel_id FROM guilds WHERE id = %s",
-            (self.id,))
-
-        channel_id = self._cursor.fetchone()[0]
-
-        return channel_id
+        return self._get('dynamic_voice_channel_id')
 
     @dynamic_voice_channel_id.setter
     def dynamic_voice_channel_id(self, channel_id: int):
@@ -1431,10 +1624,7 @@ class Guild:
             channel_id (int): [channel id]
         """
 
-        self._cursor.execute(
-            "UPDATE guilds SET dynamic_voice_channel_id = %s WHERE id = %s",
-            (channel_id, self.id))
-        self._db.commit()
+        self._set('dynamic_voice_channel_id', channel_id)
 
     @property
     def dynamic_voice_channel_name(self) -> str:
@@ -1445,13 +1635,7 @@ class Guild:
             str: [channel name]
         """
 
-        self._cursor.execute(
-            "SELECT dynamic_voice_channel_name FROM guilds WHERE id = %s",
-            (self.id,))
-
-        channel_name = self._cursor.fetchone()[0]
-
-        return channel_name
+        return self._get('dynamic_voice_channel_name')
 
     @dynamic_voice_channel_name.setter
     def dynamic_voice_channel_name(self, channel_name: str):
@@ -1462,10 +1646,7 @@ class Guild:
             channel_name (str): [channel name]
         """
 
-        self._cursor.execute(
-            "UPDATE guilds SET dynamic_voice_channel_name = %s WHERE id = %s",
-            (channel_name, self.id))
-        self._db.commit()
+        self._set('dynamic_voice_channel_name', channel_name)
 
     @property
     def dynamic_voice_channels(self) -> set:
@@ -1476,12 +1657,10 @@ class Guild:
             Set: [Set of Channel objects]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM channels WHERE guild_id = %s AND dynamic_voice_channel = 1",
+        rows = self._db.fetchall(
+            Channel._select("WHERE guild_id = %s AND dynamic_voice_channel = 1"),
             (self.id,))
-
-        channel_ids = self._cursor.fetchall()
-        channels = {Channel(id) for id in channel_ids}
+        channels = set(Channel._from_rows(rows, self._db))
 
         return channels
 
@@ -1494,13 +1673,14 @@ class Guild:
             channels (set): [Channel object]
         """
 
-        for channel in self.channels:
-            if channel in channels:
-                # Set channel to dynamic voice channel if it is in the set
-                channel.dynamic_voice_channel = True
-            else:
-                # Set channel to not dynamic voice channel if it is not in the set
-                channel.dynamic_voice_channel = False
+        with self._db.transaction():
+            for channel in self.channels:
+                if channel in channels:
+                    # Set channel to dynamic voice channel if it is in the set
+                    channel.dynamic_voice_channel = True
+                else:
+                    # Set channel to not dynamic voice channel if it is not in the set
+                    channel.dynamic_voice_channel = False
 
     @property
     def member_count_history(self) -> list:
@@ -1510,12 +1690,10 @@ class Guild:
             list: [list of member counts]
         """
 
-        self._cursor.execute(
+        member_counts = self._db.fetchall(
             "SELECT time, count FROM member_count_history WHERE guild_id = %s ORDER BY time DESC",
             (self.id,))
 
-        member_counts = self._cursor.fetchall()
-
         return member_counts
 
     @member_count_history.setter
@@ -1524,11 +1702,12 @@ class Guild:
 
         Args:
             member_counts (list): [list of member counts]
+
+        Raises:
+            ValueError: [If a count older than the point retention would change]
         """
 
         # Check for valid input
-        import datetime
-
         if not isinstance(member_counts, list):
             raise TypeError("member_counts must be a list")
 
@@ -1540,7 +1719,7 @@ class Guild:
                 raise ValueError(
                     "member_counts must be a list of tuples of length 2")
 
-            if not isinstance(member_count[0], datetime):
+            if not isinstance(member_count[0], datetime.datetime):
                 raise TypeError(
                     "member_counts must be a list of tuples of datetime objects")
 
@@ -1548,17 +1727,100 @@ class Guild:
                 raise TypeError(
                     "member_counts must be a list of tuples of ints")
 
-        # Delete old member count history
-        self._cursor.execute(
-            "DELETE FROM member_count_history WHERE guild_id = %s", (self.id,))
+        # Several points may share a time, so they are kept in order
+        new = {}  # time: [count]
+        for time, count in member_counts:
+            new.setdefault(time, []).append(count)
+
+        series = self.member_counts
+
+        with self._db.transaction():
+            current = {}  # time: [(id, count)]
+            for id, time, count in self._db.fetchall(
+                    "SELECT id, time, count FROM member_count_history WHERE guild_id = %s ORDER BY time, id",
+                    (self.id,)):
+                current.setdefault(time, []).append((id, count))
+
+            # Points at the same time are paired up by position, and only
+            # points that were removed, changed or added are touched
+            removed = []  # id
+            changed = []  # (count, id)
+            added = []  # (guild id, time, count)
+            touched = []
+
+            for time in current.keys() | new.keys():
+                rows = current.get(time, [])
+                counts = new.get(time, [])
+
+                for (id, count), new_count in zip(rows, counts):
+                    if count != new_count:
+                        changed.append((new_count, id))
+                        touched.append(time)
+
+                for id, count in rows[len(counts):]:
+                    removed.append(id)
+                    touched.append(time)
+
+                for count in counts[len(rows):]:
+                    added.append((self.id, time, count))
+                    touched.append(time)
+
+            # Older rollups can't be redone, their points may be gone
+            if touched and min(touched) < point_cutoff():
+                raise ValueError(
+                    "member counts older than the point retention can't be changed")
 
-        # Insert new member count history
-        for member_count in member_counts:
-            self._cursor.execute(
-                "INSERT INTO member_count_history (guild_id, time, count) VALUES (%s, %s, %s)",
-                (self.id, member_count[0], member_count[1]))
+            for chunk in _chunks(removed):
+                placeholders = ", ".join(["%s"] * len(chunk))
+                self._db.execute(
+                    f"DELETE FROM member_count_history WHERE id IN ({placeholders})", chunk)
+
+            if changed:
+                self._db.executemany(
+                    "UPDATE member_count_history SET count = %s WHERE id = %s", changed)
+
+            if added:
+                self._db.executemany(
+                    "INSERT INTO member_count_history (guild_id, time, count) VALUES (%s, %s, %s)",
+                    added)
+
+            # Rollups are redone from the earliest point that changed
+            if touched:
+                series.rebuild(min(touched))
+
+    @property
+    def log_retention(self) -> float:
+        """Returns how many days the guild's logs are kept
+
+        Returns:
+            float: [Days, None if they are kept forever]
+        """
+
+        return LogRetention.shared(self._db).get_days(self.id)
+
+    @log_retention.setter
+    def log_retention(self, days: int):
+        """Sets how many days the guild's logs are kept
+
+        Args:
+            days (int): [Days, None to keep them forever]
+        """
+
+        if days is not None and days <= 0:
+            raise ValueError("days must be greater than 0")
+
+        LogRetention.shared(self._db).set_days(self.id, days)
+
+    @property
+    def member_counts(self) -> MemberCountSeries:
+        """Returns the member count time series, which appends points and
+        serves minute, hour and day rollups
 
-        self._db.commit()
+        Returns:
+            MemberCountSeries: [Member counts of the guild]
+        """
+
+        return MemberCountSeries(self._db, self.id)
 
     @property
     def slash_commands(self) -> bool:
@@ -1568,13 +1830,7 @@ class Guild:
             bool: [True if enabled, False otherwise]
         """
 
-        self._cursor.execute(
-            "SELECT slash_commands FROM guilds WHERE id = %s",
-            (self.id,))
-
-        enabled = self._cursor.fetchone()[0]
-
-        return enabled
+        return self._get('slash_commands')
 
     @slash_commands.setter
     def slash_commands(self, enabled: bool):
@@ -1584,11 +1840,7 @@ class Guild:
             enabled (bool): [True if enabled, False otherwise]
         """
 
-        self._cursor.execute(
-            "UPDATE guilds SET slash_commands = %s WHERE id = %s",
-            (enabled, self.id))
-
-        self._db.commit()
+        self._set('slash_commands', enabled)
 
     @property
     def logs(self) -> list:
@@ -1598,14 +1850,24 @@ class Guild:
             list: [list of Log objects]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM audit_log WHERE guild_id = %s", (self.id,))
-
-        log_ids = self._cursor.fetchall()
-        logs = [Log(id[0], self._db, self._cursor) for id in log_ids]
+        logs = Log._fetch(self._db, "WHERE guild_id = %s", (self.id,))
 
         return logs
 
+    def iter_logs(self, page_size: int = 1000, **filters):
+        """Yields the logs of the guild a page at a time from the database, in
+        constant memory
+
+        Args:
+            page_size (int, optional): [Logs fetched per query]. Defaults to 1000.
+            **filters: [newest_first, time, user, channel or action, see Log.pages]
+
+        Yields:
+            Log: [Each matching log]
+        """
+
+        return Log.iterate(self._db, page_size, guild=self.id, **filters)
+
     @property
     def auto_mod(self) -> bool:
         """Returns AutoMod object
@@ -1614,12 +1876,26 @@ class Guild:
             AutoMod: [AutoMod object]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM auto_mod_config WHERE guild_id = %s", (self.id,))
+        row = self._db.fetchone(
+            AutoMod._select("WHERE guild_id = %s"), (self.id,))
 
-        auto_mod_id = self._cursor.fetchone()[0]
+        return AutoMod(row[0], self._db, row[1:])
 
-        return AutoMod(auto_mod_id, self._db, self._cursor)
+    @property
+    def config(self) -> GuildConfig:
+        """Returns a snapshot of the AutoMod settings, cached until they change
+
+        Returns:
+            GuildConfig: [AutoMod settings]
+        """
+
+        def load():
+            auto_mod = self.auto_mod
+
+            return GuildConfig(self.id, auto_mod.id, bool(auto_mod.enabled),
+                               auto_mod.anti_spam, auto_mod.rule_set)
+
+        return GuildConfig.cached(self._db, self.id, load)
 
     def __hash__(self):
         return hash(self.id)
@@ -1640,16 +1916,23 @@ class Guild:
             Channel: [Channel object]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM channels WHERE guild_id = %s AND discord_id = %s",
+        identity = IdentityMap.shared(self._db)
+
+        channel = identity.get(('channel', self.id, discord_id))
+        if channel is not None:
+            return channel
+
+        row = self._db.fetchone(
+            Channel._select("WHERE guild_id = %s AND discord_id = %s"),
             (self.id, discord_id))
 
-        try:
-            channel_id = self._cursor.fetchone()[0]
-        except TypeError:
+        if row is None:
             raise EntryNotFound("Channel is not a part of this guild")
 
-        return Channel(channel_id, self._db, self._cursor)
+        channel = Channel(row[0], self._db, row[1:])
+        identity.put(('channel', self.id, discord_id), channel)
+
+        return channel
 
     def add_channel(self, discord_id, name, **kwargs):
         """Adds a channel to the guild
@@ -1658,21 +1941,53 @@ class Guild:
             channel (Channel): [Channel object]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM channels WHERE guild_id = %s AND discord_id = %s", (self.id, discord_id))
+        identity = IdentityMap.shared(self._db)
 
-        if len(self._cursor.fetchall()) != 0:
+        if identity.get(('channel', self.id, discord_id)) is not None or self._db.fetchone(
+                "SELECT id FROM channels WHERE guild_id = %s AND discord_id = %s", (self.id, discord_id)) is not None:
             raise EntryAlreadyExists("Channel already exists in this guild")
 
         # Optional args
         dynamic_voice_channel = kwargs.get('dynamic_voice_channel', False)
 
-        self._cursor.execute(
+        channel_id = self._db.execute(
             "INSERT INTO channels (guild_id, discord_id, name, dynamic_voice_channel) VALUES (%s, %s, %s, %s)",
             (self.id, discord_id, name, dynamic_voice_channel))
-        self._db.commit()
 
-        return Channel(self._cursor.lastrowid, self._db, self._cursor)
+        channel = Channel(channel_id, self._db)
+        identity.put(('channel', self.id, discord_id), channel)
+
+        return channel
+
+    def get_or_create_channel(self, discord_id: int, name: str) -> 'Channel':
+        """Returns the channel with a discord id, adding it to the guild if it is missing
+
+        Uses one upsert on the unique (guild_id, discord_id) key, which also
+        updates the stored name.
+
+        Args:
+            discord_id (int): [discord id]
+            name (str): [Name of the channel]
+
+        Returns:
+            Channel: [Channel object]
+        """
+
+        identity = IdentityMap.shared(self._db)
+
+        channel = identity.get(('channel', self.id, discord_id))
+        if channel is not None and not channel._stale(name=name):
+            return channel
+
+        # An existing row reports its id as well
+        channel_id = self._db.upsert(
+            'channels', {'guild_id': self.id, 'discord_id': discord_id, 'name': name},
+            key=('guild_id', 'discord_id'), update=('name',))
+
+        channel = Channel(channel_id, self._db, known={'name': name})
+        identity.put(('channel', self.id, discord_id), channel)
+
+        return channel
 
     def remove_channel(self, discord_id):
         """Removes a channel from the guild
@@ -1681,24 +1996,159 @@ class Guild:
             channel (Channel): [Channel object]
         """
 
-        self._cursor.execute(
+        self._db.execute(
             "DELETE FROM channels WHERE guild_id = %s AND discord_id = %s",
             (self.id, discord_id))
-        self._db.commit()
+
+        def update_cache():
+            IdentityMap.shared(self._db).invalidate(('channel', self.id, discord_id))
+
+            # A removed channel can't stay muted
+            MutedChannels.shared(self._db).set(discord_id, False)
+
+        self._db.after_commit(update_cache)
+
+    def set_channels_muted(self, channels: list, muted: bool) -> list:
+        """Mutes or unmutes many channels at once, adding any that are missing
+
+        Uses one batched upsert, then a select and an update per chunk of
+        channels, all in one transaction.
+
+        Args:
+            channels (list): [(discord id, name) of each channel]
+            muted (bool): [Whether the channels should be muted]
+
+        Returns:
+            list: [discord ids of the channels that changed]
+        """
+
+        if not channels:
+            return []
+
+        # The cache is only updated once every statement has committed
+        with self._db.transaction():
+            self._db.executemany(
+                self._db.upsert_query(
+                    'channels', ('guild_id', 'discord_id', 'name'),
+                    key=('guild_id', 'discord_id'), update=('name',)),
+                [(self.id, discord_id, name) for discord_id, name in channels])
+
+            changed = []
+
+            for chunk in _chunks([discord_id for discord_id, name in channels]):
+                placeholders = ", ".join(["%s"] * len(chunk))
+
+                rows = self._db.fetchall(
+                    f"SELECT discord_id FROM channels WHERE guild_id = %s AND discord_id IN ({placeholders}) "
+                    "AND COALESCE(muted_events, 0) != %s",
+                    (self.id, *chunk, muted))
+                changed.extend(row[0] for row in rows)
+
+            for chunk in _chunks(changed):
+                placeholders = ", ".join(["%s"] * len(chunk))
+
+                self._db.execute(
+                    f"UPDATE channels SET muted_events = %s WHERE guild_id = %s AND discord_id IN ({placeholders})",
+                    (muted, self.id, *chunk))
+
+            def update_cache():
+                identity = IdentityMap.shared(self._db)
+                muted_channels = MutedChannels.shared(self._db)
+
+                for discord_id in changed:
+                    # Cached channels still hold the old value
+                    identity.invalidate(('channel', self.id, discord_id))
+                    muted_channels.set(discord_id, muted)
+
+            self._db.after_commit(update_cache)
+
+        return changed
 
 
 class Data:
-    def __init__(self):
-        load_dotenv()
+    def __init__(self, db: Database = None):
+        # Every Data object shares the process wide connection pool
+        self._db = Database.shared() if db is None else db
+
+        # Logs are buffered and written in batches
+        self._log_writer = LogWriter.shared(self._db)
+
+        # Users, guilds and channels are cached by discord id
+        self._identity = IdentityMap.shared(self._db)
+
+        # Muted channels are held in memory
+        self._muted = MutedChannels.shared(self._db)
+
+    def transaction(self):
+        """Groups writes into one commit, e.g.
+
+            def rename(guild, name):
+                with data.transaction():
+                    guild.name = name
+                    guild.slash_commands = True  # Sent with name in one UPDATE
+
+            await data.run(rename, guild, name)
+
+        Everything in the block is rolled back if it raises. The
+        transaction belongs to the thread that opened it, so run the block
+        with run rather than on the event loop.
+        """
+
+        return self._db.transaction()
+
+    async def run(self, func, *args, **kwargs):
+        """Runs a blocking database function on the database executor
+
+        Args:
+            func (callable): [Function that uses this Data object or its models]
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            Any: [Whatever func returns]
+        """
+
+        return await self._db.run(func, *args, **kwargs)
+
+    @property
+    def aio(self) -> 'AsyncModel':
+        """Returns an awaitable view of this object
+
+        Returns:
+            AsyncModel: [Awaitable Data object]
+        """
+
+        return AsyncModel(self, self)
 
-        self._db = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            passwd=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME"),
-        )
+    @property
+    def query_stats(self) -> QueryStats:
+        """Returns the counts, latencies and callers of every statement run
+
+        Returns:
+            QueryStats: [Query stats of the database]
+        """
 
-        self._cursor = self._db.cursor(buffered=True)
+        return self._db.stats
+
+    @property
+    def log_writer(self) -> LogWriter:
+        """Returns the writer logs are buffered in
+
+        Returns:
+            LogWriter: [Log writer]
+        """
+
+        return self._log_writer
+
+    @property
+    def pool(self) -> ConnectionPool:
+        """Returns the pool of database connections
+
+        Returns:
+            ConnectionPool: [Connection pool]
+        """
+
+        return self._db.pool
 
     @property
     def guild_discord_ids(self) -> list:
@@ -1708,9 +2158,7 @@ class Data:
             list: [list of guild ids]
         """
 
-        self._cursor.execute("SELECT discord_id FROM guilds")
-
-        discord_ids = self._cursor.fetchall()
+        discord_ids = self._db.fetchall("SELECT discord_id FROM guilds")
         discord_ids = [discord_id[0]
                        for discord_id in discord_ids]  # Convert to ints
 
@@ -1724,11 +2172,8 @@ class Data:
             List: [List of Guild objects]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM guilds")
-
-        guild_ids = self._cursor.fetchall()
-        guilds = [Guild(id[0], self._db, self._cursor) for id in guild_ids]
+        rows = self._db.fetchall(Guild._select(""))
+        guilds = Guild._from_rows(rows, self._db)
 
         return guilds
 
@@ -1740,10 +2185,8 @@ class Data:
             list: [list of guild ids]
         """
 
-        self._cursor.execute(
+        discord_ids = self._db.fetchall(
             "SELECT discord_id FROM guilds WHERE slash_commands = 1")
-
-        discord_ids = self._cursor.fetchall()
         discord_ids = [discord_id[0]
                        for discord_id in discord_ids]  # Convert to ints
 
@@ -1757,13 +2200,92 @@ class Data:
             list: [list of cog objects]
         """
 
-        self._cursor.execute("SELECT id FROM cogs")
-
-        cog_ids = self._cursor.fetchall()
-        cogs = [Cog(id[0], self._db, self._cursor) for id in cog_ids]
+        rows = self._db.fetchall(Cog._select(""))
+        cogs = Cog._from_rows(rows, self._db)
 
         return cogs
 
+    def apply_log_retention(self) -> dict:
+        """Moves logs past the hot window out of audit_log if LOG_HOT_DAYS is
+        set, removes logs past the retention of their guild and archives
+        finished months
+
+        Returns:
+            dict: [{'rolled': logs moved, 'pruned': logs removed, 'dropped': tables dropped,
+                    'archived': logs archived}]
+        """
+
+        return LogRetention.shared(self._db).run(archive=self.log_archive)
+
+    @property
+    def log_archive(self) -> LogArchive:
+        """Returns the archive old logs are moved to, set by LOG_ARCHIVE_DIR
+
+        Returns:
+            LogArchive: [Log archive, None if archiving is off]
+        """
+
+        directory = os.getenv("LOG_ARCHIVE_DIR")
+
+        if not directory:
+            return None
+
+        return LogArchive.shared(directory, ('id',) + Log._columns)
+
+    def archived_logs(self, **filters):
+        """Yields logs from the archive, blocks so iterate it on the database executor
+
+        Args:
+            **filters: [guild, user, channel, action, start or end, see LogArchive.query]
+
+        Yields:
+            dict: [Columns of each matching log]
+        """
+
+        archive = self.log_archive
+
+        if archive is not None:
+            yield from archive.query(**filters)
+
+    def record_member_counts(self, guilds: list):
+        """Adds a member count point for each guild in one transaction
+
+        Args:
+            guilds (list): [(discord id, name, member count) of each guild]
+        """
+
+        counts = [(self.get_or_create_guild(discord_id, name).id, count)
+                  for discord_id, name, count in guilds]
+
+        MemberCountSeries.append_many(self._db, counts)
+
+    def compact_member_counts(self) -> int:
+        """Drops member count points and rollups that are past their retention
+
+        Returns:
+            int: [Rows removed]
+        """
+
+        return MemberCountSeries.compact(self._db)
+
+    def load_muted_channels(self):
+        """Loads the muted channels into memory, later changes are tracked as
+        they are made"""
+
+        self._muted.load()
+
+    def is_muted(self, channel_id: int) -> bool:
+        """Returns if a channel is muted without querying the database
+
+        Args:
+            channel_id (int): [discord id of the channel]
+
+        Returns:
+            bool: [If the channel is muted]
+        """
+
+        return channel_id in self._muted
+
     @property
     def logs(self) -> list:
         """Returns a list of log objects
@@ -1772,13 +2294,49 @@ class Data:
             list: [list of log objects]
         """
 
-        self._cursor.execute("SELECT id FROM audit_log")
-
-        log_ids = self._cursor.fetchall()
-        logs = [Log(id[0], self._db, self._cursor) for id in log_ids]
+        logs = Log._fetch(self._db)
 
         return logs
 
+    def iter_logs(self, page_size: int = 1000, **filters):
+        """Yields logs a page at a time from the database, in constant memory.
+        Blocks on each page, so use stream_logs from the event loop
+
+        Args:
+            page_size (int, optional): [Logs fetched per query]. Defaults to 1000.
+            **filters: [newest_first, time, user, guild, channel or action, see Log.pages]
+
+        Yields:
+            Log: [Each matching log]
+        """
+
+        return Log.iterate(self._db, page_size, **filters)
+
+    async def stream_logs(self, page_size: int = 1000, **filters):
+        """Yields logs like iter_logs, fetching each page on the database executor
+
+            async for log in data.stream_logs(guild=guild.id, action="Message"):
+                ...
+
+        Args:
+            page_size (int, optional): [Logs fetched per query]. Defaults to 1000.
+            **filters: [newest_first, time, user, guild, channel or action, see Log.pages]
+
+        Yields:
+            Log: [Each matching log]
+        """
+
+        pages = Log.pages(self._db, page_size, **filters)
+
+        while True:
+            page = await self.run(next, pages, None)
+
+            if page is None:
+                return
+
+            for log in page:
+                yield log
+
     def get_guild(self, discord_id: int) -> Guild:
         """Returns Guild object from database
 
@@ -1789,15 +2347,20 @@ class Data:
             Guild: [Guild object]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM guilds WHERE discord_id = %s", (discord_id,))
+        guild = self._identity.get(('guild', discord_id))
+        if guild is not None:
+            return guild
 
-        try:
-            guild_id = self._cursor.fetchone()[0]
-        except TypeError:
+        row = self._db.fetchone(
+            Guild._select("WHERE discord_id = %s"), (discord_id,))
+
+        if row is None:
             raise EntryNotFound("Guild does not exist in the database")
 
-        return Guild(guild_id, self._db, self._cursor)
+        guild = Guild(row[0], self._db, row[1:])
+        self._identity.put(('guild', discord_id), guild)
+
+        return guild
 
     def add_guild(self, discord_id: int, name: str):
         """Adds a guild to the database
@@ -1810,24 +2373,23 @@ class Data:
             Guild: [Guild object]
         """
         # Check if guild is already in the database
-        self._cursor.execute(
-            "SELECT * FROM guilds WHERE discord_id = %s", (discord_id,))
-
-        if len(self._cursor.fetchall()) != 0:
+        if self._identity.get(('guild', discord_id)) is not None or self._db.fetchone(
+                "SELECT id FROM guilds WHERE discord_id = %s", (discord_id,)) is not None:
             raise EntryAlreadyExists(
                 f"Guild with id {discord_id} already exists in the database")
 
-        # Insert new guild
-        self._cursor.execute(
-            "INSERT INTO guilds (discord_id, name) VALUES (%s, %s)",
-            (discord_id, name))
+        # Insert new guild along with its AutoMod config
+        with self._db.transaction():
+            guild_id = self._db.execute(
+                "INSERT INTO guilds (discord_id, name) VALUES (%s, %s)",
+                (discord_id, name))
 
-        guild = Guild(self._cursor.lastrowid, self._db, self._cursor)
+            guild = Guild(guild_id, self._db)
 
-        self._cursor.execute(
-            "INSERT INTO auto_mod_config (guild_id) VALUES (%s)", (guild.id,))
+            self._db.execute(
+                "INSERT INTO auto_mod_config (guild_id) VALUES (%s)", (guild.id,))
 
-        self._db.commit()
+        self._identity.put(('guild', discord_id), guild)
 
         return guild
 
@@ -1838,15 +2400,13 @@ class Data:
             discord_id ([int]): [Id discord associates with each channel]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM channels WHERE discord_id = %s", (discord_id,))
+        row = self._db.fetchone(
+            Channel._select("WHERE discord_id = %s"), (discord_id,))
 
-        try:
-            channel_id = self._cursor.fetchone()[0]
-        except TypeError:
+        if row is None:
             raise EntryNotFound("Channel does not exist in the database")
 
-        return Channel(channel_id, self._db, self._cursor)
+        return Channel(row[0], self._db, row[1:])
 
     def add_channel(self, discord_id: int, name: str, **kwargs):
         """Adds a channel to the database
@@ -1856,10 +2416,8 @@ class Data:
             name (str): [Name of the channel]
         """
         # Check if channel is already in the database
-        self._cursor.execute(
-            "SELECT * FROM channels WHERE discord_id = %s", (discord_id,))
-
-        if len(self._cursor.fetchall()) != 0:
+        if self._db.fetchone(
+                "SELECT id FROM channels WHERE discord_id = %s", (discord_id,)) is not None:
             raise EntryAlreadyExists(
                 f"Channel with id {discord_id} already exists in the database")
 
@@ -1867,12 +2425,11 @@ class Data:
         dynamic_voice_channel = kwargs.get('dynamic_voice_channel', False)
 
         # Insert new channel
-        self._cursor.execute(
+        channel_id = self._db.execute(
             "INSERT INTO channels (discord_id, name, dynamic_voice_channel) VALUES (%s, %s, %s)",
             (discord_id, name, dynamic_voice_channel))
-        self._db.commit()
 
-        channel = Channel(self._cursor.lastrowid, self._db, self._cursor)
+        channel = Channel(channel_id, self._db)
 
         return channel
 
@@ -1886,15 +2443,20 @@ class Data:
             User: [User object]
         """
 
-        self._cursor.execute(
-            "SELECT id FROM users WHERE discord_id = %s", (discord_id,))
+        user = self._identity.get(('user', discord_id))
+        if user is not None:
+            return user
 
-        try:
-            user_id = self._cursor.fetchone()[0]
-        except TypeError:
+        row = self._db.fetchone(
+            User._select("WHERE discord_id = %s"), (discord_id,))
+
+        if row is None:
             raise EntryNotFound("User does not exist in the database")
 
-        return User(user_id, self._db, self._cursor)
+        user = User(row[0], self._db, row[1:])
+        self._identity.put(('user', discord_id), user)
+
+        return user
 
     def add_user(self, discord_id: int, name: str, discriminator: str):
         """Adds a user to the database
@@ -1905,23 +2467,117 @@ class Data:
             discriminator (str): [Discriminator of the user]
         """
         # Check if user is already in the database
-        self._cursor.execute(
-            "SELECT * FROM users WHERE discord_id = %s", (discord_id,))
-
-        if len(self._cursor.fetchall()) != 0:
+        if self._identity.get(('user', discord_id)) is not None or self._db.fetchone(
+                "SELECT id FROM users WHERE discord_id = %s", (discord_id,)) is not None:
             raise EntryAlreadyExists(
                 f"User with id {discord_id} already exists in the database")
 
         # Insert new user
-        self._cursor.execute(
+        user_id = self._db.execute(
             "INSERT INTO users (discord_id, name, discriminator) VALUES (%s, %s, %s)",
             (discord_id, name, discriminator))
-        self._db.commit()
 
-        user = User(self._cursor.lastrowid, self._db, self._cursor)
+        user = User(user_id, self._db)
+        self._identity.put(('user', discord_id), user)
 
         return user
 
+    def get_or_create_guild(self, discord_id: int, name: str) -> Guild:
+        """Returns the guild with a discord id, adding it if it is missing
+
+        Uses an upsert on the unique discord_id key, which also updates the
+        stored name, then an upsert of the AutoMod config on its unique
+        guild_id key. A cached guild whose name changed only needs the first.
+
+        Args:
+            discord_id (int): [Id discord associates with each guild]
+            name (str): [Name of the guild]
+
+        Returns:
+            Guild: [Guild object]
+        """
+
+        guild = self._identity.get(('guild', discord_id))
+        if guild is not None and not guild._stale(name=name):
+            return guild
+
+        # An existing row reports its id as well
+        guild_id = self._db.upsert(
+            'guilds', {'discord_id': discord_id, 'name': name},
+            key=('discord_id',), update=('name',))
+
+        # New guilds also need an AutoMod config, the unique guild_id key
+        # keeps concurrent calls from adding two
+        if guild is None:
+            self._db.upsert('auto_mod_config', {'guild_id': guild_id}, key=('guild_id',), returning=False)
+
+        guild = Guild(guild_id, self._db, known={'name': name})
+        self._identity.put(('guild', discord_id), guild)
+
+        return guild
+
+    def get_or_create_channel(self, guild: Guild, discord_id: int, name: str) -> Channel:
+        """Returns the channel with a discord id, adding it to the guild if it is missing
+
+        Args:
+            guild (Guild): [Guild the channel is in]
+            discord_id (int): [Id discord associates with each channel]
+            name (str): [Name of the channel]
+
+        Returns:
+            Channel: [Channel object]
+        """
+
+        return guild.get_or_create_channel(discord_id, name)
+
+    def get_or_create_user(self, discord_id: int, name: str, discriminator: str) -> User:
+        """Returns the user with a discord id, adding it if it is missing
+
+        Uses one upsert on the unique discord_id key, which also updates
+        the stored name and discriminator.
+
+        Args:
+            discord_id (int): [Id discord associates with each user]
+            name (str): [Name of the user]
+            discriminator (str): [Discriminator of the user]
+
+        Returns:
+            User: [User object]
+        """
+
+        user = self._identity.get(('user', discord_id))
+        if user is not None and not user._stale(name=name, discriminator=discriminator):
+            return user
+
+        # An existing row reports its id as well
+        user_id = self._db.upsert(
+            'users', {'discord_id': discord_id, 'name': name, 'discriminator': discriminator},
+            key=('discord_id',), update=('name', 'discriminator'))
+
+        user = User(user_id, self._db, known={'name': name, 'discriminator': discriminator})
+        self._identity.put(('user', discord_id), user)
+
+        return user
+
+    def resolve(self, author, guild, channel) -> tuple:
+        """Returns the database objects for a discord event, adding any that are missing
+
+        Args:
+            author (discord.User): [Author of the event]
+            guild (discord.Guild): [Guild the event happened in]
+            channel (discord.abc.GuildChannel): [Channel the event happened in]
+
+        Returns:
+            tuple: [(User, Guild, Channel)]
+        """
+
+        user = self.get_or_create_user(
+            author.id, author.name, author.discriminator)
+        guild_data = self.get_or_create_guild(guild.id, guild.name)
+        channel_data = guild_data.get_or_create_channel(channel.id, channel.name)
+
+        return user, guild_data, channel_data
+
     def get_cog(self, name: str) -> Cog:
         """Returns Cog object from database
 
@@ -1929,14 +2585,12 @@ class Data:
             name (str): [Name of the cog]
         """
 
-        self._cursor.execute("SELECT id FROM cogs WHERE name = %s", (name,))
+        row = self._db.fetchone(Cog._select("WHERE name = %s"), (name,))
 
-        try:  # Check if cog exists
-            cog_id = self._cursor.fetchone()[0]
-        except TypeError:
+        if row is None:  # Check if cog exists
             raise EntryNotFound("Cog does not exist in the database")
 
-        return Cog(cog_id, self._db, self._cursor)
+        return Cog(row[0], self._db, row[1:])
 
     def add_log(self, action: str, extra: str = None, **kwargs):
         """Adds a log to the database
@@ -1959,11 +2613,95 @@ class Data:
         # Get current time
         time = datetime.datetime.now()
 
-        # Insert new log
-        self._cursor.execute(
-            "INSERT INTO audit_log (time, action, extra, user_id, guild_id, channel_id, message_id, message_text) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+        # Queue the log, it is written with the next batch
+        self._log_writer.add(
             (time, action, extra, user_id, guild_id, channel_id, message_id, message_text))
-        self._db.commit()
+
+    def flush_logs(self, timeout: float = None) -> bool:
+        """Blocks until every log added so far is in the database
+
+        Args:
+            timeout (float, optional): [Most seconds to wait]. Defaults to None.
+
+        Returns:
+            bool: [False if the timeout ran out first]
+        """
+
+        return self._log_writer.flush(timeout)
+
+    def close(self, timeout: float = None) -> int:
+        """Writes any buffered logs and closes the database connections
+
+        Args:
+            timeout (float, optional): [Most seconds to wait for the logs]. Defaults to None.
+
+        Returns:
+            int: [Logs that couldn't be written in time]
+        """
+
+        unwritten = self._log_writer.close(timeout)
+        self._db.close()
+
+        return unwritten
+
+
+class AsyncModel:
+    """Awaitable view of a model object
+
+    Property reads and method calls are run on the database executor
+    instead of the event loop, e.g. `await (await guild.auto_mod).enabled`.
+    Model objects returned from the database are wrapped again.
+    """
+
+    def __init__(self, model, data: Data):
+        self._model = model
+        self._data = data
+
+    def __getattr__(self, name):
+        attr = getattr(type(self._model), name, None)
+
+        # Properties query the database, so they are awaited
+        if isinstance(attr, property):
+            return self._data.run(self._call, getattr, self._model, name)
+
+        value = getattr(self._model, name)
+
+        if callable(value):
+            async def method(*args, **kwargs):
+                return await self._data.run(self._call, value, *args, **kwargs)
+
+            return method
+
+        return value
+
+    async def set(self, name: str, value):
+        """Sets a property of the model on the database executor
+
+        Args:
+            name (str): [Name of the property]
+            value (Any): [Value to set]
+        """
+
+        await self._data.run(setattr, self._model, name, value)
+
+    def _call(self, func, *args, **kwargs):
+        return self._wrap(func(*args, **kwargs))
+
+    def _wrap(self, value):
+        if isinstance(value, MODELS):
+            return AsyncModel(value, self._data)
+
+        if isinstance(value, (list, set)):
+            return type(value)(self._wrap(item) for item in value)
+
+        return value
+
+    def __repr__(self):
+        # The model's own repr queries the database, so it isn't used here
+        return f"<AsyncModel {type(self._model).__name__} id={getattr(self._model, 'id', None)}>"
+
+
+MODELS = (CustomConfig, AutoMod, Log, Cog, Game, Embed, User, Channel, Guild, MemberCountSeries)
 
 
 if __name__ == "__main__":
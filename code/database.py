@@ -0,0 +1,618 @@
+import os
+from dotenv import load_dotenv
+
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import backends
+import schema
+from backends import Backend, MySQLBackend
+from exceptions import PoolExhausted
+from query_stats import QueryStats
+
+
+class ConnectionPool:
+    def __init__(self, connect, check=None, min_size: int = 1, max_size: int = 5,
+                 timeout: float = 10, check_interval: float = 30):
+        """Thread safe pool of database connections
+
+        Args:
+            connect (callable): [Returns a new connection]
+            check (callable, optional): [Raises if a connection is no longer usable]. Defaults to None.
+            min_size (int, optional): [Connections opened up front]. Defaults to 1.
+            max_size (int, optional): [Most connections open at once]. Defaults to 5.
+            timeout (float, optional): [Seconds to wait for a free connection]. Defaults to 10.
+            check_interval (float, optional): [Seconds a connection can sit idle before it is checked]. Defaults to 30.
+        """
+
+        if min_size > max_size:
+            raise ValueError("min_size must not be greater than max_size")
+
+        self._connect = connect
+        self._check = check
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+
+        self._idle = deque()  # (connection, time it was released)
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    @property
+    def size(self) -> int:
+        """Returns the number of open connections
+
+        Returns:
+            int: [open connections]
+        """
+
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        """Returns the number of connections waiting to be used
+
+        Returns:
+            int: [idle connections]
+        """
+
+        return len(self._idle)
+
+    @property
+    def in_use(self) -> int:
+        """Returns the number of connections currently checked out
+
+        Returns:
+            int: [connections in use]
+        """
+
+        return self._size - len(self._idle)
+
+    def acquire(self):
+        """Returns a healthy connection, opening one if none are idle
+
+        Raises:
+            PoolExhausted: [If no connection becomes free before the timeout]
+        """
+
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        raise PoolExhausted("Connection pool is closed")
+
+                    if self._idle:
+                        connection, released = self._idle.pop()
+                        break
+
+                    if self._size < self.max_size:
+                        # Reserve the slot before connecting outside the lock
+                        self._size += 1
+                        connection, released = None, None
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhausted(
+                            f"No database connection was free after {self.timeout} seconds")
+
+                    self._condition.wait(remaining)
+
+            if connection is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+
+            # Connections that sat idle may have been dropped by the server
+            if time.monotonic() - released < self.check_interval or self._healthy(connection):
+                return connection
+
+            self._discard(connection)
+
+    def release(self, connection, healthy: bool = True):
+        """Returns a connection to the pool
+
+        Args:
+            connection: [Connection from acquire]
+            healthy (bool, optional): [False to close the connection instead]. Defaults to True.
+        """
+
+        if not healthy or self._closed:
+            self._discard(connection)
+            return
+
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection for the duration of a with block"""
+
+        connection = self.acquire()
+
+        try:
+            yield connection
+        except Exception:
+            # A failed query might mean the connection was dropped
+            self.release(connection, healthy=self._healthy(connection))
+            raise
+        else:
+            self.release(connection)
+
+    def close(self):
+        """Closes every idle connection and stops handing out new ones"""
+
+        with self._condition:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._condition.notify_all()
+
+        for connection in idle:
+            self._discard(connection)
+
+    def _healthy(self, connection) -> bool:
+        if self._check is None:
+            return True
+
+        try:
+            self._check(connection)
+        except Exception:
+            return False
+
+        return True
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+        self._forget()
+
+    def _forget(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+
+class Transaction:
+    __slots__ = ('connection', 'writes', 'callbacks', 'rollbacks')
+
+    def __init__(self, connection):
+        """Work done on one connection and committed together
+
+        Args:
+            connection: [Connection the transaction runs on]
+        """
+
+        self.connection = connection
+        self.writes = {}  # (table, id): {column: value} not yet sent
+        self.callbacks = []  # Run once the transaction commits
+        self.rollbacks = []  # Run if the transaction is rolled back
+
+
+class Database:
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    # Connections kept for threads outside the executor, i.e. the log writer
+    BACKGROUND_CONNECTIONS = 1
+
+    def __init__(self, pool: ConnectionPool, backend: Backend = None, stats: QueryStats = None):
+        """Runs queries on connections drawn from a pool
+
+        Args:
+            pool (ConnectionPool): [Pool to draw connections from]
+            backend (Backend, optional): [Server the connections are to]. Defaults to MySQL.
+            stats (QueryStats, optional): [Records every statement run]. Defaults to recording on.
+        """
+
+        self._pool = pool
+        self._backend = MySQLBackend() if backend is None else backend
+        self._stats = QueryStats() if stats is None else stats
+
+        # The transaction each thread is running, if any
+        self._local = threading.local()
+
+        # One worker per connection, leaving connections for the background
+        # threads, so workers don't wait on acquire while another thread
+        # holds a connection
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, pool.max_size - self.BACKGROUND_CONNECTIONS), thread_name_prefix='data')
+
+    @classmethod
+    def shared(cls) -> 'Database':
+        """Returns the database used by the whole process, connecting on first use
+
+        Returns:
+            Database: [Shared database]
+        """
+
+        with cls._shared_lock:
+            if cls._shared is None:
+                load_dotenv()
+
+                # DB_BACKEND picks MySQL, a SQLite file or memory
+                backend = backends.from_env()
+
+                pool = ConnectionPool(
+                    connect=backend.connect,
+                    check=backend.check,
+                    min_size=min(int(os.getenv("DB_POOL_MIN", 1)), backend.max_size),
+                    max_size=backend.max_size,
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+                    check_interval=float(os.getenv("DB_POOL_CHECK_INTERVAL", 30)),
+                )
+
+                # DB_STATS=0 turns off per statement timing
+                cls._shared = cls(pool, backend, QueryStats.from_env())
+
+                # DB_MIGRATE=0 leaves a large database to be migrated by hand
+                if os.getenv("DB_MIGRATE", "1") != "0":
+                    try:
+                        schema.migrate(cls._shared)
+                    except Exception as error:
+                        # The bot still runs on the schema it has, verify says what is missing
+                        print(f"Schema migration failed: {error}")
+
+                for problem in schema.verify(cls._shared):
+                    print(f"Schema problem: {problem}")
+
+            return cls._shared
+
+    @property
+    def backend(self) -> Backend:
+        """Returns the backend the database runs on
+
+        Returns:
+            Backend: [Database backend]
+        """
+
+        return self._backend
+
+    @property
+    def pool(self) -> ConnectionPool:
+        """Returns the connection pool
+
+        Returns:
+            ConnectionPool: [Connection pool]
+        """
+
+        return self._pool
+
+    @property
+    def stats(self) -> QueryStats:
+        """Returns the counts and latencies of the statements run
+
+        Returns:
+            QueryStats: [Query stats]
+        """
+
+        return self._stats
+
+    @property
+    def in_transaction(self) -> bool:
+        """Returns if this thread is inside a transaction
+
+        Returns:
+            bool: [If a transaction is open]
+        """
+
+        return getattr(self._local, 'transaction', None) is not None
+
+    @contextmanager
+    def transaction(self):
+        """Runs every statement in the with block on one connection and commits
+        them together, or rolls them all back if the block raises
+
+        Column updates are held until the next statement or the commit and
+        updates to the same row are merged into one UPDATE. Transactions
+        belong to the thread that opened them, so blocking code using one
+        should be run with run. Nested blocks join the outer transaction.
+        """
+
+        current = getattr(self._local, 'transaction', None)
+
+        if current is not None:
+            yield current
+            return
+
+        connection = self._pool.acquire()
+        transaction = Transaction(connection)
+        self._local.transaction = transaction
+
+        healthy = True
+
+        try:
+            self._backend.begin(connection)
+
+            yield transaction
+
+            self._flush(transaction)
+            connection.commit()
+        except BaseException:
+            try:
+                connection.rollback()
+            except Exception:
+                healthy = False
+
+            # Objects changed in the block no longer match the database
+            for callback in transaction.rollbacks:
+                callback()
+
+            raise
+        finally:
+            self._local.transaction = None
+            self._pool.release(connection, healthy=healthy)
+
+        for callback in transaction.callbacks:
+            callback()
+
+    def after_commit(self, callback):
+        """Runs a callback once the current transaction commits, or now if
+        there is no transaction
+
+        Args:
+            callback (callable): [Function taking no arguments]
+        """
+
+        transaction = getattr(self._local, 'transaction', None)
+
+        if transaction is None:
+            callback()
+        else:
+            transaction.callbacks.append(callback)
+
+    def after_rollback(self, callback):
+        """Runs a callback if the current transaction is rolled back, does
+        nothing if there is no transaction
+
+        Args:
+            callback (callable): [Function taking no arguments]
+        """
+
+        transaction = getattr(self._local, 'transaction', None)
+
+        if transaction is not None:
+            transaction.rollbacks.append(callback)
+
+    @contextmanager
+    def cursor(self):
+        """Checks out a connection and yields a cursor on it, using the
+        connection of the current transaction if there is one"""
+
+        transaction = getattr(self._local, 'transaction', None)
+
+        if transaction is not None:
+            # Held updates are sent first so statements run in order
+            self._flush(transaction)
+
+            cursor = self._stats.wrap(self._backend.cursor(transaction.connection))
+
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+            return
+
+        with self._pool.connection() as connection:
+            cursor = self._stats.wrap(self._backend.cursor(connection))
+
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def execute(self, query: str, params: tuple = ()) -> int:
+        """Runs a statement
+
+        Args:
+            query (str): [SQL statement]
+            params (tuple, optional): [Statement parameters]. Defaults to ().
+
+        Returns:
+            int: [Id of the inserted row, if any]
+        """
+
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+
+            return cursor.lastrowid
+
+    def executemany(self, query: str, seq_params: list) -> int:
+        """Runs a statement once for each set of parameters
+
+        Args:
+            query (str): [SQL statement]
+            seq_params (list): [List of statement parameters]
+
+        Returns:
+            int: [Number of affected rows]
+        """
+
+        with self.cursor() as cursor:
+            cursor.executemany(query, seq_params)
+
+            return cursor.rowcount
+
+    def upsert(self, table: str, values: dict, key: tuple, update=(), returning: bool = True) -> int:
+        """Inserts a row, or updates the row with the same unique key
+
+        Args:
+            table (str): [Table to insert into]
+            values (dict): [{column: value} of the row]
+            key (tuple): [Columns of the unique key]
+            update (tuple or dict, optional): [Columns to update on an existing row, see Backend.upsert]. Defaults to ().
+            returning (bool, optional): [Report the id of the row, False for tables without one]. Defaults to True.
+
+        Returns:
+            int: [Id of the inserted or existing row, None if returning is False]
+        """
+
+        query = self._backend.upsert(table, tuple(values), key, update, returning=returning)
+
+        with self.cursor() as cursor:
+            cursor.execute(query, tuple(values.values()))
+
+            if not returning:
+                return None
+
+            if self._backend.returns_id():
+                return cursor.fetchone()[0]
+
+            return cursor.lastrowid
+
+    def upsert_query(self, table: str, columns: tuple, key: tuple, update=()) -> str:
+        """Returns an upsert for executemany, see Backend.upsert
+
+        Returns:
+            str: [SQL statement]
+        """
+
+        return self._backend.upsert(table, columns, key, update)
+
+    def tables(self, prefix: str) -> list:
+        """Returns the names of the tables starting with a prefix
+
+        Args:
+            prefix (str): [Start of the table names]
+
+        Returns:
+            list: [Table names]
+        """
+
+        return [row[0] for row in self.fetchall(self._backend.tables(prefix))]
+
+    def indexes(self, table: str) -> list:
+        """Returns the indexes of a table, including unique keys
+
+        Args:
+            table (str): [Table to look at]
+
+        Returns:
+            list: [(name, columns tuple, unique) of each index]
+        """
+
+        with self.cursor() as cursor:
+            return self._backend.indexes(cursor, table)
+
+    def create_table_like(self, table: str, source: str):
+        """Creates an empty table with the columns of another, if it doesn't exist
+
+        Args:
+            table (str): [Table to create]
+            source (str): [Table to copy the columns of]
+        """
+
+        with self.cursor() as cursor:
+            self._backend.create_table_like(cursor, table, source)
+
+    def update(self, table: str, id: int, column: str, value):
+        """Sets one column of a row, held and merged with other updates to the
+        row when inside a transaction
+
+        Args:
+            table (str): [Table of the row]
+            id (int): [Id of the row]
+            column (str): [Column to set]
+            value: [New value]
+        """
+
+        transaction = getattr(self._local, 'transaction', None)
+
+        if transaction is None:
+            self.execute(
+                f"UPDATE {table} SET {column} = %s WHERE id = %s", (value, id))
+            return
+
+        transaction.writes.setdefault((table, id), {})[column] = value
+
+    def fetchone(self, query: str, params: tuple = ()) -> tuple:
+        """Runs a query and returns the first row
+
+        Args:
+            query (str): [SQL query]
+            params (tuple, optional): [Query parameters]. Defaults to ().
+
+        Returns:
+            tuple: [First row or None]
+        """
+
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+
+            return cursor.fetchone()
+
+    def fetchall(self, query: str, params: tuple = ()) -> list:
+        """Runs a query and returns every row
+
+        Args:
+            query (str): [SQL query]
+            params (tuple, optional): [Query parameters]. Defaults to ().
+
+        Returns:
+            list: [List of rows]
+        """
+
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+
+            return cursor.fetchall()
+
+    async def run(self, func, *args, **kwargs):
+        """Runs a blocking function on the database executor
+
+        Args:
+            func (callable): [Function that queries the database]
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            Any: [Whatever func returns]
+        """
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    def _flush(self, transaction: Transaction):
+        if not transaction.writes:
+            return
+
+        writes, transaction.writes = transaction.writes, {}
+
+        cursor = self._stats.wrap(self._backend.cursor(transaction.connection))
+
+        try:
+            for (table, id), columns in writes.items():
+                assignments = ", ".join(f"{column} = %s" for column in columns)
+
+                cursor.execute(
+                    f"UPDATE {table} SET {assignments} WHERE id = %s", (*columns.values(), id))
+        finally:
+            cursor.close()
+
+    def close(self):
+        """Waits for queued work and closes every connection"""
+
+        self._executor.shutdown(wait=True)
+        self._pool.close()
@@ -14,3 +14,12 @@ class EntryAlreadyExists(Exception):
         super().__init__(message)
 
         self.message = message
+
+
+class PoolExhausted(Exception):
+    """Raised when no database connection becomes free before the pool timeout."""
+
+    def __init__(self, message):
+        super().__init__(message)
+
+        self.message = message
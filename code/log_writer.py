@@ -0,0 +1,254 @@
+import os
+import queue
+import threading
+import time
+import weakref
+
+from database import Database
+
+
+INSERT_LOG = "INSERT INTO audit_log (time, action, extra, user_id, guild_id, channel_id, message_id, message_text) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+
+
+class _Flush:
+    def __init__(self, stop: bool = False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class LogWriter:
+    _shared = weakref.WeakKeyDictionary()
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db: Database, batch_size: int = 200, flush_interval: float = 1,
+                 max_queue: int = 10000, put_timeout: float = 0.5):
+        """Buffers audit log rows and writes them in multi-row inserts from a background thread
+
+        Args:
+            db (Database): [Database to write to]
+            batch_size (int, optional): [Rows that trigger a write]. Defaults to 200.
+            flush_interval (float, optional): [Most seconds a row waits before it is written]. Defaults to 1.
+            max_queue (int, optional): [Rows that can be buffered before callers wait]. Defaults to 10000.
+            put_timeout (float, optional): [Seconds a caller waits on a full queue before the row is dropped]. Defaults to 0.5.
+        """
+
+        self._db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+
+        self._stats = {
+            'enqueued': 0,  # rows accepted
+            'written': 0,  # rows inserted
+            'batches': 0,  # inserts run
+            'blocked': 0,  # rows that had to wait for space in the queue
+            'dropped': 0,  # rows lost to a full queue
+            'failed': 0,  # rows lost to a failed insert
+            'max_depth': 0,  # most rows buffered at once
+        }
+        self._stats_lock = threading.Lock()
+
+        self._thread = threading.Thread(
+            target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def shared(cls, db: Database) -> 'LogWriter':
+        """Returns the log writer for a database, starting it on first use
+
+        Args:
+            db (Database): [Database to write to]
+
+        Returns:
+            LogWriter: [Log writer]
+        """
+
+        with cls._shared_lock:
+            if db not in cls._shared:
+                cls._shared[db] = cls(
+                    db,
+                    batch_size=int(os.getenv("LOG_BATCH_SIZE", 200)),
+                    flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", 1)),
+                    max_queue=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+                )
+
+            return cls._shared[db]
+
+    @property
+    def depth(self) -> int:
+        """Returns the number of rows waiting to be written
+
+        Returns:
+            int: [queue depth]
+        """
+
+        return self._queue.qsize()
+
+    @property
+    def stats(self) -> dict:
+        """Returns counters for the writer
+
+        Returns:
+            dict: [counter name to value, plus the current depth]
+        """
+
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        stats['depth'] = self.depth
+
+        return stats
+
+    def add(self, row: tuple):
+        """Queues a row to be written
+
+        Args:
+            row (tuple): [(time, action, extra, user_id, guild_id, channel_id, message_id, message_text)]
+        """
+
+        if self._closed:
+            # Nothing is left to flush the queue, so write straight away
+            self._write([row])
+            return
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('blocked')
+
+            try:
+                self._queue.put(row, timeout=self.put_timeout)
+            except queue.Full:
+                self._count('dropped')
+                return
+
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            self._stats['max_depth'] = max(
+                self._stats['max_depth'], self._queue.qsize())
+
+    def flush(self, timeout: float = None) -> bool:
+        """Blocks until every row queued so far has been written
+
+        Args:
+            timeout (float, optional): [Most seconds to wait]. Defaults to None.
+
+        Returns:
+            bool: [False if the timeout ran out first]
+        """
+
+        if self._closed:
+            return True
+
+        marker = _Flush()
+        self._queue.put(marker)
+
+        return marker.done.wait(timeout)
+
+    def close(self, timeout: float = None) -> int:
+        """Writes every queued row and stops the writer thread
+
+        The writer stays open if the timeout runs out, so no queued row is
+        dropped and close can be called again.
+
+        Args:
+            timeout (float, optional): [Most seconds to wait]. Defaults to None.
+
+        Returns:
+            int: [Rows still waiting to be written, 0 once the writer is closed]
+        """
+
+        if self._closed:
+            return 0
+
+        try:
+            self._queue.put(_Flush(stop=True), timeout=timeout)
+        except queue.Full:
+            return self._pending()
+
+        self._thread.join(timeout)
+
+        if self._thread.is_alive():
+            return self._pending()
+
+        self._closed = True
+
+        # Rows added after the stop marker are written here
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if isinstance(item, _Flush):
+                item.done.set()
+            else:
+                batch.append(item)
+
+        self._write(batch)
+
+        return 0
+
+    def _run(self):
+        batch = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(
+                0, deadline - time.monotonic())
+
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # The oldest row has waited flush_interval seconds
+                self._write(batch)
+                batch, deadline = [], None
+                continue
+
+            if isinstance(item, _Flush):
+                self._write(batch)
+                batch, deadline = [], None
+                item.done.set()
+
+                if item.stop:
+                    return
+
+                continue
+
+            batch.append(item)
+
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch, deadline = [], None
+
+    def _write(self, batch: list):
+        if not batch:
+            return
+
+        try:
+            # mysql.connector turns this into a single multi-row INSERT
+            self._db.executemany(INSERT_LOG, batch)
+        except Exception as error:
+            self._count('failed', len(batch))
+            print(f"Failed to write {len(batch)} logs: {error}")
+            return
+
+        with self._stats_lock:
+            self._stats['written'] += len(batch)
+            self._stats['batches'] += 1
+
+    def _pending(self) -> int:
+        # Queued rows, leaving out flush markers
+        with self._queue.mutex:
+            return sum(not isinstance(item, _Flush) for item in self._queue.queue)
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[name] += amount
@@ -0,0 +1,227 @@
+import asyncio
+import datetime
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+
+STACK_LIMIT = 20  # Innermost frames kept from each stack
+
+
+class SlowCall:
+    __slots__ = ('time', 'kind', 'handler', 'seconds', 'stack')
+
+    def __init__(self, kind: str, handler: str, seconds: float, stack: str):
+        """A handler that held up the bot
+
+        Args:
+            kind (str): ['blocked' if it stopped the event loop, 'slow' if it took too long while awaiting]
+            handler (str): [Name of the handler, e.g. AutoMod.on_message_context, None if unknown]
+            seconds (float): [How long it took]
+            stack (str): [Stack captured while it was running]
+        """
+
+        self.time = datetime.datetime.now()
+        self.kind = kind
+        self.handler = handler
+        self.seconds = seconds
+        self.stack = stack
+
+
+class LoopMonitor:
+    def __init__(self, threshold: float = 0.5, interval: float = 0.1, size: int = 50):
+        """Watches the event loop for blocking calls and handlers that run long
+
+        A coroutine on the loop marks a heartbeat every interval. A thread
+        checks the heartbeat and, if the loop has been stuck for longer than
+        threshold, captures the loop thread's stack, which shows the
+        blocking call itself. Handlers are also timed, and any that take
+        longer than threshold while awaiting have the stack they were
+        waiting at captured. Both are kept in a ring buffer of size entries.
+
+        Args:
+            threshold (float, optional): [Seconds before a handler or stall is recorded]. Defaults to 0.5.
+            interval (float, optional): [Seconds between heartbeats]. Defaults to 0.1.
+            size (int, optional): [Most slow calls kept]. Defaults to 50.
+        """
+
+        self.threshold = threshold
+        self.interval = interval
+
+        self.lag = 0.0  # Seconds, as of the last heartbeat
+        self.max_lag = 0.0
+
+        self._calls = deque(maxlen=size)
+        self._handlers = {}  # code object: handler name, to name blocked stacks
+        self._lock = threading.Lock()
+
+        self._loop_thread = None
+        self._beat = time.monotonic()
+        self._stall = None  # SlowCall of the stall in progress
+        self._blocked = {}  # handler name: time.monotonic() it was last caught blocking
+        self._started = False
+
+    @classmethod
+    def from_env(cls) -> 'LoopMonitor':
+        """Returns a monitor configured by WATCHDOG_THRESHOLD, WATCHDOG_INTERVAL and WATCHDOG_SIZE"""
+
+        return cls(
+            threshold=float(os.getenv("WATCHDOG_THRESHOLD", 0.5)),
+            interval=float(os.getenv("WATCHDOG_INTERVAL", 0.1)),
+            size=int(os.getenv("WATCHDOG_SIZE", 50)),
+        )
+
+    @property
+    def calls(self) -> list:
+        """Returns the slow calls recorded, newest first
+
+        Returns:
+            list: [SlowCall]
+        """
+
+        with self._lock:
+            return list(reversed(self._calls))
+
+    def clear(self):
+        """Forgets the slow calls recorded and the largest lag seen"""
+
+        with self._lock:
+            self._calls.clear()
+
+        self.max_lag = 0.0
+
+    async def run(self):
+        """Measures loop lag until cancelled, call once from the event loop"""
+
+        if self._started:
+            return
+
+        self._started = True
+
+        loop = asyncio.get_running_loop()
+
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+
+        threading.Thread(target=self._watch, name='loop-monitor', daemon=True).start()
+
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+
+            # Anything past the interval is time the loop spent busy elsewhere
+            self.lag = max(loop.time() - start - self.interval, 0)
+            self.max_lag = max(self.max_lag, self.lag)
+            metrics.LOOP_LAG.set(self.lag)
+
+            with self._lock:
+                self._beat = time.monotonic()
+
+                # The stall is over, so its full length is known
+                if self._stall is not None:
+                    self._stall.seconds = self.lag
+                    self._stall = None
+
+    @contextmanager
+    def handler(self, name: str, function=None):
+        """Times a handler, recording it if it runs longer than the threshold
+
+        Args:
+            name (str): [Name of the handler, e.g. Chat.mute_channel]
+            function (callable, optional): [Handler function, lets stacks of a blocked loop be named]. Defaults to None.
+        """
+
+        code = getattr(getattr(function, '__func__', function), '__code__', None)
+        if code is not None:
+            self._handlers[code] = name
+
+        task = asyncio.current_task()
+        stack = []
+
+        def capture():
+            # The loop is free, so the task is waiting on something
+            stack.append(_task_stack(task))
+
+        timer = None
+        if task is not None:
+            timer = asyncio.get_running_loop().call_later(self.threshold, capture)
+
+        start = time.monotonic()
+
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - start
+
+            if timer is not None:
+                timer.cancel()
+
+            # A handler that blocked the loop was already caught by the watcher
+            if seconds > self.threshold and self._blocked.get(name, 0) < start:
+                self._record(SlowCall('slow', name, seconds, stack[0] if stack else ""))
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+
+            with self._lock:
+                stalled = time.monotonic() - self._beat
+                reported = self._stall is not None
+
+            if reported or stalled < self.threshold + self.interval:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+
+            if frame is None:
+                return  # The loop thread has exited
+
+            call = SlowCall('blocked', self._handler_of(frame), stalled, _format(traceback.extract_stack(frame)))
+
+            with self._lock:
+                self._stall = call
+                self._blocked[call.handler] = time.monotonic()
+
+            self._record(call)
+
+    def _handler_of(self, frame) -> str:
+        name = None
+
+        # The outermost known handler is the one the event started in
+        while frame is not None:
+            name = self._handlers.get(frame.f_code, name)
+            frame = frame.f_back
+
+        return name
+
+    def _record(self, call: SlowCall):
+        with self._lock:
+            self._calls.append(call)
+
+        metrics.SLOW_HANDLERS.inc(kind=call.kind)
+
+
+def _task_stack(task) -> str:
+    frames = []
+    awaiting = task.get_coro()
+
+    # Follow what each coroutine is awaiting down to where the task is waiting
+    while awaiting is not None:
+        frame = getattr(awaiting, 'cr_frame', None) or getattr(awaiting, 'gi_frame', None)
+
+        if frame is not None:
+            frames.append((frame, frame.f_lineno))
+
+        awaiting = getattr(awaiting, 'cr_await', None) or getattr(awaiting, 'gi_yieldfrom', None)
+
+    return _format(traceback.StackSummary.extract(frames))
+
+
+def _format(stack) -> str:
+    return "".join(traceback.format_list(stack[-STACK_LIMIT:]))
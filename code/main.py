@@ -1,27 +1,71 @@
 from urllib import response
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import ExtensionNotFound, ExtensionAlreadyLoaded, ExtensionNotLoaded
 from discord.commands import Option, permissions
 
+import asyncio
 import os
 from dotenv import load_dotenv
 
 from exceptions import *
 from data import Data
+from context import MessageContext
+import metrics
+from loop_monitor import LoopMonitor
 
 from cogs.logging import Logging
 
 
-data = Data()  # Connect to database
+data = Data()  # Uses the shared connection pool
+
+# Catches handlers that block the event loop
+monitor = LoopMonitor.from_env()
+
+
+class Bot(commands.Bot):
+    """Bot that records how often each event fires and how long its handlers take"""
+
+    def dispatch(self, event_name, *args, **kwargs):
+        metrics.EVENTS.inc(event=f'on_{event_name}')
+
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        labels = metrics.handler_labels(coro)
+
+        # Every listener, including those in cogs, is run through here
+        with metrics.HANDLER_SECONDS.time(**labels), monitor.handler(labels['handler'], coro):
+            await super()._run_event(coro, event_name, *args, **kwargs)
+
+    async def invoke_application_command(self, ctx):
+        cog = ctx.command.cog
+        callback = ctx.command.callback
+
+        with metrics.HANDLER_SECONDS.time(
+                cog=type(cog).__name__ if cog is not None else 'main',
+                handler=ctx.command.qualified_name), \
+                monitor.handler(callback.__qualname__, callback):
+            await super().invoke_application_command(ctx)
 
 
 INTENTS = discord.Intents.all()  # Initialize Discord Bot
-client = commands.Bot(
+client = Bot(
     command_prefix='.',
     intents=INTENTS
 )
 
+# Read on each scrape
+metrics.REGISTRY.register(metrics.Gauge(
+    'bot_log_writer_queue_depth', "Logs waiting to be written",
+    function=lambda: data.log_writer.depth))
+metrics.REGISTRY.register(metrics.Gauge(
+    'bot_db_pool_connections', "Database connections by state", ('state',),
+    function=lambda: {('in_use',): data.pool.in_use, ('idle',): data.pool.idle}))
+metrics.REGISTRY.register(metrics.Gauge(
+    'bot_db_pool_max_connections', "Most database connections the pool opens",
+    function=lambda: data.pool.max_size))
+
 # LOADS COG
 
 
@@ -159,7 +203,8 @@ async def auto_load(
     """
 
     try:
-        data.get_cog(name).enabled = enabled
+        cog = await data.aio.get_cog(name)
+        await cog.set('enabled', enabled)
     except EntryNotFound:  # If the cog doesn't exist send an error message
         response = discord.Embed(
             title='Extension Not Found',
@@ -214,17 +259,166 @@ async def shutdown(ctx):
     await Logging.log_command(ctx, action='Command',
                               extra=f"User shutdown bot: {ctx.author.name}")
 
+    # Write out buffered logs before the client stops, off the event loop
+    if not await data.run(data.flush_logs, 30):
+        print(f"{data.log_writer.depth} logs were not written before shutdown")
+
+    # The database is closed once client.run returns
     await client.close()
 
 
+@client.slash_command(guild_ids=data.enabled_slash, name='dbstats', default_permission=False)
+@permissions.is_user(int(os.getenv("BOT_OWNER_ID")))
+async def dbstats(
+    ctx,
+    sort: Option(str, "What to rank statements by", required=False, default='total',
+                 choices=['total', 'calls', 'mean', 'max', 'rows']),
+    limit: Option(int, "Statements to show (1-10)", required=False, default=5),
+    reset: Option(bool, "Clear the stats after showing them", required=False, default=False)
+):
+    """
+    Shows the database statements that take the most time
+    """
+    stats = data.query_stats
+    limit = max(1, min(limit, 10))
+
+    response = discord.Embed(
+        title='Database Stats',
+        description=f'Top {limit} statements by {sort}',
+        color=0x00ff00
+    )
+
+    for statement in stats.statements(sort=sort, limit=limit):
+        callers = sorted(statement.callers.items(), key=lambda caller: caller[1], reverse=True)
+        callers = ", ".join(f"{caller} ({calls})" for caller, calls in callers[:3])
+
+        response.add_field(
+            name=statement.statement[:250],
+            value=f'`{statement.calls}` calls, `{statement.total * 1000:.0f}ms` total, '
+                  f'p50 `{statement.percentile(50) * 1000:.1f}ms`, p95 `{statement.percentile(95) * 1000:.1f}ms`, '
+                  f'max `{statement.max * 1000:.1f}ms`, `{statement.rows}` rows\n'
+                  f'{callers or "No caller"}'[:1024],
+            inline=False
+        )
+
+    # Methods running many statements are where N+1 queries hide
+    callers = stats.callers(limit=5)
+    if callers:
+        response.add_field(
+            name='Busiest Callers',
+            value="\n".join(f'`{caller}`: {calls} calls, {statements} statements'
+                            for caller, calls, statements in callers)[:1024],
+            inline=False
+        )
+
+    if reset:
+        stats.reset()
+
+    response = await ctx.respond(embed=response, ephemeral=True)
+
+    await Logging.log_command(ctx, action='Command',
+                              extra=f"{ctx.author.name} viewed database stats")
+
+
+@client.slash_command(guild_ids=data.enabled_slash, name='slow_handlers', default_permission=False)
+@permissions.is_user(int(os.getenv("BOT_OWNER_ID")))
+async def slow_handlers(
+    ctx,
+    limit: Option(int, "Slow calls to show (1-5)", required=False, default=3),
+    clear: Option(bool, "Clear the slow calls after showing them", required=False, default=False)
+):
+    """
+    Shows the handlers that recently blocked the bot or ran too long
+    """
+    calls = monitor.calls[:max(1, min(limit, 5))]
+
+    response = discord.Embed(
+        title='Slow Handlers',
+        description=f'Event loop lag `{monitor.lag * 1000:.1f}ms`, '
+                    f'worst `{monitor.max_lag * 1000:.1f}ms`, threshold `{monitor.threshold * 1000:.0f}ms`'
+                    + ('' if calls else '\nNothing has been slow'),
+        color=0x00ff00 if not calls else 0xffff00
+    )
+
+    for call in calls:
+        # The innermost frames show where it was stuck
+        stack = call.stack[-900:] if call.stack else 'No stack captured'
+
+        response.add_field(
+            name=f'{call.handler or "Unknown handler"} {call.kind} for {call.seconds:.2f}s '
+                 f'at {call.time:%H:%M:%S}'[:256],
+            value=f'```{stack}```',
+            inline=False
+        )
+
+    if clear:
+        monitor.clear()
+
+    response = await ctx.respond(embed=response, ephemeral=True)
+
+    await Logging.log_command(ctx, action='Command',
+                              extra=f"{ctx.author.name} viewed slow handlers")
+
+
+@tasks.loop(hours=1)
+async def maintenance():
+    """Samples member counts and keeps the history tables small"""
+    # One member count point per guild each hour
+    await data.run(data.record_member_counts,
+                   [(guild.id, guild.name, guild.member_count) for guild in client.guilds])
+
+    # Drops member count history past its retention, charts use the rollups
+    await data.run(data.compact_member_counts)
+
+    # Removes expired audit logs. With LOG_HOT_DAYS set, old logs are also
+    # rolled into monthly tables, and finished months are archived to
+    # LOG_ARCHIVE_DIR
+    await data.run(data.apply_log_retention)
+
+
+monitor_task = None  # Task measuring event loop lag
+
+
 @client.event
 async def on_ready():
+    global monitor_task
+
     print(f'{client.user} is ready!')
 
+    if not maintenance.is_running():
+        maintenance.start()
+
+    # on_ready fires again after reconnects
+    if monitor_task is None:
+        monitor_task = asyncio.create_task(monitor.run())
+
+
+@client.event
+async def on_message(message):
+    """Looks up the database records for a message once, then hands them to
+    every cog through the message_context event"""
+    if message.guild is not None:
+        context = await data.run(MessageContext.resolve, data, message)
+
+        client.dispatch('message_context', context)
+
+    await client.process_commands(message)
+
 
 # Load enabled cogs
 for cog in data.cogs:
     if cog.enabled:
         client.load_extension(f'cogs.{cog.name}')
 
-client.run(os.getenv('TOKEN'))
+# Prometheus metrics on http://127.0.0.1:9108/metrics, METRICS_PORT=0 turns them off
+if int(os.getenv("METRICS_PORT", 9108)):
+    metrics.start_server(os.getenv("METRICS_HOST", "127.0.0.1"), int(os.getenv("METRICS_PORT", 9108)))
+
+try:
+    client.run(os.getenv('TOKEN'))
+finally:
+    # Write out any logs left and close the database connections
+    unwritten = data.close(timeout=30)
+
+    if unwritten:
+        print(f"{unwritten} logs were not written before the database closed")
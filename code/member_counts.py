@@ -0,0 +1,295 @@
+import datetime
+import os
+from typing import NamedTuple
+
+
+# Seconds covered by one rollup at each resolution
+RESOLUTIONS = {
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+
+ROLLUP_COLUMNS = ('guild_id', 'resolution', 'time', 'min_count', 'max_count', 'total', 'points', 'last_count')
+
+# How a new point changes an existing rollup, {new} is the value of the point
+ROLLUP_UPDATE = {
+    'min_count': "CASE WHEN {new} < min_count THEN {new} ELSE min_count END",
+    'max_count': "CASE WHEN {new} > max_count THEN {new} ELSE max_count END",
+    'total': "total + {new}",
+    'points': "points + {new}",
+    'last_count': "{new}",
+}
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class Rollup(NamedTuple):
+    time: datetime.datetime  # Start of the period
+    min: int
+    max: int
+    average: float
+    last: int
+    points: int
+
+
+def bucket(time: datetime.datetime, seconds: int) -> datetime.datetime:
+    """Returns the start of the period a time falls in
+
+    Args:
+        time (datetime.datetime): [Time of a point]
+        seconds (int): [Length of each period]
+
+    Returns:
+        datetime.datetime: [Start of the period]
+    """
+
+    offset = (time - _EPOCH) // datetime.timedelta(seconds=seconds)
+
+    return _EPOCH + datetime.timedelta(seconds=offset * seconds)
+
+
+def retention() -> dict:
+    """Returns how long points and rollups are kept, day rollups are kept forever
+
+    Returns:
+        dict: [{'points' or resolution: datetime.timedelta}]
+    """
+
+    return {
+        'points': datetime.timedelta(days=float(os.getenv("MEMBER_COUNT_POINT_DAYS", 7))),
+        'minute': datetime.timedelta(days=float(os.getenv("MEMBER_COUNT_MINUTE_DAYS", 30))),
+        'hour': datetime.timedelta(days=float(os.getenv("MEMBER_COUNT_HOUR_DAYS", 365))),
+    }
+
+
+def point_cutoff(now: datetime.datetime = None) -> datetime.datetime:
+    """Returns the time before which points are dropped by compact, on a day boundary
+
+    Args:
+        now (datetime.datetime, optional): [Current time]. Defaults to now.
+
+    Returns:
+        datetime.datetime: [Start of the oldest day whose points are kept]
+    """
+
+    if now is None:
+        now = datetime.datetime.now()
+
+    return bucket(now - retention()['points'], RESOLUTIONS['day'])
+
+
+class MemberCountSeries:
+    def __init__(self, db, guild_id: int):
+        """Member counts of a guild over time
+
+        Points are only ever appended. Each point is also folded into
+        minute, hour and day rollups as it is written, so charts read the
+        precomputed rollups and old points can be dropped by compact.
+
+        Args:
+            db (Database): [Database the counts are in]
+            guild_id (int): [Id of the guild]
+        """
+
+        self._db = db
+        self.guild_id = guild_id
+
+    def append(self, count: int, time: datetime.datetime = None):
+        """Records the member count at a time
+
+        Args:
+            count (int): [Member count]
+            time (datetime.datetime, optional): [Time of the count]. Defaults to now.
+        """
+
+        if time is None:
+            time = datetime.datetime.now()
+
+        with self._db.transaction():
+            self._db.execute(
+                "INSERT INTO member_count_history (guild_id, time, count) VALUES (%s, %s, %s)",
+                (self.guild_id, time, count))
+
+            self._db.executemany(self._upsert_rollup(self._db), [
+                (self.guild_id, seconds, bucket(time, seconds), count, count, count, 1, count)
+                for seconds in RESOLUTIONS.values()
+            ])
+
+    @staticmethod
+    def append_many(db, counts: list, time: datetime.datetime = None):
+        """Records the member counts of many guilds at the same time
+
+        Args:
+            db (Database): [Database the counts are in]
+            counts (list): [(guild id, member count) of each guild]
+            time (datetime.datetime, optional): [Time of the counts]. Defaults to now.
+        """
+
+        if not counts:
+            return
+
+        if time is None:
+            time = datetime.datetime.now()
+
+        with db.transaction():
+            db.executemany(
+                "INSERT INTO member_count_history (guild_id, time, count) VALUES (%s, %s, %s)",
+                [(guild_id, time, count) for guild_id, count in counts])
+
+            db.executemany(MemberCountSeries._upsert_rollup(db), [
+                (guild_id, seconds, bucket(time, seconds), count, count, count, 1, count)
+                for guild_id, count in counts
+                for seconds in RESOLUTIONS.values()
+            ])
+
+    def points(self, start: datetime.datetime = None, end: datetime.datetime = None) -> list:
+        """Returns the points in a time range, oldest first
+
+        Args:
+            start (datetime.datetime, optional): [Earliest time]. Defaults to None.
+            end (datetime.datetime, optional): [Time to stop before]. Defaults to None.
+
+        Returns:
+            list: [(time, count) of each point]
+        """
+
+        where, params = self._range("time", start, end)
+
+        return [tuple(row) for row in self._db.fetchall(
+            f"SELECT time, count FROM member_count_history WHERE guild_id = %s{where} ORDER BY time",
+            (self.guild_id, *params))]
+
+    def rollups(self, resolution: str, start: datetime.datetime = None,
+                end: datetime.datetime = None) -> list:
+        """Returns the rollups in a time range, oldest first
+
+        Args:
+            resolution (str): ['minute', 'hour' or 'day']
+            start (datetime.datetime, optional): [Earliest time]. Defaults to None.
+            end (datetime.datetime, optional): [Time to stop before]. Defaults to None.
+
+        Returns:
+            list: [Rollup for each period that has points]
+        """
+
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+
+        seconds = RESOLUTIONS[resolution]
+
+        # Include the period the start falls in
+        where, params = self._range(
+            "time", None if start is None else bucket(start, seconds), end)
+
+        rows = self._db.fetchall(
+            "SELECT time, min_count, max_count, total, points, last_count FROM member_count_rollups "
+            f"WHERE guild_id = %s AND resolution = %s{where} ORDER BY time",
+            (self.guild_id, seconds, *params))
+
+        return [Rollup(time, min_count, max_count, total / points, last_count, points)
+                for time, min_count, max_count, total, points, last_count in rows]
+
+    def rebuild(self, start: datetime.datetime = None):
+        """Recomputes the rollups from the stored points, for when points were
+        changed other than by append. Rollups older than the point retention
+        are left as they are.
+
+        Args:
+            start (datetime.datetime, optional): [Earliest time that changed]. Defaults to None.
+        """
+
+        # Day periods hold whole minute and hour periods, so this redoes every
+        # period the change touched. Points before the cutoff may have been
+        # compacted away, leaving their rollups as the only record of them.
+        cutoff = point_cutoff()
+        start = cutoff if start is None else max(bucket(start, RESOLUTIONS['day']), cutoff)
+
+        with self._db.transaction():
+            points = self.points(start)
+
+            where, params = self._range("time", start, None)
+            self._db.execute(
+                f"DELETE FROM member_count_rollups WHERE guild_id = %s{where}",
+                (self.guild_id, *params))
+
+            rollups = {}  # (seconds, period): [min, max, total, points, last]
+
+            for time, count in points:
+                for seconds in RESOLUTIONS.values():
+                    key = (seconds, bucket(time, seconds))
+                    rollup = rollups.get(key)
+
+                    if rollup is None:
+                        rollups[key] = [count, count, count, 1, count]
+                    else:
+                        rollup[0] = min(rollup[0], count)
+                        rollup[1] = max(rollup[1], count)
+                        rollup[2] += count
+                        rollup[3] += 1
+                        rollup[4] = count
+
+            if rollups:
+                self._db.executemany(self._upsert_rollup(self._db), [
+                    (self.guild_id, seconds, period, *rollup)
+                    for (seconds, period), rollup in rollups.items()
+                ])
+
+    @staticmethod
+    def compact(db, now: datetime.datetime = None) -> int:
+        """Drops points and rollups older than their retention for every guild
+
+        Cutoffs fall on day boundaries, so dropped points are always
+        covered by complete rollups.
+
+        Args:
+            db (Database): [Database the counts are in]
+            now (datetime.datetime, optional): [Current time]. Defaults to now.
+
+        Returns:
+            int: [Rows removed]
+        """
+
+        if now is None:
+            now = datetime.datetime.now()
+
+        day = RESOLUTIONS['day']
+        kept = retention()
+
+        removed = 0
+
+        with db.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM member_count_history WHERE time < %s",
+                (point_cutoff(now),))
+            removed += cursor.rowcount
+
+            for resolution in ('minute', 'hour'):
+                cursor.execute(
+                    "DELETE FROM member_count_rollups WHERE resolution = %s AND time < %s",
+                    (RESOLUTIONS[resolution], bucket(now - kept[resolution], day)))
+                removed += cursor.rowcount
+
+        return removed
+
+    @staticmethod
+    def _upsert_rollup(db) -> str:
+        return db.upsert_query(
+            'member_count_rollups', ROLLUP_COLUMNS,
+            key=('guild_id', 'resolution', 'time'), update=ROLLUP_UPDATE)
+
+    @staticmethod
+    def _range(column: str, start, end) -> tuple:
+        where = ""
+        params = []
+
+        if start is not None:
+            where += f" AND {column} >= %s"
+            params.append(start)
+
+        if end is not None:
+            where += f" AND {column} < %s"
+            params.append(end)
+
+        return where, params
+
@@ -0,0 +1,308 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds of the handler latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        """A named value reported to Prometheus, one sample per set of label values
+
+        Args:
+            name (str): [Metric name, e.g. bot_events_total]
+            help (str): [What the metric measures]
+            labels (tuple, optional): [Label names]. Defaults to ().
+        """
+
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+        self._values = {}  # label values: value
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labels) or 'none'}")
+
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self) -> list:
+        """Returns the current samples
+
+        Returns:
+            list: [(name suffix, {label: value}, value)]
+        """
+
+        with self._lock:
+            values = dict(self._values)
+
+        return [("", dict(zip(self.labels, key)), value) for key, value in values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels(labels)} {_number(value)}")
+
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        """Adds to the counter
+
+        Args:
+            amount (float, optional): [Amount to add]. Defaults to 1.
+            **labels: Label values
+        """
+
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), function=None):
+        """A value that goes up and down
+
+        Args:
+            name (str): [Metric name]
+            help (str): [What the metric measures]
+            labels (tuple, optional): [Label names]. Defaults to ().
+            function (callable, optional): [Called on each scrape, returns the value, or
+                {label values tuple: value} when there are labels]. Defaults to None.
+        """
+
+        super().__init__(name, help, labels)
+
+        self.function = function
+
+    def set(self, value: float, **labels):
+        """Sets the gauge
+
+        Args:
+            value (float): [New value]
+            **labels: Label values
+        """
+
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> list:
+        if self.function is None:
+            return super().samples()
+
+        value = self.function()
+
+        if not self.labels:
+            return [("", {}, value)]
+
+        return [("", dict(zip(self.labels, key)), sample) for key, sample in value.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        """Counts of observations by size, which percentiles are worked out from
+
+        Args:
+            name (str): [Metric name]
+            help (str): [What the metric measures]
+            labels (tuple, optional): [Label names]. Defaults to ().
+            buckets (tuple, optional): [Upper bounds of the buckets, ending with inf]. Defaults to BUCKETS.
+        """
+
+        super().__init__(name, help, labels)
+
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        """Records one observation
+
+        Args:
+            value (float): [Observed value]
+            **labels: Label values
+        """
+
+        key = self._key(labels)
+
+        with self._lock:
+            counts = self._values.get(key)
+
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0]
+
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the time a with block takes"""
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = {key: (list(buckets), total) for key, (buckets, total) in self._values.items()}
+
+        samples = []
+
+        for key, (buckets, total) in values.items():
+            labels = dict(zip(self.labels, key))
+
+            # Prometheus buckets count every observation up to their bound
+            count = 0
+            for bound, observed in zip(self.buckets, buckets):
+                count += observed
+                samples.append(("_bucket", {**labels, 'le': _number(bound)}, count))
+
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        """Metrics reported together"""
+
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Adds a metric, replacing any with the same name
+
+        Args:
+            metric (Metric): [Metric to report]
+
+        Returns:
+            Metric: [The metric]
+        """
+
+        with self._lock:
+            self._metrics = [other for other in self._metrics if other.name != metric.name]
+            self._metrics.append(metric)
+
+        return metric
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text format
+
+        Returns:
+            str: [Metrics text]
+        """
+
+        with self._lock:
+            metrics = list(self._metrics)
+
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+EVENTS = REGISTRY.register(Counter(
+    'bot_events_total', "Gateway events dispatched", ('event',)))
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    'bot_handler_seconds', "Time taken by event listeners and slash commands", ('cog', 'handler')))
+
+AUTOMOD_ACTIONS = REGISTRY.register(Counter(
+    'bot_automod_actions_total', "AutoMod actions taken", ('consequence',)))
+
+LOOP_LAG = REGISTRY.register(Gauge(
+    'bot_event_loop_lag_seconds', "How late the event loop last ran a scheduled callback"))
+
+SLOW_HANDLERS = REGISTRY.register(Counter(
+    'bot_slow_handlers_total', "Handlers that blocked the event loop or ran past the watchdog threshold", ('kind',)))
+
+
+def handler_labels(func) -> dict:
+    """Returns the cog and handler labels of a listener
+
+    Args:
+        func (callable): [Listener, e.g. the bound method AutoMod.on_message_context]
+
+    Returns:
+        dict: [{'cog': cog name or main, 'handler': qualified name}]
+    """
+
+    owner = getattr(func, '__self__', None)
+    cog = type(owner).__name__ if owner is not None else 'main'
+
+    return {'cog': cog, 'handler': getattr(func, '__qualname__', repr(func))}
+
+
+def start_server(host: str = "127.0.0.1", port: int = 9108, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serves the metrics at /metrics from a background thread, so they can be
+    read even while the event loop is blocked
+
+    Args:
+        host (str, optional): [Address to listen on]. Defaults to "127.0.0.1".
+        port (int, optional): [Port to listen on]. Defaults to 9108.
+        registry (Registry, optional): [Metrics to serve]. Defaults to REGISTRY.
+
+    Returns:
+        ThreadingHTTPServer: [Running server, shutdown stops it]
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = registry.render().encode()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would flood the console
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+
+    return server
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
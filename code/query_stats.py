@@ -0,0 +1,332 @@
+import bisect
+import functools
+import os
+import re
+import sys
+import threading
+import time
+
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, float('inf'))
+
+# Files whose frames are part of running the query rather than asking for it
+_INTERNAL = {'database.py', 'backends.py', 'query_stats.py', 'contextlib.py'}
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER = re.compile(r"\b\d+\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize(query: str) -> str:
+    """Returns a query with its values and the length of its lists removed,
+    so every call of the same statement is counted together
+
+    Args:
+        query (str): [SQL statement]
+
+    Returns:
+        str: [Normalized statement, e.g. SELECT ... WHERE id IN (...)]
+    """
+
+    query = _STRING.sub("?", query)
+    query = _NUMBER.sub("?", query.replace("%s", "?"))
+    query = _PLACEHOLDER_LIST.sub("(...)", query)
+    query = _ROWS.sub("(...)", query)
+
+    return _SPACE.sub(" ", query).strip()
+
+
+class StatementStats:
+    __slots__ = ('statement', 'calls', 'total', 'max', 'rows', 'buckets', 'callers')
+
+    def __init__(self, statement: str):
+        """Counts for one normalized statement
+
+        Args:
+            statement (str): [Normalized statement]
+        """
+
+        self.statement = statement
+        self.calls = 0
+        self.total = 0.0  # Seconds
+        self.max = 0.0
+        self.rows = 0  # Returned by queries, changed by other statements
+        self.buckets = [0] * len(BUCKETS)
+        self.callers = {}  # caller: calls
+
+    @property
+    def mean(self) -> float:
+        """Returns the mean latency in seconds"""
+
+        return self.total / self.calls if self.calls else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """Returns an estimate of a latency percentile
+
+        Args:
+            percent (float): [Percentile between 0 and 100]
+
+        Returns:
+            float: [Upper bound of the bucket the percentile falls in, in seconds]
+        """
+
+        wanted = self.calls * percent / 100
+        seen = 0
+
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+
+            if count and seen >= wanted:
+                # The last bucket has no upper bound, the slowest call stands in
+                return self.max if bound == float('inf') else min(bound, self.max)
+
+        return 0.0
+
+    def copy(self) -> 'StatementStats':
+        stats = StatementStats(self.statement)
+        stats.calls = self.calls
+        stats.total = self.total
+        stats.max = self.max
+        stats.rows = self.rows
+        stats.buckets = list(self.buckets)
+        stats.callers = dict(self.callers)
+
+        return stats
+
+    def as_dict(self) -> dict:
+        return {
+            'statement': self.statement,
+            'calls': self.calls,
+            'total': self.total,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'rows': self.rows,
+            'buckets': dict(zip(BUCKETS, self.buckets)),
+            'callers': dict(self.callers),
+        }
+
+
+class QueryStats:
+    def __init__(self, enabled: bool = True, max_statements: int = 1000):
+        """Call counts, latency histograms and rows of every statement run,
+        grouped by normalized statement and by the model method that ran it
+
+        Args:
+            enabled (bool, optional): [If statements are recorded]. Defaults to True.
+            max_statements (int, optional): [Most distinct statements tracked, the rest are counted as <other>]. Defaults to 1000.
+        """
+
+        self.enabled = enabled
+        self.max_statements = max_statements
+
+        self._statements = {}  # statement: StatementStats
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'QueryStats':
+        """Returns stats configured by DB_STATS, 0 turns recording off"""
+
+        return cls(enabled=os.getenv("DB_STATS", "1") != "0")
+
+    def wrap(self, cursor):
+        """Returns a cursor that records the statements run on it
+
+        Args:
+            cursor: [Backend cursor]
+
+        Returns:
+            Cursor that records into these stats, or the cursor itself when disabled
+        """
+
+        if not self.enabled:
+            return cursor
+
+        return _TimedCursor(cursor, self)
+
+    def record(self, query: str, seconds: float, rows: int = 0, caller: str = None) -> StatementStats:
+        """Adds one call of a statement
+
+        Args:
+            query (str): [SQL statement as run]
+            seconds (float): [Time the call took]
+            rows (int, optional): [Rows returned or changed]. Defaults to 0.
+            caller (str, optional): [Method that ran the statement]. Defaults to None.
+
+        Returns:
+            StatementStats: [Stats the call was added to]
+        """
+
+        statement = normalize(query)
+
+        with self._lock:
+            stats = self._statements.get(statement)
+
+            if stats is None:
+                if len(self._statements) >= self.max_statements:
+                    statement = "<other>"
+                    stats = self._statements.get(statement)
+
+                if stats is None:
+                    stats = self._statements[statement] = StatementStats(statement)
+
+            stats.calls += 1
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            stats.rows += rows
+            stats.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+            if caller is not None:
+                stats.callers[caller] = stats.callers.get(caller, 0) + 1
+
+        return stats
+
+    def add_rows(self, stats: StatementStats, rows: int):
+        """Adds rows fetched after a statement was recorded
+
+        Args:
+            stats (StatementStats): [Stats returned by record]
+            rows (int): [Rows fetched]
+        """
+
+        with self._lock:
+            stats.rows += rows
+
+    def statements(self, sort: str = 'total', limit: int = None) -> list:
+        """Returns a copy of the stats of each statement
+
+        Args:
+            sort (str, optional): ['total', 'calls', 'mean', 'max' or 'rows' to sort by, highest first]. Defaults to 'total'.
+            limit (int, optional): [Most statements to return]. Defaults to all.
+
+        Returns:
+            list: [StatementStats]
+        """
+
+        if sort not in ('total', 'calls', 'mean', 'max', 'rows'):
+            raise ValueError("sort must be one of total, calls, mean, max or rows")
+
+        with self._lock:
+            statements = [stats.copy() for stats in self._statements.values()]
+
+        statements.sort(key=lambda stats: getattr(stats, sort), reverse=True)
+
+        return statements[:limit]
+
+    def callers(self, limit: int = None) -> list:
+        """Returns the methods that run the most statements, which is where
+        N+1 queries show up
+
+        Args:
+            limit (int, optional): [Most callers to return]. Defaults to all.
+
+        Returns:
+            list: [(caller, calls, distinct statements), most calls first]
+        """
+
+        counts = {}  # caller: [calls, statements]
+
+        with self._lock:
+            for stats in self._statements.values():
+                for caller, calls in stats.callers.items():
+                    count = counts.setdefault(caller, [0, 0])
+                    count[0] += calls
+                    count[1] += 1
+
+        callers = sorted(((caller, calls, statements) for caller, (calls, statements) in counts.items()),
+                         key=lambda caller: caller[1], reverse=True)
+
+        return callers[:limit]
+
+    def snapshot(self) -> dict:
+        """Returns every statement's stats as plain values
+
+        Returns:
+            dict: [{normalized statement: stats dict}]
+        """
+
+        return {stats.statement: stats.as_dict() for stats in self.statements()}
+
+    def reset(self):
+        """Forgets everything recorded so far"""
+
+        with self._lock:
+            self._statements.clear()
+
+
+class _TimedCursor:
+    """Cursor that times each statement and counts the rows it returns"""
+
+    def __init__(self, cursor, stats: QueryStats):
+        self._cursor = cursor
+        self._stats = stats
+        self._last = None  # Stats of the last statement, fetched rows are added to it
+
+    def execute(self, query: str, params=()):
+        start = time.perf_counter()
+
+        try:
+            return self._cursor.execute(query, params)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    def executemany(self, query: str, seq_params):
+        start = time.perf_counter()
+
+        try:
+            return self._cursor.executemany(query, seq_params)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+
+        if row is not None and self._last is not None:
+            self._stats.add_rows(self._last, 1)
+
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+
+        if self._last is not None:
+            self._stats.add_rows(self._last, len(rows))
+
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _record(self, query: str, seconds: float):
+        rows = 0
+
+        # Statements without results report the rows they changed
+        if self._cursor.description is None:
+            rows = max(self._cursor.rowcount or 0, 0)
+
+        self._last = self._stats.record(query, seconds, rows, _caller())
+
+
+def _caller() -> str:
+    frame = sys._getframe(2)
+
+    while frame is not None:
+        code = frame.f_code
+        module = os.path.basename(code.co_filename)
+
+        # co_qualname is new in Python 3.11
+        name = getattr(code, 'co_qualname', code.co_name)
+
+        # Model helpers are called by the property that matters
+        if module not in _INTERNAL and not name.startswith("Model."):
+            return f"{module[:-3]}.{name}"
+
+        frame = frame.f_back
+
+    return None
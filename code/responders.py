@@ -0,0 +1,130 @@
+import re
+
+
+# Named groups are renamed so responders can share one pattern
+_GROUP = re.compile(r"\(\?P(<|=)(\w+)")
+
+# Numbered backreferences would point at the wrong group once combined
+_UNSAFE = re.compile(r"\\[1-9]")
+
+
+class Responder:
+    __slots__ = ('name', 'pattern', 'reply', 'flags')
+
+    def __init__(self, name: str, pattern: str, reply: str, flags: str = ''):
+        """A chat trigger and the message sent back when it matches
+
+        Args:
+            name (str): [Name of the responder]
+            pattern (str): [Regex searched for in the message]
+            reply (str): [Reply, formatted with the named groups of the match and mention]
+            flags (str, optional): [Inline regex flags, e.g. 'i']. Defaults to ''.
+        """
+
+        self.name = name
+        self.pattern = pattern
+        self.reply = reply
+        self.flags = flags
+
+    def __repr__(self):
+        return f"<Responder {self.name} {self.pattern!r}>"
+
+
+# Jerald's replies, most specific first. Only the first that matches replies.
+RESPONDERS = (
+    # if the message is all caps
+    Responder('caps', r"^[A-Z\s'!.?]+$",
+              "{mention} keep your voice down!"),
+
+    # if message has I'm followed by a sentence, say "Hi <sentence>, I'm Jerald"
+    Responder('im', r"\bi'?m (?P<sentence>[\s\w]+)\.?",
+              "Hi {sentence}, I'm Jerald", flags='i'),
+
+    # if the message contains 'hi', say 'hi'
+    Responder('hi', r"hi", "hi"),
+)
+
+
+class ResponderSet:
+    def __init__(self, responders: tuple):
+        """Responders compiled for matching
+
+        The responders are joined into a single alternation whose group
+        names map back to the responder, so a message that no responder
+        matches is scanned once. The leftmost match may not be the first
+        responder in order, so only the responders before it are then
+        checked on their own.
+
+        Args:
+            responders (tuple): [Responders to check, first has priority]
+        """
+
+        self.responders = tuple(responders)
+
+        self._patterns = []  # (compiled pattern, {group name: reply field}) of each responder
+        self._combined_indexes = set()
+
+        alternatives = []
+
+        for i, responder in enumerate(self.responders):
+            prefix = f"r{i}_"
+            pattern = _GROUP.sub(
+                lambda match: f"(?P{match.group(1)}{prefix}{match.group(2)}", responder.pattern)
+
+            if responder.flags:
+                pattern = f"(?{responder.flags}:{pattern})"
+
+            compiled = re.compile(pattern)
+            fields = {name: name[len(prefix):] for name in compiled.groupindex}
+
+            self._patterns.append((compiled, fields))
+
+            if not _UNSAFE.search(responder.pattern):
+                alternatives.append(f"(?P<{prefix}>{pattern})")
+                self._combined_indexes.add(i)
+
+        self._combined = re.compile("|".join(alternatives)) if alternatives else None
+
+    def __len__(self):
+        return len(self.responders)
+
+    def reply(self, content: str, mention: str) -> str:
+        """Returns the reply of the first responder that matches a message
+
+        Args:
+            content (str): [Message content]
+            mention (str): [Mention of the author]
+
+        Returns:
+            str: [Reply to send, or None]
+        """
+
+        found = None
+
+        if self._combined is not None:
+            match = self._combined.search(content)
+
+            if match is not None:
+                # The outer group of the responder closes last
+                found = int(match.lastgroup[1:-1])
+
+        for i, (pattern, _) in enumerate(self._patterns):
+            if found is not None and i >= found:
+                # Nothing before the match comes first
+                return self._format(found, match, mention)
+
+            if found is None and i in self._combined_indexes:
+                continue  # Already known not to match
+
+            responder_match = pattern.search(content)
+
+            if responder_match is not None:
+                return self._format(i, responder_match, mention)
+
+        return None
+
+    def _format(self, i: int, match, mention: str) -> str:
+        fields = self._patterns[i][1]
+        values = {field: match.group(name) for name, field in fields.items()}
+
+        return self.responders[i].reply.format(mention=mention, **values)
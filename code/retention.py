@@ -0,0 +1,326 @@
+import datetime
+import os
+import re
+import threading
+import weakref
+
+from database import Database
+
+
+# Period tables are named after the month they hold, e.g. audit_log_2022_03
+_PERIOD = re.compile(r"^audit_log_(\d{4})_(\d{2})$")
+
+
+class LogRetention:
+    _shared = weakref.WeakKeyDictionary()
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db: Database, hot_days: float = None, default_days: float = None,
+                 batch_size: int = 5000):
+        """Keeps audit_log small by rolling old logs into monthly tables and
+        removing logs that are past the retention of their guild
+
+        When hot_days is set, audit_log only holds the last hot_days of
+        logs and older logs are moved into one table per month. A month is
+        dropped as a whole once every guild's retention has passed it, so
+        removing old logs rarely needs a large DELETE. Log readers include
+        the monthly tables, so rolled logs can still be read. Without
+        hot_days, an archive still takes each month out of audit_log once
+        it finishes.
+
+        Args:
+            db (Database): [Database the logs are in]
+            hot_days (float, optional): [Days logs stay in audit_log, None to keep them there]. Defaults to None.
+            default_days (float, optional): [Days logs are kept for guilds without their own setting, None to keep them forever]. Defaults to None.
+            batch_size (int, optional): [Most logs moved by one statement]. Defaults to 5000.
+        """
+
+        self._db = db
+        self.hot_days = hot_days
+        self.default_days = default_days
+        self.batch_size = batch_size
+
+    @classmethod
+    def shared(cls, db: Database) -> 'LogRetention':
+        """Returns the retention policy for a database
+
+        Args:
+            db (Database): [Database the logs are in]
+
+        Returns:
+            LogRetention: [Retention policy]
+        """
+
+        with cls._shared_lock:
+            if db not in cls._shared:
+                hot_days = os.getenv("LOG_HOT_DAYS")
+                default_days = os.getenv("LOG_RETENTION_DAYS")
+
+                cls._shared[db] = cls(
+                    db,
+                    hot_days=None if not hot_days else float(hot_days),
+                    default_days=None if not default_days else float(default_days),
+                    batch_size=int(os.getenv("LOG_RETENTION_BATCH", 5000)),
+                )
+
+            return cls._shared[db]
+
+    @staticmethod
+    def period_table(time: datetime.datetime) -> str:
+        """Returns the name of the table logs from a time are rolled into
+
+        Args:
+            time (datetime.datetime): [Time of a log]
+
+        Returns:
+            str: [Table name]
+        """
+
+        return f"audit_log_{time.year:04d}_{time.month:02d}"
+
+    def periods(self) -> list:
+        """Returns the monthly tables that exist, oldest first
+
+        Returns:
+            list: [(table name, start of the month)]
+        """
+
+        periods = []
+
+        for name in self._db.tables("audit_log_"):
+            match = _PERIOD.match(name)
+
+            if match is not None:
+                periods.append(
+                    (name, datetime.datetime(int(match.group(1)), int(match.group(2)), 1)))
+
+        return sorted(periods, key=lambda period: period[1])
+
+    def get_days(self, guild_id: int) -> float:
+        """Returns how many days a guild's logs are kept
+
+        Args:
+            guild_id (int): [Id of the guild]
+
+        Returns:
+            float: [Days, None if they are kept forever]
+        """
+
+        row = self._db.fetchone(
+            "SELECT days FROM log_retention WHERE guild_id = %s", (guild_id,))
+
+        return self.default_days if row is None else row[0]
+
+    def set_days(self, guild_id: int, days: int = None):
+        """Sets how many days a guild's logs are kept
+
+        Args:
+            guild_id (int): [Id of the guild]
+            days (int, optional): [Days to keep logs, None to keep them forever]. Defaults to None.
+        """
+
+        self._db.upsert(
+            'log_retention', {'guild_id': guild_id, 'days': days},
+            key=('guild_id',), update=('days',), returning=False)
+
+    def run(self, now: datetime.datetime = None, archive=None) -> dict:
+        """Rolls old logs out of audit_log, archives finished months if an
+        archive is given, then removes expired logs
+
+        Without hot_days, logs are only rolled out of audit_log when there
+        is an archive, once their month has finished.
+
+        Args:
+            now (datetime.datetime, optional): [Current time]. Defaults to now.
+            archive (LogArchive, optional): [Archive to move finished months to]. Defaults to None.
+
+        Returns:
+            dict: [{'rolled': logs moved, 'pruned': logs removed, 'dropped': tables dropped,
+                    'archived': logs archived}]
+        """
+
+        if now is None:
+            now = datetime.datetime.now()
+
+        rolled = self.roll(now, archiving=archive is not None)
+
+        # Expired months are archived rather than dropped
+        archived = 0 if archive is None else self.archive(archive, now)
+        pruned, dropped = self.prune(now)
+
+        return {'rolled': rolled, 'pruned': pruned, 'dropped': dropped, 'archived': archived}
+
+    def archive(self, archive, now: datetime.datetime = None) -> int:
+        """Moves monthly tables that can no longer receive logs into the archive
+
+        Args:
+            archive (LogArchive): [Archive to write to]
+            now (datetime.datetime, optional): [Current time]. Defaults to now.
+
+        Returns:
+            int: [Logs archived]
+        """
+
+        if now is None:
+            now = datetime.datetime.now()
+
+        cutoff = self._cutoff(now, archiving=True)
+
+        archived = 0
+
+        for table, start in self.periods():
+            # Logs from this month may still be rolled out of audit_log
+            if _next_month(start) > cutoff:
+                continue
+
+            archived += archive.export(self._db, table)
+
+        return archived
+
+    def roll(self, now: datetime.datetime = None, archiving: bool = False) -> int:
+        """Moves logs older than the hot window into their monthly tables
+
+        Args:
+            now (datetime.datetime, optional): [Current time]. Defaults to now.
+            archiving (bool, optional): [Roll out finished months to be archived when hot_days isn't set]. Defaults to False.
+
+        Returns:
+            int: [Logs moved, 0 if hot_days isn't set and nothing is archived]
+        """
+
+        if now is None:
+            now = datetime.datetime.now()
+
+        cutoff = self._cutoff(now, archiving)
+
+        if cutoff is None:
+            return 0
+        created = set(name for name, _ in self.periods())
+
+        moved = 0
+
+        while True:
+            rows = self._db.fetchall(
+                "SELECT id, time FROM audit_log WHERE time < %s ORDER BY id LIMIT %s",
+                (cutoff, self.batch_size))
+
+            if not rows:
+                return moved
+
+            by_table = {}  # table: [ids]
+            for id, time in rows:
+                by_table.setdefault(self.period_table(time), []).append(id)
+
+            for table in by_table:
+                if table not in created:
+                    # Creating a table commits, so it happens before the move
+                    self._db.create_table_like(table, "audit_log")
+                    created.add(table)
+
+            # Each batch is copied and removed together
+            with self._db.transaction():
+                for table, ids in by_table.items():
+                    placeholders = ", ".join(["%s"] * len(ids))
+
+                    self._db.execute(
+                        f"INSERT INTO {table} SELECT * FROM audit_log WHERE id IN ({placeholders})", ids)
+                    self._db.execute(
+                        f"DELETE FROM audit_log WHERE id IN ({placeholders})", ids)
+
+            moved += len(rows)
+
+            if len(rows) < self.batch_size:
+                return moved
+
+    def prune(self, now: datetime.datetime = None) -> tuple:
+        """Removes logs past the retention of their guild
+
+        Monthly tables past every guild's retention are dropped whole.
+
+        Args:
+            now (datetime.datetime, optional): [Current time]. Defaults to now.
+
+        Returns:
+            tuple: [(logs removed, tables dropped)]
+        """
+
+        if now is None:
+            now = datetime.datetime.now()
+
+        overrides = dict(self._db.fetchall("SELECT guild_id, days FROM log_retention"))
+
+        # Logs are kept as long as the longest retention asks for
+        longest = [self.default_days] + list(overrides.values())
+        keep_forever = None in longest
+
+        removed = 0
+        dropped = 0
+
+        periods = self.periods()
+
+        if not keep_forever:
+            oldest = now - datetime.timedelta(days=max(longest))
+
+            for table, start in list(periods):
+                if _next_month(start) <= oldest:
+                    self._db.execute(f"DROP TABLE {table}")
+                    periods.remove((table, start))
+                    dropped += 1
+
+        # Guilds that follow the default retention
+        if self.default_days is not None:
+            cutoff = now - datetime.timedelta(days=self.default_days)
+            others = list(overrides)
+
+            where = "time < %s"
+            params = (cutoff,)
+
+            # Logs without a guild, e.g. from DMs, follow the default too
+            if others:
+                where += f" AND (guild_id IS NULL OR guild_id NOT IN ({', '.join(['%s'] * len(others))}))"
+                params = params + tuple(others)
+
+            removed += self._delete(periods, cutoff, where, params)
+
+        # Guilds with their own retention
+        for guild_id, days in overrides.items():
+            if days is None:
+                continue
+
+            cutoff = now - datetime.timedelta(days=days)
+
+            removed += self._delete(
+                periods, cutoff, "guild_id = %s AND time < %s", (guild_id, cutoff))
+
+        return removed, dropped
+
+    def _cutoff(self, now: datetime.datetime, archiving: bool) -> datetime.datetime:
+        # Logs before this are rolled out of audit_log, None if they stay
+        if self.hot_days is not None:
+            return now - datetime.timedelta(days=self.hot_days)
+
+        if archiving:
+            # Finished months go straight to the archive
+            return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+        return None
+
+    def _delete(self, periods: list, cutoff: datetime.datetime, where: str, params: tuple) -> int:
+        # Months that start after the cutoff have nothing to remove
+        tables = [table for table, start in periods if start < cutoff] + ['audit_log']
+
+        removed = 0
+
+        for table in tables:
+            with self._db.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {table} WHERE {where}", params)
+                removed += cursor.rowcount
+
+        return removed
+
+
+def _next_month(start: datetime.datetime) -> datetime.datetime:
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+
+    return start.replace(month=start.month + 1)
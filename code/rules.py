@@ -0,0 +1,184 @@
+import re
+import threading
+import weakref
+
+
+# Higher wins when a message breaks several rules
+SEVERITY = {
+    'delete': 1,
+    'timeout': 2,
+    'kick': 3,
+    'ban': 4,
+}
+
+# Patterns using these can't be renumbered into one alternation
+_UNSAFE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?[aiLmsux]+\)")
+
+
+class Rule:
+    __slots__ = ('type', 'value', 'consequence', 'timeout_time', 'severity')
+
+    def __init__(self, type: str, value: str, consequence: str, timeout_time: int):
+        self.type = type
+        self.value = value
+        self.consequence = consequence
+        self.timeout_time = timeout_time
+        self.severity = SEVERITY.get(consequence, 0)
+
+    def __repr__(self):
+        return f"<Rule {self.type} {self.value!r} {self.consequence}>"
+
+
+class RuleSet:
+    _shared = weakref.WeakKeyDictionary()
+    _versions = weakref.WeakKeyDictionary()  # Database: invalidation count
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rules: list):
+        """AutoMod custom config compiled for matching
+
+        Word rules become one dictionary looked up once per word of the
+        message. Regex rules are sorted by severity and joined into a
+        single alternation whose group names map back to the rule, so a
+        message that breaks no rule is scanned once.
+
+        Args:
+            rules (list): [Objects with type, value, consequence and timeout_time]
+        """
+
+        self._words = {}  # word: most severe Rule for it
+        self._regexes = []  # (compiled pattern, Rule), most severe first
+
+        regex_rules = []
+
+        for config in rules:
+            rule = Rule(config.type, config.value,
+                        config.consequence, config.timeout_time)
+
+            if rule.type == "word":
+                current = self._words.get(rule.value)
+
+                if current is None or rule.severity > current.severity:
+                    self._words[rule.value] = rule
+
+            elif rule.type == "regex":
+                regex_rules.append(rule)
+
+        regex_rules.sort(key=lambda rule: rule.severity, reverse=True)
+
+        alternatives = []
+        self._combined_indexes = set()
+
+        for i, rule in enumerate(regex_rules):
+            try:
+                pattern = re.compile(rule.value)
+            except re.error:
+                continue  # An invalid pattern could never match
+
+            self._regexes.append((pattern, rule))
+
+            if not _UNSAFE.search(rule.value):
+                index = len(self._regexes) - 1
+                alternatives.append(f"(?P<r{index}>{rule.value})")
+                self._combined_indexes.add(index)
+
+        self._combined = None
+
+        if alternatives:
+            try:
+                self._combined = re.compile("|".join(alternatives))
+            except re.error:
+                # Fall back to checking each pattern on its own
+                self._combined_indexes = set()
+
+    @classmethod
+    def cached(cls, db, config_id: int, load) -> 'RuleSet':
+        """Returns the rule set for an AutoMod config, compiling it on first use
+
+        Args:
+            db (Database): [Database the config is in]
+            config_id (int): [Id of the AutoMod config]
+            load (callable): [Returns the custom config rules]
+
+        Returns:
+            RuleSet: [Compiled rules]
+        """
+
+        with cls._shared_lock:
+            rule_sets = cls._shared.setdefault(db, {})
+            rule_set = rule_sets.get(config_id)
+            version = cls._versions.get(db, 0)
+
+        if rule_set is None:
+            rule_set = cls(load())
+
+            with cls._shared_lock:
+                # Don't keep rules that were changed while they loaded
+                if cls._versions.get(db, 0) == version:
+                    rule_sets[config_id] = rule_set
+
+        return rule_set
+
+    @classmethod
+    def invalidate(cls, db, config_id: int):
+        """Drops a cached rule set so it is rebuilt on next use
+
+        Args:
+            db (Database): [Database the config is in]
+            config_id (int): [Id of the AutoMod config]
+        """
+
+        with cls._shared_lock:
+            cls._versions[db] = cls._versions.get(db, 0) + 1
+            cls._shared.get(db, {}).pop(config_id, None)
+
+    def __len__(self):
+        return len(self._words) + len(self._regexes)
+
+    def match(self, content: str) -> Rule:
+        """Returns the most severe rule a message breaks
+
+        Args:
+            content (str): [Message content]
+
+        Returns:
+            Rule: [Most severe rule broken, or None]
+        """
+
+        best = None
+
+        if self._words:
+            for word in set(content.lower().split()):
+                rule = self._words.get(word)
+
+                if rule is not None and (best is None or rule.severity > best.severity):
+                    best = rule
+
+        regex = self._match_regex(content)
+
+        if regex is not None and (best is None or regex.severity > best.severity):
+            best = regex
+
+        return best
+
+    def _match_regex(self, content: str) -> Rule:
+        found = None
+
+        if self._combined is not None:
+            match = self._combined.search(content)
+
+            if match is not None:
+                found = int(match.lastgroup[1:])
+
+        for i, (pattern, rule) in enumerate(self._regexes):
+            if found is not None and i >= found:
+                # Nothing before the match was more severe
+                return self._regexes[found][1]
+
+            if found is None and i in self._combined_indexes:
+                continue  # Already known not to match
+
+            if pattern.search(content):
+                return rule
+
+        return None
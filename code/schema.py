@@ -0,0 +1,375 @@
+import datetime
+import os
+import sys
+from typing import NamedTuple
+
+
+VERSION_TABLE = (
+    "CREATE TABLE IF NOT EXISTS schema_version ("
+    "version INT NOT NULL PRIMARY KEY, "
+    "description VARCHAR(255), "
+    "applied DATETIME NOT NULL)"
+)
+
+# Tables used by the bot, {id} is the auto incrementing id of the backend
+TABLES = (
+    "CREATE TABLE IF NOT EXISTS users ("
+    "{id}, "
+    "discord_id BIGINT NOT NULL, "
+    "name VARCHAR(255), "
+    "discriminator VARCHAR(8), "
+    "goated BOOLEAN NOT NULL DEFAULT 0, "
+    "rigged BOOLEAN NOT NULL DEFAULT 0)",
+
+    "CREATE TABLE IF NOT EXISTS guilds ("
+    "{id}, "
+    "discord_id BIGINT NOT NULL, "
+    "name VARCHAR(255), "
+    "member_count_channel BIGINT, "
+    "dynamic_voice_channel_id BIGINT, "
+    "dynamic_voice_channel_name VARCHAR(255), "
+    "slash_commands BOOLEAN NOT NULL DEFAULT 0)",
+
+    "CREATE TABLE IF NOT EXISTS channels ("
+    "{id}, "
+    "guild_id INT, "
+    "discord_id BIGINT NOT NULL, "
+    "name VARCHAR(255), "
+    "muted_events BOOLEAN NOT NULL DEFAULT 0, "
+    "dynamic_voice_channel BOOLEAN NOT NULL DEFAULT 0)",
+
+    "CREATE TABLE IF NOT EXISTS auto_mod_config ("
+    "{id}, "
+    "guild_id INT NOT NULL, "
+    "enabled BOOLEAN NOT NULL DEFAULT 0, "
+    "anti_spam INT NOT NULL DEFAULT 0)",
+
+    "CREATE TABLE IF NOT EXISTS auto_mod_custom_config ("
+    "{id}, "
+    "config_id INT NOT NULL, "
+    "type VARCHAR(16) NOT NULL, "
+    "value TEXT NOT NULL, "
+    "consequence VARCHAR(16) NOT NULL, "
+    "timeout_time INT NOT NULL DEFAULT 10)",
+
+    "CREATE TABLE IF NOT EXISTS audit_log ("
+    "{id}, "
+    "time DATETIME NOT NULL, "
+    "action VARCHAR(64), "
+    "extra TEXT, "
+    "user_id INT, "
+    "guild_id INT, "
+    "channel_id INT, "
+    "message_id BIGINT, "
+    "message_text TEXT)",
+
+    "CREATE TABLE IF NOT EXISTS cogs ("
+    "{id}, "
+    "name VARCHAR(64) NOT NULL, "
+    "enabled BOOLEAN NOT NULL DEFAULT 0)",
+
+    "CREATE TABLE IF NOT EXISTS games ("
+    "{id}, "
+    "channel_id INT, "
+    "type VARCHAR(64), "
+    "turn INT, "
+    "waiting_for_players BOOLEAN NOT NULL DEFAULT 1, "
+    "wait_time INT, "
+    "max_wait_time INT, "
+    "last_move_time DATETIME, "
+    "winner INT, "
+    "board LONGBLOB)",
+
+    "CREATE TABLE IF NOT EXISTS game_players ("
+    "game_id INT NOT NULL, "
+    "player_id INT NOT NULL)",
+
+    "CREATE TABLE IF NOT EXISTS embeds ("
+    "{id}, "
+    "user_id INT NOT NULL, "
+    "name VARCHAR(255) NOT NULL, "
+    "title VARCHAR(256), "
+    "description TEXT, "
+    "color INT, "
+    "image TEXT, "
+    "file_type VARCHAR(64), "
+    "file_name VARCHAR(255), "
+    "file LONGBLOB)",
+
+    "CREATE TABLE IF NOT EXISTS embed_fields ("
+    "{id}, "
+    "embed_id INT NOT NULL, "
+    "name VARCHAR(256) NOT NULL, "
+    "value TEXT NOT NULL)",
+
+    "CREATE TABLE IF NOT EXISTS member_count_history ("
+    "{id}, "
+    "guild_id INT NOT NULL, "
+    "time DATETIME NOT NULL, "
+    "count INT NOT NULL)",
+)
+
+
+# Unique keys and the indexes the bot's lookups rely on
+INDEXES = (
+    # name, table, columns, unique
+    ('users_discord_id', 'users', ('discord_id',), True),
+    ('guilds_discord_id', 'guilds', ('discord_id',), True),
+    ('channels_guild_discord', 'channels', ('guild_id', 'discord_id'), True),
+    ('channels_discord_id', 'channels', ('discord_id',), False),
+    ('cogs_name', 'cogs', ('name',), True),
+    ('audit_log_user', 'audit_log', ('user_id', 'guild_id', 'action', 'time'), False),
+    ('audit_log_guild', 'audit_log', ('guild_id', 'time'), False),
+    ('audit_log_channel', 'audit_log', ('channel_id',), False),
+    ('audit_log_time', 'audit_log', ('time',), False),
+    ('auto_mod_config_guild', 'auto_mod_config', ('guild_id',), True),
+    ('auto_mod_custom_config_config', 'auto_mod_custom_config', ('config_id',), False),
+    ('games_channel', 'games', ('channel_id',), False),
+    ('game_players_game', 'game_players', ('game_id', 'player_id'), False),
+    ('embeds_user', 'embeds', ('user_id', 'name'), False),
+    ('embed_fields_embed', 'embed_fields', ('embed_id',), False),
+    ('member_count_history_guild', 'member_count_history', ('guild_id', 'time'), False),
+)
+
+# Tables whose duplicate rows can be folded into the oldest one when their
+# unique key is added, {table: [(table, column) referencing it]}. Users,
+# guilds and channels are referenced from too many places to merge safely.
+MERGEABLE = {
+    'auto_mod_config': [('auto_mod_custom_config', 'config_id')],
+}
+
+ROLLUP_TABLES = (
+    "CREATE TABLE IF NOT EXISTS member_count_rollups ("
+    "guild_id INT NOT NULL, "
+    "resolution INT NOT NULL, "
+    "time DATETIME NOT NULL, "
+    "min_count INT NOT NULL, "
+    "max_count INT NOT NULL, "
+    "total BIGINT NOT NULL, "
+    "points INT NOT NULL, "
+    "last_count INT NOT NULL, "
+    "PRIMARY KEY (guild_id, resolution, time))",
+
+    "CREATE TABLE IF NOT EXISTS log_retention ("
+    "guild_id INT NOT NULL PRIMARY KEY, "
+    "days INT NULL)",
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: callable  # Takes the database, safe to run again if it stopped part way
+    tables: tuple = ()  # CREATE TABLE statements it runs, checked by verify
+
+
+def _create_tables(tables: tuple):
+    def apply(db):
+        for table in tables:
+            db.execute(table.format(id=db.backend.id_column))
+
+    return apply
+
+
+def _create_indexes(db):
+    for name, table, columns, unique in INDEXES:
+        # A key made before migrations existed may have another name
+        if _find_index(db, table, columns, unique) is not None:
+            continue
+
+        if unique and duplicates(db, table, columns):
+            if table not in MERGEABLE:
+                # Left for verify to report, the rows need merging by hand
+                continue
+
+            _merge_duplicates(db, table, columns)
+
+        # An older index by this name that no longer fits, e.g. one made non-unique
+        if any(index[0] == name for index in db.indexes(table)):
+            db.execute(db.backend.drop_index(table, name))
+
+        db.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(columns)})")
+
+
+def duplicates(db, table: str, columns: tuple) -> int:
+    """Returns how many values of a would be unique key are held by more than one row
+
+    Args:
+        db (Database): [Database to check]
+        table (str): [Table of the key]
+        columns (tuple): [Columns of the key]
+
+    Returns:
+        int: [Duplicated values, 0 if the key can be added]
+    """
+
+    # Rows with a NULL in the key never clash
+    not_null = " AND ".join(f"{column} IS NOT NULL" for column in columns)
+
+    row = db.fetchone(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {not_null} "
+        f"GROUP BY {', '.join(columns)} HAVING COUNT(*) > 1) AS duplicated")
+
+    return row[0]
+
+
+def _merge_duplicates(db, table: str, columns: tuple):
+    references = MERGEABLE[table]
+    not_null = " AND ".join(f"{column} IS NOT NULL" for column in columns)
+
+    groups = db.fetchall(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE {not_null} "
+        f"GROUP BY {', '.join(columns)} HAVING COUNT(*) > 1")
+
+    for values in groups:
+        match = " AND ".join(f"{column} = %s" for column in columns)
+
+        with db.transaction():
+            ids = [row[0] for row in db.fetchall(
+                f"SELECT id FROM {table} WHERE {match} ORDER BY id", tuple(values))]
+
+            # The oldest row is kept and everything pointing at the others moves to it
+            kept, merged = ids[0], ids[1:]
+            placeholders = ", ".join(["%s"] * len(merged))
+
+            for reference, column in references:
+                db.execute(
+                    f"UPDATE {reference} SET {column} = %s WHERE {column} IN ({placeholders})",
+                    (kept, *merged))
+
+            db.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", merged)
+
+
+# Applied in order, new changes go at the end with the next version
+MIGRATIONS = (
+    Migration(1, "Create tables", _create_tables(TABLES), TABLES),
+    Migration(2, "Add unique keys and lookup indexes", _create_indexes),
+    Migration(3, "Create member count rollup and log retention tables", _create_tables(ROLLUP_TABLES),
+              ROLLUP_TABLES),
+)
+
+LATEST = MIGRATIONS[-1].version
+
+
+def version(db) -> int:
+    """Returns the schema version of a database
+
+    Args:
+        db (Database): [Database to check]
+
+    Returns:
+        int: [Last migration applied, 0 if none were]
+    """
+
+    if "schema_version" not in db.tables("schema_version"):
+        return 0
+
+    row = db.fetchone("SELECT MAX(version) FROM schema_version")
+
+    return row[0] or 0
+
+
+def migrate(db) -> list:
+    """Applies the migrations a database hasn't had yet, then adds back any
+    missing indexes
+
+    Args:
+        db (Database): [Database to migrate]
+
+    Returns:
+        list: [Versions applied]
+    """
+
+    db.execute(VERSION_TABLE)
+
+    current = version(db)
+    applied = []
+
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+
+        # Table and index changes commit on their own in MySQL, so each
+        # migration is recorded once it has fully run
+        migration.apply(db)
+
+        db.execute(
+            "INSERT INTO schema_version (version, description, applied) VALUES (%s, %s, %s)",
+            (migration.version, migration.description, datetime.datetime.now()))
+
+        applied.append(migration.version)
+
+    # Indexes dropped by hand since are put back
+    _create_indexes(db)
+
+    return applied
+
+
+def verify(db) -> list:
+    """Checks a database has every table and index the bot expects
+
+    Args:
+        db (Database): [Database to check]
+
+    Returns:
+        list: [Description of each problem, empty if there are none]
+    """
+
+    problems = []
+
+    current = version(db)
+    if current < LATEST:
+        problems.append(f"schema is at version {current}, the latest is {LATEST}")
+
+    # "CREATE TABLE IF NOT EXISTS name (..." of every table a migration creates
+    expected = [table.split()[5] for migration in MIGRATIONS for table in migration.tables]
+    missing = [table for table in expected if table not in db.tables(table)]
+
+    for table in missing:
+        problems.append(f"table {table} is missing")
+
+    for name, table, columns, unique in INDEXES:
+        if table in missing:
+            continue
+
+        if _find_index(db, table, columns, unique) is None:
+            kind = "unique key" if unique else "index"
+            problem = f"{kind} {name} on {table} ({', '.join(columns)}) is missing"
+
+            if unique:
+                duplicated = duplicates(db, table, columns)
+
+                if duplicated:
+                    problem += f", the table has {duplicated} duplicated keys to merge first"
+
+            problems.append(problem)
+
+    return problems
+
+
+def _find_index(db, table: str, columns: tuple, unique: bool) -> str:
+    for name, index_columns, index_unique in db.indexes(table):
+        # A unique key also serves lookups that only need an index
+        if index_columns == columns and (index_unique or not unique):
+            return name
+
+    return None
+
+
+if __name__ == "__main__":
+    from database import Database
+
+    # python schema.py migrate, or python schema.py verify
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+
+    if command not in ("migrate", "verify"):
+        sys.exit("Usage: python schema.py [migrate|verify]")
+
+    # Connecting migrates and prints any problems left
+    os.environ["DB_MIGRATE"] = "1" if command == "migrate" else "0"
+    db = Database.shared()
+
+    print(f"Schema version {version(db)} of {LATEST}")
+
+    sys.exit(1 if verify(db) else 0)
@@ -1,8 +1,7 @@
 from discord import Forbidden
 
-from exceptions import EntryNotFound
 from data import Data
-data = Data()  # Connect to database
+data = Data()  # Uses the shared connection pool
 
 
 def fetch_slash_enabled(client):
@@ -11,10 +10,8 @@ def fetch_slash_enabled(client):
     """
 
     for guild in client.guilds:
-        try:  # Make sure the guild is in the database
-            data.get_guild(guild.id)
-        except EntryNotFound:
-            data.add_guild(guild.id, guild.name)
+        # Make sure the guild is in the database
+        data.get_or_create_guild(guild.id, guild.name)
 
         try:
             # Try making initializing a slash command in the guild
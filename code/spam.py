@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class SpamTracker:
+    def __init__(self, window: float = 15, max_messages: int = 100):
+        """Tracks recent messages per user in memory to spot repeated messages
+
+        Each (guild, user) keeps the messages sent in the last window
+        seconds along with how many of the newest ones are identical, so a
+        check costs the same however long the history is.
+
+        Args:
+            window (float, optional): [Seconds a message is remembered]. Defaults to 15.
+            max_messages (int, optional): [Most messages remembered per user]. Defaults to 100.
+        """
+
+        self.window = window
+        self.max_messages = max_messages
+
+        # (guild id, user id): [deque of (time, hash, channel id, message id), streak]
+        self._history = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._history)
+
+    def add(self, guild_id: int, user_id: int, channel_id: int, message_id: int,
+            content: str, threshold: int) -> list:
+        """Records a message and checks if it completes a run of spam
+
+        Args:
+            guild_id (int): [discord id of the guild]
+            user_id (int): [discord id of the author]
+            channel_id (int): [discord id of the channel]
+            message_id (int): [discord id of the message]
+            content (str): [Message content]
+            threshold (int): [Identical messages in a row that count as spam, 0 to only record]
+
+        Returns:
+            list: [(channel id, message id) of every message in the run if it is spam, otherwise empty]
+        """
+
+        now = time.monotonic()
+        key = (guild_id, user_id)
+        digest = hash(content)
+
+        with self._lock:
+            self._evict(now)
+
+            entry = self._history.get(key)
+
+            if entry is None:
+                entry = [deque(maxlen=self.max_messages), 0]
+                self._history[key] = entry
+            else:
+                self._history.move_to_end(key)
+
+            messages = entry[0]
+
+            # Forget messages that fell out of the window
+            while messages and messages[0][0] < now - self.window:
+                messages.popleft()
+
+            if messages and messages[-1][1] == digest:
+                entry[1] = min(entry[1], len(messages)) + 1
+            else:
+                entry[1] = 1
+
+            messages.append((now, digest, channel_id, message_id))
+
+            if not threshold or entry[1] < threshold:
+                return []
+
+            spam = [(channel_id, message_id)
+                    for _, _, channel_id, message_id in list(messages)[-entry[1]:]]
+
+            # Start over so the same run isn't reported twice
+            del self._history[key]
+
+            return spam
+
+    def clear(self, guild_id: int = None, user_id: int = None):
+        """Forgets tracked messages
+
+        Args:
+            guild_id (int, optional): [Only forget this guild]. Defaults to None.
+            user_id (int, optional): [Only forget this user]. Defaults to None.
+        """
+
+        with self._lock:
+            if guild_id is None and user_id is None:
+                self._history.clear()
+                return
+
+            for key in list(self._history):
+                if guild_id in (None, key[0]) and user_id in (None, key[1]):
+                    del self._history[key]
+
+    def _evict(self, now: float):
+        # Least recently active users are at the front
+        while self._history:
+            key, (messages, _) = next(iter(self._history.items()))
+
+            if messages and messages[-1][0] >= now - self.window:
+                break
+
+            del self._history[key]